@@ -2,9 +2,9 @@ import gradio as gr
 import os
 import yaml
 from pathlib import Path
-import subprocess
 from glob import glob
 import numbers
+from slmlab.utils.jobs import JOB_TARGETS, get_job_manager
 
 # --- Data Functions ---
 
@@ -72,18 +72,46 @@ def save_train_params(use_case, keys, *values):
     return f"Training parameters for '{use_case}' saved."
 
 
-def train(use_case):
-    # (train function remains the same)
+# --- Background jobs ---
+
+jobs = get_job_manager()
+LOG_TAIL_LINES = 500  # lines kept in the log view; older ones stay in the job's log file
+
+def job_choices():
+    return [(f"{j.id} · {j.kind} · {j.use_case} · {j.status}", j.id) for j in jobs.jobs()]
+
+def job_rows():
+    return [[j["id"], j["kind"], j["use_case"], j["status"], j["elapsed_s"], j["returncode"]]
+            for j in (job.summary() for job in jobs.jobs())]
+
+def start_job(kind, use_case):
+    """Starts a prep/train/eval job in the background and selects it."""
     if not use_case:
-        return "Please select a use case first."
-    process = subprocess.Popen(["make", "train", f"USE_CASE={use_case}"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8')
-    output = ""
-    for line in iter(process.stdout.readline, ''):
-        output += line
-        yield output
-    process.stdout.close()
-    if process.wait() != 0:
-        yield output + "\n\nTraining failed"
+        return gr.update(), job_rows(), "Please select a use case first."
+    job = jobs.submit(kind, use_case)
+    return gr.update(choices=job_choices(), value=job.id), job_rows(), f"Started {kind} job {job.id} for '{use_case}'."
+
+def cancel_job(job_id):
+    if not job_id:
+        return job_rows(), "No job selected."
+    ok = jobs.cancel(job_id)
+    return job_rows(), f"Job {job_id} cancelled." if ok else f"Job {job_id} is not running."
+
+def follow_job(job_id, follow):
+    """
+    Appends the selected job's new log lines (read from the last byte offset)
+    to a bounded tail; leaves the log box untouched when nothing is new.
+    """
+    if not job_id:
+        return gr.update(), follow
+    if not follow or follow.get("job") != job_id:
+        follow = {"job": job_id, "offset": 0, "tail": ""}
+    text, follow["offset"] = jobs.read_log(job_id, follow["offset"])
+    if not text and follow["offset"]:
+        return gr.update(), follow
+    lines = (follow["tail"] + text).splitlines(keepends=True)
+    follow["tail"] = "".join(lines[-LOG_TAIL_LINES:])
+    return follow["tail"], follow
 
 # --- App Initialization & UI Generation ---
 available_use_cases = get_use_cases()
@@ -117,9 +145,18 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
         save_file_button = gr.Button("Save Active YAML File", visible=False)
 
     with gr.Row():
-        train_button = gr.Button("Train Use Case")
+        job_kind = gr.Radio(choices=list(JOB_TARGETS), value="train", label="Job")
+        start_job_button = gr.Button("Start Job")
+        cancel_job_button = gr.Button("Cancel Selected Job")
+
+    output_log = gr.Textbox(label="Log Output", lines=3, interactive=False)
 
-    output_log = gr.Textbox(label="Log Output", lines=15, interactive=False)
+    job_table = gr.Dataframe(headers=["id", "kind", "use case", "status", "elapsed (s)", "exit code"],
+                             value=job_rows, interactive=False, label="Jobs")
+    job_selector = gr.Dropdown(choices=job_choices(), label="Follow Job")
+    job_log = gr.Textbox(label="Job Log", lines=15, max_lines=30, interactive=False, autoscroll=True)
+    job_follow_state = gr.State(None)
+    job_timer = gr.Timer(1.0)
 
     # --- UI Generation and Event Handlers ---
 
@@ -224,8 +261,15 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
         outputs=output_log
     )
 
+    # Wire up jobs: several can run at once (SLMLAB_MAX_JOBS); the timer only ships new log lines
+    start_job_button.click(fn=start_job, inputs=[job_kind, use_case_dropdown],
+                           outputs=[job_selector, job_table, output_log])
+    cancel_job_button.click(fn=cancel_job, inputs=job_selector, outputs=[job_table, output_log])
+    job_selector.change(fn=follow_job, inputs=[job_selector, gr.State(None)], outputs=[job_log, job_follow_state])
+    job_timer.tick(fn=follow_job, inputs=[job_selector, job_follow_state], outputs=[job_log, job_follow_state])
+    job_timer.tick(fn=job_rows, inputs=[], outputs=job_table)
+
     # Wire up other buttons
-    train_button.click(fn=train, inputs=use_case_dropdown, outputs=output_log)
     refresh_button.click(
         fn=lambda: (gr.update(choices=get_use_cases(), value=get_use_cases()[0] if get_use_cases() else None)),
         inputs=[], # Changed from None to []
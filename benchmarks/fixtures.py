@@ -0,0 +1,68 @@
+import json
+import random
+from pathlib import Path
+from typing import Dict, List
+
+_TITLES = ["La recherche", "Introduction à la physique", "Histoire de France", "Le temps retrouvé",
+           "Traité de chimie", "Les misérables", "Éléments de géométrie", "Voyage au centre de la Terre"]
+_AUTHORS = ["Marie Curie", "Albert Einstein", "Niels Bohr", "Victor Hugo", "Jules Verne", "Marcel Proust"]
+
+
+def synthetic_rows(n: int, seed: int = 0) -> List[Dict[str, str]]:
+    """Raw rows shaped like the unimarc source: free-text metadata + a UNIMARC record."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        title = f"{rng.choice(_TITLES)} {i}"
+        authors = rng.sample(_AUTHORS, rng.randint(1, 3))
+        year = str(rng.randint(1800, 2024))
+        metadata = f"Title: {title}\nAuthors: {'; '.join(authors)}\nDate: {year}"
+        fields = [f'<datafield tag="200"><subfield code="a">{title}</subfield></datafield>']
+        fields += [f'<datafield tag="700"><subfield code="a">{a}</subfield></datafield>' for a in authors]
+        fields.append(f'<datafield tag="210"><subfield code="d">{year}</subfield></datafield>')
+        rows.append({"id": str(i), "metadata": metadata, "unimarc_record": "<record>" + "".join(fields) + "</record>"})
+    return rows
+
+
+def build_tiny_model(out_dir: str | Path, seed: int = 0) -> Path:
+    """
+    Writes a randomly initialised 2-layer Llama and a byte-level BPE tokenizer
+    trained on synthetic records to `out_dir` (reused when already there).
+    Everything is built locally, so benchmarks need no network.
+    """
+    out = Path(out_dir)
+    if (out / "config.json").exists() and (out / "tokenizer.json").exists():
+        return out
+
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    corpus = [r["metadata"] + "\n" + r["unimarc_record"] for r in synthetic_rows(500, seed)]
+    bpe = Tokenizer(models.BPE(unk_token="<unk>"))
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    bpe.train_from_iterator(corpus, trainers.BpeTrainer(
+        vocab_size=1024, special_tokens=["<unk>", "<s>", "</s>", "<pad>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet()))
+    tok = PreTrainedTokenizerFast(tokenizer_object=bpe, bos_token="<s>", eos_token="</s>",
+                                  unk_token="<unk>", pad_token="<pad>")
+
+    torch.manual_seed(seed)
+    cfg = LlamaConfig(vocab_size=len(tok), hidden_size=128, intermediate_size=256, num_hidden_layers=2,
+                      num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=2048,
+                      bos_token_id=tok.bos_token_id, eos_token_id=tok.eos_token_id,
+                      pad_token_id=tok.pad_token_id)
+    out.mkdir(parents=True, exist_ok=True)
+    LlamaForCausalLM(cfg).save_pretrained(out)
+    tok.save_pretrained(out)
+    return out
+
+
+def write_jsonl(rows: List[dict], path: str | Path) -> Path:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        for r in rows:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    return path
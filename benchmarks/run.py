@@ -0,0 +1,234 @@
+import json
+import math
+import os
+import platform
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Annotated, Callable, Dict, List, Optional
+
+import typer
+
+from benchmarks.fixtures import build_tiny_model, synthetic_rows
+
+app = typer.Typer()
+
+DEFAULT_BASELINE = Path("benchmarks/baseline.json")
+DEFAULT_OUT = Path("benchmarks/results/latest.json")
+MODEL_DIR = Path("artifacts/bench/tiny-llama")
+
+
+def _percentile(xs: List[float], p: float) -> float:
+    s = sorted(xs)
+    return s[max(0, math.ceil(p * len(s)) - 1)]
+
+
+def _machine() -> dict:
+    import torch
+    import transformers
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+# ---- benchmarks: setup() returns a step() that does the work and returns the items it processed ----
+
+def _bench_templating(ctx) -> Callable[[], int]:
+    from cli.io import _init_worker, _template_chunk, hash_split
+
+    rows = synthetic_rows(20000)
+    _init_worker(ctx.cfg)
+
+    def step():
+        chunk = [(hash_split(r["id"], 0.2), r) for r in rows]
+        return len(_template_chunk(chunk))
+    return step
+
+
+def _bench_tokenization(ctx) -> Callable[[], int]:
+    from datasets import Dataset
+    from slmlab.prep.tokenization import make_tokenize_fn
+
+    ds = Dataset.from_list(ctx.examples)
+    tok_fn = make_tokenize_fn(ctx.tok, "base", 1024)
+
+    def step():
+        ds.map(tok_fn, batched=True, remove_columns=ds.column_names, load_from_cache_file=False)
+        return len(ds)
+    return step
+
+
+def _bench_sft_steps(ctx) -> Callable[[], int]:
+    from datasets import Dataset, DatasetDict
+    from slmlab.prep.tokenization import make_tokenize_fn
+    from slmlab.train.sft_lora import train
+
+    tok_fn = make_tokenize_fn(ctx.tok, "base", 1024)
+    ds = Dataset.from_list(ctx.examples[:256])
+    ds = DatasetDict(train=ds.map(tok_fn, batched=True, remove_columns=ds.column_names))
+    steps, bs = 5, 8
+    cfg = SimpleNamespace(
+        seed=42,
+        model=SimpleNamespace(name=str(ctx.model_dir), trust_remote_code=False),
+        method=ctx.cfg.method,
+        train=SimpleNamespace(max_steps=steps, per_device_train_batch_size=bs, gradient_accumulation_steps=1,
+                              lr=2e-4, logging_steps=1000, save_steps=10**6, eval_steps=10**6,
+                              bf16=False, fp16=False, gradient_checkpointing=False),
+    )
+
+    def step():
+        with tempfile.TemporaryDirectory() as out:
+            train(cfg, ds, out)
+        return steps * bs
+    return step
+
+
+def _bench_generate(ctx) -> Callable[[], int]:
+    from slmlab.eval.runner import _generate
+
+    prompts = [ex["prompt"] for ex in ctx.examples[:32]]
+
+    def step():
+        _, stats = _generate(str(ctx.model_dir), prompts, max_new_tokens=32, batch_size=8)
+        return stats.generated_tokens
+    return step
+
+
+def _bench_xml_metrics(ctx) -> Callable[[], int]:
+    from slmlab.eval.xml_eval import ReferenceSet, score_xml
+
+    refs = [ex["label"] for ex in ctx.examples]
+    # Some predictions lose a field, some are truncated (not well-formed)
+    preds = [r.replace('<datafield tag="210">', '<datafield tag="214">') if i % 3 == 0 else
+             r[:len(r) // 2] if i % 7 == 0 else r for i, r in enumerate(refs)]
+
+    def step():
+        score_xml(preds, ReferenceSet(refs))
+        return len(preds)
+    return step
+
+
+BENCHMARKS: Dict[str, tuple] = {
+    # name: (setup, unit)
+    "templating": (_bench_templating, "rows"),
+    "tokenization": (_bench_tokenization, "examples"),
+    "sft_steps": (_bench_sft_steps, "examples"),
+    "generate": (_bench_generate, "tokens"),
+    "xml_metrics": (_bench_xml_metrics, "documents"),
+}
+
+
+def _context(use_case: str):
+    from transformers import AutoTokenizer
+    from cli.io import _init_worker, _template_chunk
+    from slmlab.utils.config import load_config
+
+    cfg = load_config(use_case)
+    model_dir = build_tiny_model(MODEL_DIR)
+    _init_worker(cfg)
+    examples = [json.loads(line) for _, line in _template_chunk([(False, r) for r in synthetic_rows(5000)])]
+    return SimpleNamespace(cfg=cfg, model_dir=model_dir, tok=AutoTokenizer.from_pretrained(model_dir),
+                           examples=examples)
+
+
+def run_benchmark(name: str, ctx, repeats: int) -> dict:
+    setup, unit = BENCHMARKS[name]
+    step = setup(ctx)
+    step()  # warm-up: imports, model load, allocator
+    times, items = [], 0
+    for _ in range(repeats):
+        t = time.perf_counter()
+        items = step()
+        times.append(time.perf_counter() - t)
+    p50 = _percentile(times, 0.5)
+    return {
+        "unit": unit,
+        "items": items,
+        "repeats": repeats,
+        "p50_s": round(p50, 6),
+        "p95_s": round(_percentile(times, 0.95), 6),
+        "mean_s": round(sum(times) / len(times), 6),
+        "throughput": round(items / p50, 2) if p50 > 0 else None,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[dict]:
+    """Per benchmark p50 ratio to the baseline; ratios above 1 + tolerance are regressions."""
+    rows = []
+    for name, cur in current["benchmarks"].items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if not base or not base.get("p50_s"):
+            continue
+        ratio = cur["p50_s"] / base["p50_s"]
+        rows.append({"name": name, "baseline_p50_s": base["p50_s"], "p50_s": cur["p50_s"],
+                     "ratio": round(ratio, 3), "regression": ratio > 1 + tolerance})
+    return rows
+
+
+@app.command()
+def run(use_case: Annotated[str, typer.Option(help="Use case whose templating/method config is benchmarked.")] = "unimarc",
+        only: Annotated[Optional[str], typer.Option(help="Comma-separated subset of: " + ", ".join(BENCHMARKS))] = None,
+        repeats: Annotated[int, typer.Option(help="Timed repetitions per benchmark (after one warm-up).")] = 5,
+        threads: Annotated[int, typer.Option(help="torch intra-op threads, fixed for comparable numbers.")] = min(4, os.cpu_count() or 1),
+        out: Annotated[Path, typer.Option(help="Where to write this run's results.")] = DEFAULT_OUT,
+        baseline: Annotated[Path, typer.Option(help="Stored results to compare against.")] = DEFAULT_BASELINE,
+        tolerance: Annotated[float, typer.Option(help="Allowed p50 slowdown before a benchmark is flagged (0.2 = 20%).")] = 0.2,
+        save_baseline: Annotated[bool, typer.Option(help="Store this run as the new baseline.")] = False,
+        fail_on_regression: Annotated[bool, typer.Option(help="Exit non-zero when a regression is flagged.")] = False):
+    """Times prep, tokenization, training steps, generation and metrics on a tiny local model."""
+    import random
+
+    import numpy as np
+    import torch
+
+    torch.set_num_threads(threads)
+    random.seed(0)
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    names = [n.strip() for n in only.split(",")] if only else list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise typer.BadParameter(f"Unknown benchmarks: {sorted(unknown)}")
+
+    ctx = _context(use_case)
+    results = {"machine": _machine(), "benchmarks": {}}
+    for name in names:
+        typer.echo(f"[bench] {name}…")
+        results["benchmarks"][name] = run_benchmark(name, ctx, repeats)
+
+    if baseline.exists():
+        base = json.loads(baseline.read_text())
+        if base.get("machine") != results["machine"]:
+            typer.echo(f"[bench] note: {baseline} was recorded on a different machine/software stack")
+        results["comparison"] = compare(results, base, tolerance)
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2))
+
+    typer.echo(f"\n{'benchmark':<14}{'p50 (s)':>10}{'p95 (s)':>10}{'throughput':>23}{'vs baseline':>14}")
+    by_name = {c["name"]: c for c in results.get("comparison", [])}
+    for name, r in results["benchmarks"].items():
+        c = by_name.get(name)
+        vs = f"{c['ratio']:.2f}x{' REGRESSION' if c['regression'] else ''}" if c else "-"
+        typer.echo(f"{name:<14}{r['p50_s']:>10.3f}{r['p95_s']:>10.3f}{r['throughput']:>12.1f} {r['unit']:<10}{vs:>14}")
+    typer.echo(f"Results saved to {out}")
+
+    if save_baseline:
+        baseline.parent.mkdir(parents=True, exist_ok=True)
+        baseline.write_text(json.dumps({k: results[k] for k in ("machine", "benchmarks")}, indent=2))
+        typer.echo(f"Baseline saved to {baseline}")
+
+    if fail_on_regression and any(c["regression"] for c in results.get("comparison", [])):
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
@@ -1,16 +1,180 @@
-import json, typer
+import json, logging, typer
 from pathlib import Path
+from typing import Annotated, Optional
+from slmlab.eval.decode_report import decode_report
+from slmlab.eval.golden import load_suites, run_golden
+from slmlab.eval.quant_report import DEFAULT_VARIANTS, quant_report
 from slmlab.eval.runner import evaluate_models
+from slmlab.inference.quantize import QUANT_MODES
+from slmlab.inference.speculative import SPECULATIVE_MODES, make_speculator
+from slmlab.inference.xml_constraint import CONSTRAINTS
+from slmlab.prep.templating import template_prefix
+from slmlab.utils.config import load_config
+from slmlab.utils.profiling import profile_run
 
 app = typer.Typer()
 
+QUANT_HELP = f"Weight-only quantization of the tuned model on CPU: {' | '.join(QUANT_MODES)} (default: the use case's inference.quant)."
+
+
+def _default_model(cfg, use_case_dir: Path) -> str:
+    adapter = use_case_dir / str(getattr(cfg.paths, "out", "runs/")) / "adapter"
+    return str(adapter) if adapter.exists() else cfg.model.name
+
+
+def _quant(cfg, quant: Optional[str]) -> Optional[str]:
+    if quant is None and cfg is not None:
+        quant = getattr(getattr(cfg, "inference", None), "quant", None)
+    return None if quant in (None, "none") else quant
+
+
+def _speculator(cfg, mode: Optional[str], num_draft: Optional[int], draft_model: Optional[str]):
+    inference = getattr(cfg, "inference", None) if cfg is not None else None
+    return make_speculator(mode or getattr(inference, "speculative", None),
+                           num_draft=num_draft or getattr(inference, "num_draft_tokens", 10),
+                           draft_model=draft_model or getattr(inference, "draft_model", None))
+
+def _prefix(cfg) -> Optional[str]:
+    # Opt-in: only attention-only models can reuse the prefix key/values (see inference.prefix_cache)
+    if cfg is None or not getattr(getattr(cfg, "inference", None), "prefix_cache", False):
+        return None
+    return template_prefix(cfg) or None
+
+def _constrain(cfg, constrain: Optional[str]) -> Optional[str]:
+    if constrain is None and cfg is not None:
+        constrain = getattr(getattr(cfg, "inference", None), "constrain", None)
+    return None if constrain in (None, "none") else constrain
+
+SPEC_HELP = f"Speculative decoding: {' | '.join(SPECULATIVE_MODES)} (default: the use case's inference.speculative)."
+CONSTRAIN_HELP = f"Constrained decoding: {' | '.join(CONSTRAINTS)}; xml keeps outputs well-formed and stops at the closing root tag (default: the use case's inference.constrain)."
+
+
 @app.command()
-def run(baseline: str, tuned: str, eval_path: Path = Path("data/eval/heldout.jsonl")):
-    report = evaluate_models(baseline, tuned, eval_path)
+def run(baseline: str, tuned: str, eval_path: Path = Path("data/eval/heldout.jsonl"),
+        batch_size: Annotated[int, typer.Option(help="Prompts per generation batch; tune per machine using the reported tok/s.")] = 8,
+        use_case: Annotated[Optional[str], typer.Option(help="Use case whose inference settings apply (prefix_cache, quant, speculative, constrain).")] = None,
+        no_cache: Annotated[bool, typer.Option("--no-cache", help="Regenerate every prediction instead of reusing/persisting them.")] = False,
+        cache_dir: Annotated[Optional[Path], typer.Option(help="Prediction cache dir (default: $SLMLAB_PRED_CACHE or artifacts/predictions).")] = None,
+        quant: Annotated[Optional[str], typer.Option(help=QUANT_HELP)] = None,
+        speculative: Annotated[Optional[str], typer.Option(help=SPEC_HELP)] = None,
+        num_draft_tokens: Annotated[Optional[int], typer.Option(help="Tokens drafted per verification pass.")] = None,
+        draft_model: Annotated[Optional[str], typer.Option(help="Draft model for --speculative draft.")] = None,
+        constrain: Annotated[Optional[str], typer.Option(help=CONSTRAIN_HELP)] = None,
+        profile: Annotated[Optional[str], typer.Option(help="Stages to run under cProfile (comma-separated names or 'all'; default: $SLMLAB_PROFILE).")] = None):
+    cfg = load_config(use_case) if use_case else None
+    prefix = _prefix(cfg)
     out = Path("runs/report.json")
+    with profile_run(out.parent, profile):
+        report = evaluate_models(baseline, tuned, eval_path, batch_size=batch_size, prefix=prefix,
+                                 use_cache=not no_cache, cache_dir=cache_dir, quant=_quant(cfg, quant),
+                                 speculative=_speculator(cfg, speculative, num_draft_tokens, draft_model),
+                                 constrain=_constrain(cfg, constrain))
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+    typer.echo(f"Report saved to {out}")
+
+@app.command()
+def golden(use_case: str,
+           model: Annotated[Optional[str], typer.Option(help="Model or adapter to test (default: the use case's runs/adapter, else its base model).")] = None,
+           batch_size: Annotated[int, typer.Option(help="Prompts per generation batch.")] = 8,
+           max_new_tokens: Annotated[int, typer.Option(help="Generation budget per test.")] = 512,
+           quant: Annotated[Optional[str], typer.Option(help=QUANT_HELP)] = None,
+           constrain: Annotated[Optional[str], typer.Option(help=CONSTRAIN_HELP)] = None):
+    """Runs the use case's golden-test suites; exits non-zero if any test fails."""
+    cfg = load_config(use_case)
+    use_case_dir = Path(f"use_cases/{use_case}")
+    model = model or _default_model(cfg, use_case_dir)
+
+    tests = load_suites(use_case_dir)
+    if not tests:
+        raise typer.BadParameter(f"No golden tests under {use_case_dir / 'data/eval'}")
+    report = run_golden(model, tests, batch_size=batch_size, max_new_tokens=max_new_tokens,
+                        prefix=_prefix(cfg), quant=_quant(cfg, quant), constrain=_constrain(cfg, constrain))
+
+    for t in report["tests"]:
+        status = "PASS" if t["passed"] else "FAIL"
+        typer.echo(f"{status}  {t['suite']}/{t['name']}  {t['latency_s']:.2f}s  {t['new_tokens']} tokens")
+        for failure in t["failures"]:
+            typer.echo(f"      - {failure}")
+    out = use_case_dir / "runs" / "golden_report.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+    typer.echo(f"{report['passed']}/{len(tests)} passed ({model}); report saved to {out}")
+    if report["failed"]:
+        raise typer.Exit(1)
+
+@app.command("quant-report")
+def quant_report_cmd(use_case: str,
+                     model: Annotated[Optional[str], typer.Option(help="Model or adapter to compare (default: the use case's runs/adapter, else its base model).")] = None,
+                     eval_path: Annotated[Optional[Path], typer.Option(help="Held-out JSONL (default: the use case's paths.eval).")] = None,
+                     variants: Annotated[str, typer.Option(help="Comma-separated precisions to compare; 'none' is fp32.")] = ",".join(DEFAULT_VARIANTS),
+                     batch_size: Annotated[int, typer.Option(help="Prompts per generation batch.")] = 8,
+                     max_new_tokens: Annotated[int, typer.Option(help="Generation budget per prompt.")] = 256,
+                     limit: Annotated[Optional[int], typer.Option(help="Only the first N held-out examples.")] = None,
+                     threads: Annotated[Optional[int], typer.Option(help="torch intra-op threads per variant, fixed for comparable tok/s.")] = None,
+                     constrain: Annotated[Optional[str], typer.Option(help=CONSTRAIN_HELP)] = None):
+    """Runs the held-out set through fp32 and quantized variants and compares speed, memory and XML quality."""
+    cfg = load_config(use_case)
+    use_case_dir = Path(f"use_cases/{use_case}")
+    model = model or _default_model(cfg, use_case_dir)
+    eval_path = eval_path or use_case_dir / cfg.paths.eval
+    names = [v.strip() for v in variants.split(",") if v.strip()]
+    unknown = set(names) - set(QUANT_MODES) - {"fp32"}
+    if unknown:
+        raise typer.BadParameter(f"Unknown variants: {sorted(unknown)} (expected {', '.join(QUANT_MODES)})")
+
+    out = use_case_dir / "runs" / "quant_report.json"
+    with profile_run(out.parent):
+        report = quant_report(model, eval_path, names, batch_size=batch_size, max_new_tokens=max_new_tokens,
+                              prefix=_prefix(cfg), limit=limit, threads=threads,
+                              constrain=_constrain(cfg, constrain))
+
+    typer.echo(f"\n{'variant':<8}{'tok/s':>9}{'weights MiB':>13}{'peak RSS MiB':>14}{'xml_valid':>11}{'xml_cov':>9}{'= fp32':>8}")
+    for name, r in report["variants"].items():
+        if "error" in r:
+            typer.echo(f"{name:<8}  {r['error']}")
+            continue
+        typer.echo(f"{name:<8}{r['tokens_per_sec']:>9.1f}{r['weights_mb']:>13.1f}{r['peak_rss_mb']:>14.1f}"
+                   f"{r['xml_valid_rate']:>11.3f}{r['xml_coverage']:>9.3f}{r['same_as_reference']:>8.3f}")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+    typer.echo(f"Report saved to {out}")
+
+@app.command("decode-report")
+def decode_report_cmd(use_case: str,
+                      model: Annotated[Optional[str], typer.Option(help="Model or adapter to decode with (default: the use case's runs/adapter, else its base model).")] = None,
+                      eval_path: Annotated[Optional[Path], typer.Option(help="Held-out JSONL (default: the use case's paths.eval).")] = None,
+                      num_draft_tokens: Annotated[Optional[int], typer.Option(help="Tokens drafted per verification pass.")] = None,
+                      draft_model: Annotated[Optional[str], typer.Option(help="Also compare drafting with this small model.")] = None,
+                      batch_size: Annotated[int, typer.Option(help="Batch size of the batched greedy variant.")] = 8,
+                      max_new_tokens: Annotated[int, typer.Option(help="Generation budget per prompt.")] = 256,
+                      limit: Annotated[Optional[int], typer.Option(help="Only the first N held-out examples.")] = None,
+                      constrain: Annotated[Optional[str], typer.Option(help=CONSTRAIN_HELP)] = None):
+    """Compares greedy and speculative decoding: tok/s, acceptance rate, speedup and output equality."""
+    cfg = load_config(use_case)
+    use_case_dir = Path(f"use_cases/{use_case}")
+    model = model or _default_model(cfg, use_case_dir)
+    speculators = {"prompt_lookup": _speculator(cfg, "prompt_lookup", num_draft_tokens, None)}
+    draft_model = draft_model or getattr(getattr(cfg, "inference", None), "draft_model", None)
+    if draft_model:
+        speculators["draft"] = _speculator(cfg, "draft", num_draft_tokens, draft_model)
+
+    out = use_case_dir / "runs" / "decode_report.json"
+    with profile_run(out.parent):
+        report = decode_report(model, eval_path or use_case_dir / cfg.paths.eval, speculators, batch_size=batch_size,
+                               max_new_tokens=max_new_tokens, prefix=_prefix(cfg), limit=limit,
+                               constrain=_constrain(cfg, constrain))
+
+    typer.echo(f"\n{'variant':<15}{'tok/s':>9}{'s/prompt':>10}{'speedup':>9}{'accepted':>10}{'tok/pass':>10}{'= greedy':>10}")
+    for name, r in report["variants"].items():
+        acc = f"{r['acceptance_rate']:.1%}" if "acceptance_rate" in r else "-"
+        per_pass = f"{r['tokens_per_step']:.2f}" if "tokens_per_step" in r else "-"
+        typer.echo(f"{name:<15}{r['tokens_per_sec']:>9.1f}{r['seconds_per_prompt']:>10.3f}{r['speedup']:>8.2f}x"
+                   f"{acc:>10}{per_pass:>10}{r['same_as_greedy']:>10.3f}")
     out.parent.mkdir(parents=True, exist_ok=True)
     out.write_text(json.dumps(report, ensure_ascii=False, indent=2))
     typer.echo(f"Report saved to {out}")
 
 if __name__ == "__main__":
-    app()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format="[%(name)s] %(message)s")
+    app()
@@ -1,13 +1,25 @@
 # cli/finetune.py
+import logging
 import typer
 from pathlib import Path
+from typing import Annotated, Optional
 from datasets import load_dataset
 from transformers import AutoTokenizer
 from slmlab.utils.config import load_config
+from slmlab.prep import token_cache
+from slmlab.prep.tokenization import make_tokenize_fn
+from slmlab.utils.profiling import profile_run, stage
+from slmlab.eval.pred_cache import model_fingerprint
+from slmlab.train import cpt, distill
 from slmlab.train.sft_lora import train as train_sft_lora
 from slmlab.train.sft_unsloth import train as train_sft_unsloth
 
 app = typer.Typer()
+cache_app = typer.Typer(help="Inspect and prune the tokenized-dataset cache.")
+app.add_typer(cache_app, name="cache")
+
+# Bump when make_tokenize_fn changes the produced ids, so cached datasets are rebuilt
+TOKENIZE_VERSION = 2
 
 def _get(obj, key, default=None):
     """Safe get for dict or SimpleNamespace."""
@@ -16,43 +28,107 @@ def _get(obj, key, default=None):
     return getattr(obj, key, default)
 
 @app.command()
-def run(use_case: str):
+def run(use_case: str,
+        no_cache: Annotated[bool, typer.Option(help="Re-tokenize even if a cached dataset matches.")] = False,
+        profile: Annotated[Optional[str], typer.Option(help="Stages to run under cProfile (comma-separated names or 'all'; default: $SLMLAB_PROFILE).")] = None,
+        resume: Annotated[bool, typer.Option(help="cpt: continue from the latest checkpoint in <out>/cpt at its shard/offset; --no-resume removes them and starts over.")] = True):
     cfg = load_config(use_case)
 
     use_case_dir = Path(f"use_cases/{use_case}")
     outdir = use_case_dir / _get(_get(cfg, "paths"), "out")
     Path(outdir).mkdir(parents=True, exist_ok=True)
 
-    method = _get(_get(cfg, "method"), "method", "sft_lora")
+    with profile_run(outdir, profile):
+        _run(use_case, cfg, use_case_dir, outdir, no_cache, resume)
 
-    if method == "sft_lora":
-        # sft_lora expects a tokenized dataset
-        model_name = _get(_get(cfg, "model"), "name")
+def _tokenized(use_case, cfg, use_case_dir, no_cache):
+    """Tokenized train/eval splits (from the token cache unless `no_cache`) and their cache key."""
+    model_name = _get(_get(cfg, "model"), "name")
+    with stage("data.tokenizer_load"):
         tok = AutoTokenizer.from_pretrained(model_name, use_fast=True, trust_remote_code=True)
 
-        train_path = use_case_dir / _get(_get(cfg, "paths"), "train")
-        eval_path  = use_case_dir / _get(_get(cfg, "paths"), "eval")
+    train_path = use_case_dir / _get(_get(cfg, "paths"), "train")
+    eval_path  = use_case_dir / _get(_get(cfg, "paths"), "eval")
+    data_files = {"train": str(train_path), "eval": str(eval_path)}
+
+    mode   = _get(_get(cfg, "templating"), "mode", "base")
+    max_len = _get(_get(cfg, "train"), "max_length", 1024)
+    num_proc = _get(_get(cfg, "train"), "num_proc", 1)
 
-        ds = load_dataset("json", data_files={"train": str(train_path), "eval": str(eval_path)})
+    tok_fn = make_tokenize_fn(tok, mode, max_len)
 
-        mode   = _get(_get(cfg, "templating"), "mode", "base")
-        max_len = _get(_get(cfg, "train"), "max_length", 1024)
-        num_proc = _get(_get(cfg, "train"), "num_proc", 1)
+    def build():
+        with stage("data.load"):
+            ds = load_dataset("json", data_files=data_files)
+        cols = ds["train"].column_names
+        with stage("data.tokenize", items=sum(len(d) for d in ds.values())):
+            return ds.map(tok_fn, batched=True, num_proc=num_proc, remove_columns=cols)
 
-        if mode == "chat":
-            def tok_fn(batch):
-                msgs_list = batch["messages"]
-                txts = [tok.apply_chat_template(msgs, tokenize=False, add_generation_prompt=False) for msgs in msgs_list]
-                labels = [(msgs[-1]["content"] if msgs and msgs[-1].get("role") == "assistant" else "") for msgs in msgs_list]
-                return tok(txts, text_target=labels, truncation=True, max_length=max_len)
+    key = token_cache.dataset_fingerprint(data_files, tok, mode=mode, max_length=max_len,
+                                          version=TOKENIZE_VERSION)
+    with stage("data.prepare") as st:
+        if no_cache:
+            ds_tok = build()
         else:
-            def tok_fn(batch):
-                return tok(batch["prompt"], text_target=batch["label"], truncation=True, max_length=max_len)
+            meta = {"use_case": use_case, "model": model_name, "mode": mode, "max_length": max_len,
+                    "inputs": data_files}
+            ds_tok = token_cache.load_or_build(key, build, meta=meta)
+        st.items = sum(len(d) for d in ds_tok.values())
+    return tok, ds_tok, key
 
-        cols = ds["train"].column_names
-        ds_tok = ds.map(tok_fn, batched=True, num_proc=num_proc, remove_columns=cols)
+def _teacher_cache(use_case, cfg, tok, ds_tok, key):
+    """Builds (or reuses) the teacher's top-k logits over the training split."""
+    teacher_cfg = _get(_get(cfg, "method"), "teacher")
+    distill_cfg = _get(_get(cfg, "method"), "distill")
+    teacher = _get(teacher_cfg, "name")
+    if not teacher:
+        raise ValueError("method: distill needs teacher.name in the method config")
+    top_k = _get(distill_cfg, "top_k", 32)
+    temperature = _get(distill_cfg, "temperature", 1.0)
+    cache_key = distill.cache_key(key, model_fingerprint(teacher), top_k, temperature)
+    path = distill.build_teacher_cache(
+        ds_tok["train"], teacher, cache_key, tok, top_k=top_k, temperature=temperature,
+        batch_size=_get(teacher_cfg, "batch_size", 4), dtype=_get(teacher_cfg, "dtype"),
+        trust_remote_code=_get(teacher_cfg, "trust_remote_code", True), root=_get(distill_cfg, "cache_dir"),
+        meta={"use_case": use_case, "student": _get(_get(cfg, "model"), "name"), "dataset": key})
+    return distill.TeacherCache(path)
+
+def _corpus(use_case, cfg, use_case_dir):
+    """Tokenizes the method's raw corpus into token shards once; returns their directory."""
+    cpt_cfg = _get(_get(cfg, "method"), "cpt")
+    model_name = _get(_get(cfg, "model"), "name")
+    trust_remote_code = _get(_get(cfg, "model"), "trust_remote_code", True)
+    corpus = _get(cpt_cfg, "corpus")
+    if not corpus:
+        raise ValueError("method: cpt needs cpt.corpus (file globs, relative to the use-case dir)")
+    files = cpt.corpus_files([corpus] if isinstance(corpus, str) else corpus, use_case_dir)
+    with stage("data.tokenizer_load"):
+        tok = AutoTokenizer.from_pretrained(model_name, use_fast=True, trust_remote_code=trust_remote_code)
+    text_field = _get(cpt_cfg, "text_field")
+    shard_bytes = int(_get(cpt_cfg, "shard_mb", 256)) << 20
+    key = cpt.corpus_key(files, tok, text_field, shard_bytes)
+    return cpt.build_corpus(files, tok, model_name, key, text_field=text_field, shard_bytes=shard_bytes,
+                            num_proc=_get(cpt_cfg, "num_proc", 1), trust_remote_code=trust_remote_code,
+                            root=_get(cpt_cfg, "cache_dir"), meta={"use_case": use_case, "model": model_name})
+
+def _run(use_case, cfg, use_case_dir, outdir, no_cache, resume=True):
+    method = _get(_get(cfg, "method"), "method", "sft_lora")
 
-        train_sft_lora(cfg, ds_tok, outdir)
+    if method == "sft_lora":
+        # sft_lora expects a tokenized dataset
+        _, ds_tok, _ = _tokenized(use_case, cfg, use_case_dir, no_cache)
+        train_sft_lora(cfg, ds_tok, str(outdir))
+
+    elif method == "distill":
+        # teacher pass first (cached across student runs), then the student
+        tok, ds_tok, key = _tokenized(use_case, cfg, use_case_dir, no_cache)
+        cache = _teacher_cache(use_case, cfg, tok, ds_tok, key)
+        distill.train(cfg, ds_tok, str(outdir), cache)
+
+    elif method == "cpt":
+        # raw corpus tokenized once into token shards, trained on as fixed-length windows
+        # own output dir, so its checkpoints never mix with another method's
+        cpt.train(cfg, _corpus(use_case, cfg, use_case_dir), str(Path(outdir) / "cpt"), resume=resume)
 
     elif method == "unsloth":
         # unsloth handles its own data loading and tokenization
@@ -61,5 +137,44 @@ def run(use_case: str):
     else:
         raise ValueError(f"Unsupported method: {method}")
 
+@app.command("teacher-cache")
+def teacher_cache(use_case: str,
+                  no_cache: Annotated[bool, typer.Option(help="Re-tokenize even if a cached dataset matches.")] = False):
+    """Runs only the teacher pass of method: distill, filling the teacher-logit cache."""
+    cfg = load_config(use_case)
+    if _get(_get(cfg, "method"), "method") != "distill":
+        raise typer.BadParameter(f"use case {use_case} does not use method: distill")
+    tok, ds_tok, key = _tokenized(use_case, cfg, Path(f"use_cases/{use_case}"), no_cache)
+    cache = _teacher_cache(use_case, cfg, tok, ds_tok, key)
+    typer.echo(f"{cache.path}: {len(cache)} examples, {cache.meta['positions']} positions, top-{cache.top_k}")
+
+@app.command("tokenize-corpus")
+def tokenize_corpus(use_case: str):
+    """Runs only the corpus tokenization of method: cpt, filling the token-shard cache."""
+    cfg = load_config(use_case)
+    if _get(_get(cfg, "method"), "method") != "cpt":
+        raise typer.BadParameter(f"use case {use_case} does not use method: cpt")
+    path = _corpus(use_case, cfg, Path(f"use_cases/{use_case}"))
+    typer.echo(f"{path}: {len(cpt.TokenWindows(path, 1))} tokens")
+
+@cache_app.command("ls")
+def cache_ls(cache_dir: Optional[Path] = None):
+    """Lists cached tokenized datasets, most recently used first."""
+    entries = token_cache.list_entries(cache_dir)
+    for e in entries:
+        typer.echo(f"{e['key']}  {e['bytes'] / 2**20:8.1f} MiB  {e.get('use_case', '?')}  "
+                   f"{e.get('model', '?')}  mode={e.get('mode', '?')}  max_length={e.get('max_length', '?')}")
+    typer.echo(f"{len(entries)} entries, {sum(e['bytes'] for e in entries) / 2**20:.1f} MiB total")
+
+@cache_app.command("prune")
+def cache_prune(keep: Annotated[Optional[int], typer.Option(help="Keep the N most recently used entries.")] = None,
+                older_than_days: Annotated[Optional[float], typer.Option(help="Remove entries unused for this many days.")] = None,
+                dry_run: bool = False, cache_dir: Optional[Path] = None):
+    """Removes cached tokenized datasets (all of them when no filter is given)."""
+    removed = token_cache.prune(cache_dir, keep=keep, older_than_days=older_than_days, dry_run=dry_run)
+    verb = "Would remove" if dry_run else "Removed"
+    typer.echo(f"{verb} {len(removed)} entries ({sum(e['bytes'] for e in removed) / 2**20:.1f} MiB)")
+
 if __name__ == "__main__":
-    typer.run(run)
+    logging.basicConfig(level=logging.INFO, format="[%(name)s] %(message)s")
+    app()
@@ -1,20 +1,44 @@
+import hashlib
 import json
+import logging
+from collections import deque
+from multiprocessing import Pool
 from pathlib import Path
+from typing import Annotated, Optional
 import typer
 from datasets import load_dataset
 from slmlab.utils.config import load_config
+from slmlab.prep.dedup import MinHasher, MinHashIndex, dedup_text
 from slmlab.prep.templating import make_example
+from slmlab.utils.profiling import profile_run, stage
 
 app = typer.Typer()
 
+@app.callback()
+def main():
+    """Dataset preparation commands."""
+
 @app.command()
-def build_from_hf(use_case: str):
+def build_from_hf(use_case: str,
+                  stream: Annotated[bool, typer.Option(help="Constant-memory build: stream, hash-split and template rows in parallel workers.")] = False,
+                  num_proc: Annotated[Optional[int], typer.Option(help="Templating worker processes in --stream mode (default: data.num_proc or 1).")] = None,
+                  chunk_size: Annotated[int, typer.Option(help="Rows per worker task / write batch in --stream mode.")] = 1000,
+                  profile: Annotated[Optional[str], typer.Option(help="Stages to run under cProfile (comma-separated names or 'all'; default: $SLMLAB_PROFILE).")] = None):
     """
     Builds a dataset from a Hugging Face repository as defined
     in the use-case configuration.
     """
     cfg = load_config(use_case)
+    outdir = Path(f"use_cases/{use_case}") / getattr(cfg.paths, "out", "runs/")
+
+    with profile_run(outdir, profile):
+        if stream:
+            return _build_streaming(use_case, cfg, num_proc or getattr(cfg.data, "num_proc", 1), chunk_size)
+        _build(use_case, cfg)
+
 
+def _build(use_case, cfg):
+    """In-memory build: load the whole split, template and write it."""
     if not hasattr(cfg, "data") or not hasattr(cfg.data, "repo"):
         raise ValueError("data.repo not defined in the config.")
 
@@ -23,37 +47,215 @@ def build_from_hf(use_case: str):
     label_col = getattr(cfg.data, "label_col", "label")
     eval_ratio = getattr(cfg.data, "eval_ratio", 0.2)
 
-    ds = load_dataset(repo)["train"]
+    with stage("prep.load_dataset"):
+        ds = load_dataset(repo)["train"]
 
     # Filter rows that have all the required columns
     required_cols = prompt_cols + [label_col]
-    rows = [r for r in ds if all(c in r and r[c] for c in required_cols)]
-
-    n_eval = max(1, int(len(rows) * eval_ratio))
-    eval_rows, train_rows = rows[:n_eval], rows[n_eval:]
+    with stage("prep.filter", items=len(ds)):
+        rows = [r for r in ds if all(c in r and r[c] for c in required_cols)]
 
     use_case_dir = Path(f"use_cases/{use_case}")
+    index = _dedup_index(use_case_dir, cfg)
+    if index is not None:
+        # Hash-based split, as in --stream: stable across incremental builds,
+        # with near-duplicates dropped and similar rows kept on one side
+        with stage("prep.dedup", items=len(rows)):
+            n_rows = len(rows)
+            fields = _dedup_fields(cfg)
+            keys = [_row_key(r, cfg.data, prompt_cols) for r in rows]
+            seed = getattr(cfg, "seed", 42)
+            reps, is_eval = index.add(keys, [hash_split(k, eval_ratio, seed) for k in keys],
+                                      texts=[dedup_text(r, fields) for r in rows])
+            eval_rows = [r for r, rep, ev in zip(rows, reps, is_eval) if rep < 0 and ev]
+            train_rows = [r for r, rep, ev in zip(rows, reps, is_eval) if rep < 0 and not ev]
+            rows = eval_rows + train_rows
+            _finish_dedup(index, n_rows, use_case_dir, cfg)
+    else:
+        n_eval = max(1, int(len(rows) * eval_ratio))
+        eval_rows, train_rows = rows[:n_eval], rows[n_eval:]
+
     train_path = use_case_dir / cfg.paths.train
     eval_path = use_case_dir / cfg.paths.eval
 
     train_path.parent.mkdir(parents=True, exist_ok=True)
     eval_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with train_path.open("w", encoding="utf-8") as ftr:
-        for r in train_rows:
-            sample = {col: r[col] for col in prompt_cols}
-            sample["label"] = r[label_col]
-            ex = make_example(sample, cfg)
-            ftr.write(json.dumps(ex, ensure_ascii=False) + "\n")
+    with stage("prep.template_write", items=len(rows)):
+        with train_path.open("w", encoding="utf-8") as ftr:
+            for r in train_rows:
+                sample = {col: r[col] for col in prompt_cols}
+                sample["label"] = r[label_col]
+                ex = make_example(sample, cfg)
+                ftr.write(json.dumps(ex, ensure_ascii=False) + "\n")
 
-    with eval_path.open("w", encoding="utf-8") as fev:
-        for r in eval_rows:
-            sample = {col: r[col] for col in prompt_cols}
-            sample["label"] = r[label_col]
-            ex = make_example(sample, cfg)
-            fev.write(json.dumps(ex, ensure_ascii=False) + "\n")
+        with eval_path.open("w", encoding="utf-8") as fev:
+            for r in eval_rows:
+                sample = {col: r[col] for col in prompt_cols}
+                sample["label"] = r[label_col]
+                ex = make_example(sample, cfg)
+                fev.write(json.dumps(ex, ensure_ascii=False) + "\n")
 
     typer.echo(f"Wrote {len(train_rows)} train and {len(eval_rows)} eval examples for use-case '{use_case}'.")
 
+
+# ---- streaming build ----
+
+def _stream_rows(data_cfg):
+    """Yields raw rows one at a time from the configured source (hf | jsonl | parquet)."""
+    source = getattr(data_cfg, "source", "hf")
+    if source == "hf":
+        ds = load_dataset(data_cfg.repo, split="train", streaming=True)
+    elif source in ("jsonl", "json", "parquet"):
+        path = getattr(data_cfg, "path", None)
+        if not path:
+            raise ValueError(f"data.path is required for data.source '{source}'.")
+        builder = "parquet" if source == "parquet" else "json"
+        ds = load_dataset(builder, data_files=path, split="train", streaming=True)
+    else:
+        raise ValueError(f"Unsupported data.source: {source}")
+    yield from ds
+
+
+def _row_key(row, data_cfg, prompt_cols):
+    key_col = getattr(data_cfg, "key_col", None)
+    if key_col:
+        return str(row.get(key_col, ""))
+    return json.dumps([row[c] for c in prompt_cols], ensure_ascii=False, sort_keys=True, default=str)
+
+
+def _dedup_params(cfg) -> Optional[dict]:
+    """MinHash settings from data.dedup, or None when deduplication is off."""
+    d = getattr(cfg.data, "dedup", None)
+    if d is None or not getattr(d, "enabled", True):
+        return None
+    return {"threshold": getattr(d, "threshold", 0.85), "split_threshold": getattr(d, "split_threshold", 0.7),
+            "num_perm": getattr(d, "num_perm", 128),
+            "ngram": getattr(d, "ngram", 5), "seed": getattr(cfg, "seed", 42)}
+
+
+def _dedup_fields(cfg):
+    return getattr(cfg.data.dedup, "fields", None) or getattr(cfg.data, "prompt_cols", [])
+
+
+def _dedup_index(use_case_dir, cfg) -> Optional[MinHashIndex]:
+    params = _dedup_params(cfg)
+    if params is None:
+        return None
+    return MinHashIndex(use_case_dir / getattr(cfg.data.dedup, "index", "data/dedup_index"), **params)
+
+
+def _finish_dedup(index, n_rows, use_case_dir, cfg):
+    """Persists the index and writes the duplicate-cluster report."""
+    index.save()
+    report = index.report(n_rows)
+    out = use_case_dir / getattr(cfg.paths, "out", "runs/") / "dedup_report.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+    typer.echo(f"Dropped {report['duplicates']} near-duplicates of {report['rows']} rows "
+               f"({report['clusters']} clusters, threshold {report['threshold']}); report saved to {out}")
+
+
+def hash_split(key: str, eval_ratio: float, seed: int = 42) -> bool:
+    """True when `key` belongs to the eval split; stable across runs and machines."""
+    h = hashlib.sha1(f"{seed}:{key}".encode("utf-8")).digest()
+    return int.from_bytes(h[:8], "big") / 2**64 < eval_ratio
+
+
+_worker_cfg = None
+_worker_hasher = None
+
+def _init_worker(cfg):
+    global _worker_cfg, _worker_hasher
+    _worker_cfg = cfg
+    params = _dedup_params(cfg)
+    if params is not None:
+        params.pop("threshold")
+        params.pop("split_threshold")
+        _worker_hasher = MinHasher(**params)
+
+def _template_chunk(chunk):
+    """[(is_eval, key, row)] -> ([(is_eval, jsonl line)], MinHash signatures or None)"""
+    cfg = _worker_cfg
+    prompt_cols = getattr(cfg.data, "prompt_cols", [])
+    label_col = getattr(cfg.data, "label_col", "label")
+    out = []
+    for is_eval, _, r in chunk:
+        sample = {col: r[col] for col in prompt_cols}
+        sample["label"] = r[label_col]
+        out.append((is_eval, json.dumps(make_example(sample, cfg), ensure_ascii=False) + "\n"))
+    sigs = None
+    if _worker_hasher is not None:
+        fields = _dedup_fields(cfg)
+        sigs = _worker_hasher.signatures([dedup_text(r, fields) for _, _, r in chunk])
+    return out, sigs
+
+def _chunks(cfg, chunk_size):
+    data_cfg = cfg.data
+    prompt_cols = getattr(data_cfg, "prompt_cols", [])
+    required_cols = prompt_cols + [getattr(data_cfg, "label_col", "label")]
+    eval_ratio = getattr(data_cfg, "eval_ratio", 0.2)
+    seed = getattr(cfg, "seed", 42)
+
+    chunk = []
+    for r in _stream_rows(data_cfg):
+        if not all(c in r and r[c] for c in required_cols):
+            continue
+        key = _row_key(r, data_cfg, prompt_cols)
+        chunk.append((hash_split(key, eval_ratio, seed), key, r))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _build_streaming(use_case, cfg, num_proc, chunk_size):
+    use_case_dir = Path(f"use_cases/{use_case}")
+    train_path = use_case_dir / cfg.paths.train
+    eval_path = use_case_dir / cfg.paths.eval
+    train_path.parent.mkdir(parents=True, exist_ok=True)
+    eval_path.parent.mkdir(parents=True, exist_ok=True)
+
+    index = _dedup_index(use_case_dir, cfg)
+    n_train = n_eval = n_rows = 0
+    with stage("prep.stream_build") as st, \
+         train_path.open("w", encoding="utf-8", buffering=1 << 20) as ftr, \
+         eval_path.open("w", encoding="utf-8", buffering=1 << 20) as fev, \
+         Pool(max(1, num_proc), initializer=_init_worker, initargs=(cfg,)) as pool:
+
+        def write(keys, done):
+            nonlocal n_train, n_eval, n_rows
+            results, sigs = done
+            n_rows += len(results)
+            if index is not None:
+                # In stream order, in this process: the first of a cluster is kept,
+                # on whichever side of the split its own key hashes to
+                reps, is_eval = index.add(keys, [ev for ev, _ in results], sigs=sigs)
+                results = [(ev, line) for (_, line), rep, ev in zip(results, reps, is_eval) if rep < 0]
+            ev = [line for is_eval, line in results if is_eval]
+            fev.writelines(ev)
+            ftr.writelines(line for is_eval, line in results if not is_eval)
+            n_eval += len(ev)
+            n_train += len(results) - len(ev)
+
+        # Keep at most 2 chunks per worker in flight so memory stays bounded
+        # regardless of dataset size (Pool.imap would drain the whole stream).
+        pending = deque()
+        for chunk in _chunks(cfg, chunk_size):
+            pending.append(([key for _, key, _ in chunk], pool.apply_async(_template_chunk, (chunk,))))
+            if len(pending) >= 2 * max(1, num_proc):
+                keys, res = pending.popleft()
+                write(keys, res.get())
+        while pending:
+            keys, res = pending.popleft()
+            write(keys, res.get())
+        st.items = n_rows
+
+    if index is not None:
+        _finish_dedup(index, n_rows, use_case_dir, cfg)
+
+    typer.echo(f"Wrote {n_train} train and {n_eval} eval examples for use-case '{use_case}' (streaming).")
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(name)s] %(message)s")
     app()
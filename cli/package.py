@@ -0,0 +1,20 @@
+import logging
+import typer
+from pathlib import Path
+from typing import Optional
+from slmlab.postproc.merge import merge_adapter
+
+app = typer.Typer()
+
+@app.command()
+def merge(adapter: Path, base: Optional[str] = None, cache_dir: Optional[Path] = None):
+    """
+    Merges a LoRA adapter into its base model and stores the result in the
+    content-addressed artifact cache (reused on later loads).
+    """
+    out = merge_adapter(str(adapter), base=base, cache_dir=cache_dir)
+    typer.echo(f"Merged model available at {out}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(name)s] %(message)s")
+    app()
@@ -0,0 +1,35 @@
+import json
+from typing import Dict, Optional
+
+from slmlab.inference.speculative import Speculator
+from .metrics import exact_match
+from .runner import _generate
+
+
+def decode_report(model_name: str, eval_path, speculators: Dict[str, Speculator], batch_size: int = 8,
+                  max_new_tokens: int = 256, prefix: Optional[str] = None, limit: Optional[int] = None,
+                  constrain: Optional[str] = None) -> dict:
+    """
+    Decodes the same held-out prompts with batched greedy, one-at-a-time
+    greedy and each speculative variant, and reports speed, acceptance and
+    whether the outputs match greedy. Speedups are per-prompt latency
+    relative to one-at-a-time greedy, the serving case. Every variant decodes
+    with `constrain`, as served.
+    """
+    with open(eval_path, encoding="utf-8") as f:
+        prompts = [json.loads(l)["prompt"] for l in f][:limit]
+
+    variants = {"greedy": (batch_size, None), "greedy_bs1": (1, None)}
+    variants.update({name: (1, spec) for name, spec in speculators.items()})
+    rows, reference = {}, None
+    for name, (bs, spec) in variants.items():
+        outs, stats = _generate(model_name, prompts, max_new_tokens=max_new_tokens, batch_size=bs, prefix=prefix,
+                                speculative=spec, constrain=constrain)
+        reference = reference or outs
+        rows[name] = {**stats.to_dict(), "same_as_greedy": exact_match(outs, reference)}
+        rows[name]["seconds_per_prompt"] = round(stats.seconds / max(1, len(prompts)), 4)
+
+    base = rows["greedy_bs1"]["seconds"]
+    for r in rows.values():
+        r["speedup"] = round(base / r["seconds"], 2) if r["seconds"] > 0 else None
+    return {"model": model_name, "n": len(prompts), "max_new_tokens": max_new_tokens, "variants": rows}
@@ -0,0 +1,228 @@
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from slmlab.inference.engine import generate_batched
+from slmlab.inference.registry import load_model
+from slmlab.utils.config import load_yaml
+from .xml_eval import parse_xml
+
+_START_TAG = re.compile(r"^<\s*([\w:.-]+)((?:\s+[\w:.-]+\s*=\s*(?:\"[^\"]*\"|'[^']*'))*)\s*/?>$")
+_ATTR = re.compile(r"([\w:.-]+)\s*=\s*(?:\"([^\"]*)\"|'([^']*)')")
+
+
+@dataclass
+class GoldenTest:
+    suite: str
+    name: str
+    prompt: str
+    expect_xml: Optional[str] = None
+    expect_contains: List[str] = field(default_factory=list)
+    root: Optional[str] = None  # root element of the output, for expect_contains
+
+
+@dataclass
+class GoldenResult:
+    suite: str
+    name: str
+    passed: bool
+    failures: List[str]
+    latency_s: float
+    new_tokens: int
+    output: str
+
+
+def load_suites(use_case_dir: str | Path) -> List[GoldenTest]:
+    """
+    Every golden test defined in the YAML suites under `<use case>/data/eval/`.
+    A case's `root` names the output's root element, matched by
+    `expect_contains`; it defaults to the root of `expect_xml`.
+    """
+    tests = []
+    for path in sorted(Path(use_case_dir, "data", "eval").glob("*.y*ml")):
+        cases = load_yaml(path)
+        if not isinstance(cases, list):
+            continue
+        for i, case in enumerate(cases):
+            if not isinstance(case, dict) or "prompt" not in case:
+                continue
+            contains = case.get("expect_contains") or []
+            tests.append(GoldenTest(
+                suite=path.stem,
+                name=case.get("name", f"{path.stem}-{i}"),
+                prompt=case["prompt"],
+                expect_xml=case.get("expect_xml"),
+                expect_contains=[contains] if isinstance(contains, str) else list(contains),
+                root=case.get("root") or _root_tag(case.get("expect_xml")),
+            ))
+    return tests
+
+
+# ---- structural comparison ----
+
+def _norm(text: Optional[str]) -> str:
+    return " ".join((text or "").split())
+
+
+def _canon(el) -> Tuple:
+    """Order-insensitive form of an element: tag, attributes, text and children."""
+    children = [_canon(c) for c in el if isinstance(c.tag, str)]
+    return (el.tag, tuple(sorted(el.attrib.items())), _norm(el.text), tuple(sorted(children)))
+
+
+def _label(c: Tuple) -> str:
+    attrs = "".join(f' {k}="{v}"' for k, v in c[1])
+    return f"<{c[0]}{attrs}>" + (c[2] if c[2] else "")
+
+
+def _extract(output: str, root_tag: str) -> Optional[str]:
+    """The first `<root_tag ...>...</root_tag>` region of a model output."""
+    start = re.search(rf"<{re.escape(root_tag)}[\s>/]", output)
+    if not start:
+        return None
+    end = output.find(f"</{root_tag}>", start.start())
+    if end < 0:
+        return output[start.start():]
+    return output[start.start():end + len(root_tag) + 3]
+
+
+def check_xml(output: str, expected: str) -> List[str]:
+    """Differences between the XML in `output` and `expected`, ignoring sibling order and whitespace."""
+    want = parse_xml(expected.strip())
+    got_text = _extract(output, want.tag)
+    if got_text is None:
+        return [f"no <{want.tag}> element in output"]
+    try:
+        got = parse_xml(got_text)
+    except Exception as e:
+        return [f"output is not well-formed XML: {e}"]
+    w, g = _canon(want), _canon(got)
+    if w == g:
+        return []
+    if w[:3] != g[:3]:
+        return [f"root differs: expected {_label(w)}, got {_label(g)}"]
+    missing, extra = Counter(w[3]) - Counter(g[3]), Counter(g[3]) - Counter(w[3])
+    return ([f"missing {_describe(c)}" for c in missing.elements()]
+            + [f"unexpected {_describe(c)}" for c in extra.elements()])
+
+
+def _describe(c: Tuple) -> str:
+    inner = ", ".join(_describe(x) for x in c[3])
+    return _label(c) + (f" [{inner}]" if inner else "")
+
+
+def _matches(pattern: Tuple, el: Tuple) -> bool:
+    """True if `el` has the pattern's tag, at least its attributes and text, and matching children."""
+    tag, attrs, text, children = pattern
+    if el[0] != tag or not set(attrs) <= set(el[1]) or (text and text != el[2]):
+        return False
+    return all(any(_matches(p, c) for c in el[3]) for p in children)
+
+
+def _walk(c: Tuple):
+    yield c
+    for child in c[3]:
+        yield from _walk(child)
+
+
+def check_contains(output: str, fragment: str, tree: Optional[Tuple]) -> bool:
+    """
+    Whether `output` contains `fragment`: complete XML fragments are matched
+    against the elements of the parsed output, lone start tags (e.g.
+    `<datafield tag="200">`) against its start tags; other text, or outputs
+    that do not parse, fall back to a whitespace-insensitive substring check.
+    """
+    frag = fragment.strip()
+    start = _START_TAG.match(frag)
+    if start:
+        tag = start.group(1)
+        attrs = {k: dq or sq for k, dq, sq in _ATTR.findall(start.group(2))}
+        if tree is not None:
+            return any(c[0] == tag and set(attrs.items()) <= set(c[1]) for c in _walk(tree))
+        for m in re.finditer(rf"<\s*{re.escape(tag)}((?:\s+[^>]*)?)/?>", output):
+            found = {k: dq or sq for k, dq, sq in _ATTR.findall(m.group(1))}
+            if attrs.items() <= found.items():
+                return True
+        return False
+    if tree is not None and frag.startswith("<"):
+        try:
+            pattern = _canon(parse_xml(frag))
+        except Exception:
+            pattern = None
+        if pattern is not None:
+            return any(_matches(pattern, c) for c in _walk(tree))
+    return _norm(frag) in _norm(output)
+
+
+def _root_tag(xml: Optional[str]) -> Optional[str]:
+    m = re.match(r"\s*<\s*([\w:.-]+)", xml or "")
+    return m.group(1) if m else None
+
+
+def _output_tree(output: str, root: Optional[str]) -> Optional[Tuple]:
+    """The output's `<root>` element, or the whole output when no root is configured."""
+    region = _extract(output, root) if root else output.strip()
+    try:
+        return _canon(parse_xml(region)) if region else None
+    except Exception:
+        return None
+
+
+def check(test: GoldenTest, output: str) -> List[str]:
+    failures = []
+    if test.expect_xml:
+        failures += check_xml(output, test.expect_xml)
+    if test.expect_contains:
+        tree = _output_tree(output, test.root)
+        failures += [f"missing {frag!r}" for frag in test.expect_contains if not check_contains(output, frag, tree)]
+    return failures
+
+
+# ---- runner ----
+
+def run_golden(model_name: str, tests: List[GoldenTest], batch_size: int = 8, max_new_tokens: int = 512,
+               prefix: Optional[str] = None, quant: Optional[str] = None, constrain: Optional[str] = None) -> dict:
+    """
+    Generates every test prompt through one loaded model in length-bucketed
+    batches and checks the outputs. A test's latency is the wall time of the
+    batch it ran in.
+    """
+    mod, tok = load_model(model_name, quant=quant)
+    new_tokens = [0] * len(tests)
+    latency = [0.0] * len(tests)
+    # Results of a batch arrive back to back; the next token marks a new batch
+    clock = {"batch_start": time.perf_counter(), "last_result": None}
+
+    def on_token(i, _token_id):
+        new_tokens[i] += 1
+        if clock["last_result"] is not None:
+            clock["batch_start"], clock["last_result"] = clock["last_result"], None
+
+    def on_result(i, _text):
+        now = time.perf_counter()
+        latency[i] = now - clock["batch_start"]
+        clock["last_result"] = now
+
+    outs, stats = generate_batched(mod, tok, [t.prompt for t in tests], max_new_tokens=max_new_tokens,
+                                   batch_size=batch_size, return_full_text=False, on_token=on_token,
+                                   on_result=on_result, prefix=prefix, constrain=constrain)
+
+    results = []
+    for i, (test, out) in enumerate(zip(tests, outs)):
+        failures = check(test, out)
+        results.append(GoldenResult(test.suite, test.name, not failures, failures, round(latency[i], 3),
+                                    new_tokens[i], out))
+
+    passed = sum(r.passed for r in results)
+    return {
+        "model": model_name,
+        "quant": quant or "none",
+        "constrain": constrain or "none",
+        "passed": passed,
+        "failed": len(results) - passed,
+        "generation": stats.to_dict(),
+        "tests": [asdict(r) for r in results],
+    }
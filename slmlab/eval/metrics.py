@@ -0,0 +1,41 @@
+from typing import List, Optional
+
+
+def exact_match(preds: List[str], refs: List[str]) -> float:
+    if not refs:
+        return 0.0
+    return sum(p.strip() == r.strip() for p, r in zip(preds, refs)) / len(refs)
+
+
+def _lcs(a: List[str], b: List[str]) -> int:
+    prev = [0] * (len(b) + 1)
+    for x in a:
+        cur = [0]
+        for j, y in enumerate(b):
+            cur.append(prev[j] + 1 if x == y else max(prev[j + 1], cur[j]))
+        prev = cur
+    return prev[-1]
+
+
+def rouge_l(preds: List[str], refs: List[str]) -> float:
+    """Mean ROUGE-L F1 over whitespace tokens."""
+    if not refs:
+        return 0.0
+    total = 0.0
+    for p, r in zip(preds, refs):
+        pt, rt = p.split(), r.split()
+        lcs = _lcs(pt, rt) if pt and rt else 0
+        if lcs:
+            precision, recall = lcs / len(pt), lcs / len(rt)
+            total += 2 * precision * recall / (precision + recall)
+    return total / len(refs)
+
+
+def bertscore_f1(preds: List[str], refs: List[str], lang: str = "en") -> Optional[float]:
+    """Mean BERTScore F1, or None when the metric or its model cannot be loaded (e.g. offline)."""
+    try:
+        import evaluate
+        scores = evaluate.load("bertscore").compute(predictions=preds, references=refs, lang=lang)
+        return sum(scores["f1"]) / len(scores["f1"])
+    except Exception:
+        return None
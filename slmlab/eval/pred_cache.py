@@ -0,0 +1,84 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from slmlab.postproc.merge import is_adapter_dir, adapter_base, merge_key, weights_fingerprint
+from slmlab.utils.fingerprint import text_fingerprint
+
+DEFAULT_CACHE_DIR = "artifacts/predictions"
+
+
+def model_fingerprint(name_or_path: str, revision: Optional[str] = None) -> str:
+    """
+    Content hash of the weights a model name resolves to (merged base +
+    adapter for LoRA dirs). Falls back to the name itself when the weights
+    cannot be located, e.g. an offline hub id.
+    """
+    try:
+        if is_adapter_dir(name_or_path):
+            return merge_key(adapter_base(name_or_path), name_or_path, revision)
+        return weights_fingerprint(name_or_path, revision)[:24]
+    except Exception:
+        return text_fingerprint("name", name_or_path, revision)[:24]
+
+
+def prediction_key(prompt: str, **gen_params) -> str:
+    return text_fingerprint(prompt, sorted(gen_params.items()))[:32]
+
+
+class PredictionCache:
+    """
+    Append-only JSONL of predictions for one model fingerprint. Every
+    prediction is flushed as soon as it is produced, so an interrupted run
+    keeps what it generated and the next run resumes from there.
+    """
+
+    def __init__(self, model_fp: str, cache_dir: str | Path | None = None):
+        root = Path(cache_dir or os.environ.get("SLMLAB_PRED_CACHE", DEFAULT_CACHE_DIR))
+        root.mkdir(parents=True, exist_ok=True)
+        self.path = root / f"{model_fp}.jsonl"
+        self._preds: Dict[str, str] = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # partial last line of an interrupted write
+                    self._preds[rec["key"]] = rec["prediction"]
+        self._f = None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._preds
+
+    def __len__(self) -> int:
+        return len(self._preds)
+
+    def get(self, key: str) -> Optional[str]:
+        return self._preds.get(key)
+
+    def put(self, key: str, prediction: str):
+        self._preds[key] = prediction
+        if self._f is None:
+            self._f = open(self.path, "a", encoding="utf-8")
+            if self._f.tell() and not self._ends_with_newline():
+                self._f.write("\n")
+        self._f.write(json.dumps({"key": key, "prediction": prediction}, ensure_ascii=False) + "\n")
+        self._f.flush()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,92 @@
+import json
+import logging
+import multiprocessing as mp
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence
+
+from slmlab.inference.quantize import model_bytes, normalize_quant
+from slmlab.utils.profiling import stage
+from .metrics import exact_match
+from .xml_eval import ReferenceSet, score_xml
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VARIANTS = ("none", "int8", "int4")
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on Linux, bytes on macOS
+    return round((peak if sys.platform == "darwin" else peak * 1024) / 2**20, 1)
+
+
+def _run_variant(model_name: str, quant: Optional[str], prompts: List[str], max_new_tokens: int, batch_size: int,
+                 prefix: Optional[str], threads: Optional[int], constrain: Optional[str] = None) -> dict:
+    """Loads and runs one variant; called in a fresh process so its peak RSS is its own."""
+    import torch
+    from slmlab.inference.registry import load_model
+    from .runner import _generate
+
+    if threads:
+        torch.set_num_threads(threads)
+    start = time.perf_counter()
+    mod, _ = load_model(model_name, quant=quant)
+    load_s = time.perf_counter() - start
+    loaded_rss = _peak_rss_mb()
+    preds, stats = _generate(model_name, prompts, max_new_tokens=max_new_tokens, batch_size=batch_size,
+                             prefix=prefix, quant=quant, constrain=constrain)
+    return {"preds": preds, "generation": stats.to_dict(), "load_s": round(load_s, 2),
+            "weights_mb": round(model_bytes(mod) / 2**20, 1), "load_peak_rss_mb": loaded_rss,
+            "peak_rss_mb": _peak_rss_mb()}
+
+
+def quant_report(model_name: str, eval_path, variants: Sequence[str] = DEFAULT_VARIANTS, batch_size: int = 8,
+                 max_new_tokens: int = 256, prefix: Optional[str] = None, limit: Optional[int] = None,
+                 threads: Optional[int] = None, metric_workers: Optional[int] = None,
+                 constrain: Optional[str] = None) -> dict:
+    """
+    Runs the same held-out prompts through each precision variant of one
+    model, every variant in its own process, and reports speed, memory and
+    XML quality side by side. Predictions always come from fresh generation,
+    with the use case's `constrain` so the decode matches the shipped one.
+    """
+    with open(eval_path, encoding="utf-8") as f:
+        examples = [json.loads(l) for l in f][:limit]
+    prompts = [ex["prompt"] for ex in examples]
+    refs = [ex["label"] for ex in examples]
+    with stage("eval.references", items=len(refs)):
+        ref_set = ReferenceSet(refs, processes=metric_workers)
+
+    rows, reference_preds = {}, None
+    for variant in variants:
+        quant = normalize_quant(variant)
+        name = quant or "fp32"
+        try:
+            with stage(f"quant.{name}", items=len(prompts)), \
+                    ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as ex:
+                r = ex.submit(_run_variant, model_name, quant, prompts, max_new_tokens, batch_size, prefix,
+                              threads, constrain).result()
+        except Exception as e:
+            logger.warning(f"{model_name} ({name}): skipped, {type(e).__name__}: {e}")
+            rows[name] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+
+        preds = r.pop("preds")
+        xml = score_xml(preds, ref_set, processes=metric_workers)
+        if reference_preds is None:
+            reference_preds = preds  # the first variant (normally fp32) is what the others are compared to
+        gen = r["generation"]
+        rows[name] = {
+            "tokens_per_sec": gen["tokens_per_sec"],
+            "seconds": round(gen["seconds"], 2),
+            **r,
+            "xml_valid_rate": xml["xml_valid_rate"],
+            "xml_coverage": xml["xml_coverage"],
+            "xml_f1": xml["xml_f1"],
+            "exact": exact_match(preds, refs),
+            "same_as_reference": exact_match(preds, reference_preds),
+        }
+
+    return {"model": model_name, "n": len(examples), "max_new_tokens": max_new_tokens, "variants": rows}
@@ -1,41 +1,109 @@
 import json
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+import logging
+from slmlab.inference.engine import generate_batched
+from slmlab.inference.registry import load_model
+from slmlab.utils.profiling import stage
 from .metrics import exact_match, rouge_l, bertscore_f1
-from .xml_eval import xml_is_well_formed, coverage_against_ref
+from .pred_cache import PredictionCache, model_fingerprint, prediction_key
+from .xml_eval import ReferenceSet, score_xml
 
+logger = logging.getLogger(__name__)
 
-def _generate(model_name, prompts, max_new_tokens=256):
-    tok = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
-    mod = AutoModelForCausalLM.from_pretrained(model_name, trust_remote_code=True)
-    gen = pipeline("text-generation", model=mod, tokenizer=tok, device=-1)
-    outs = []
-    for p in prompts:
-        out = gen(p, max_new_tokens=max_new_tokens, do_sample=False)[0]["generated_text"]
-        outs.append(out)
-    return outs
 
+def _generate(model_name, prompts, max_new_tokens=256, batch_size=8, prefix=None, on_result=None, quant=None,
+              speculative=None, constrain=None):
+    with stage("eval.model_load"):
+        mod, tok = load_model(model_name, quant=quant)
+    with stage("eval.generate") as st:  # items = generated tokens
+        outs, stats = generate_batched(mod, tok, prompts, max_new_tokens=max_new_tokens, batch_size=batch_size,
+                                       prefix=prefix, on_result=on_result, speculative=speculative,
+                                       constrain=constrain)
+        st.items = stats.generated_tokens
+        st.extra = {"model": model_name, "prompts": len(prompts), "quant": quant or "none"}
+    label = f"{model_name} ({quant})" if quant else model_name
+    logger.info(f"{label}: {stats.generated_tokens} tokens in {stats.seconds:.1f}s "
+                f"({stats.tokens_per_sec:.1f} tok/s, batch_size={stats.batch_size}, padding={stats.padding_ratio:.1%})")
+    if stats.spec_steps:
+        logger.info(f"{label}: {speculative.mode} drafts accepted {stats.spec_accepted}/{stats.spec_drafted}, "
+                    f"{stats.generated_tokens / stats.spec_steps:.2f} tokens per forward pass")
+    return outs, stats
 
-def evaluate_models(baseline_name, tuned_name, eval_path):
+
+def _predict(model_name, prompts, max_new_tokens=256, batch_size=8, prefix=None, use_cache=True, cache_dir=None,
+             quant=None, speculative=None, constrain=None):
+    """
+    Predictions (completions only) for `prompts`, served from the prediction
+    cache where possible. Missing ones are generated and persisted batch by
+    batch; prompts that could not be generated are left empty and counted as
+    failed. Speculative decoding yields the greedy outputs, so it shares their
+    cache entries; constrained decoding does not.
+    """
+    params = {"max_new_tokens": max_new_tokens, "decoding": "greedy", "output": "completion",
+              **({"quant": quant} if quant else {}), **({"constrain": constrain} if constrain else {})}
+    keys = [prediction_key(p, **params) for p in prompts]
+    cache = PredictionCache(model_fingerprint(model_name), cache_dir) if use_cache else None
+    preds = [cache.get(k) if cache is not None else None for k in keys]
+    todo = [i for i, p in enumerate(preds) if p is None]
+    counts = {"cached": len(prompts) - len(todo), "generated": 0, "failed": 0}
+    gen_stats = None
+
+    if todo:
+        def on_result(j, text):
+            i = todo[j]
+            preds[i] = text
+            counts["generated"] += 1
+            if cache is not None:
+                cache.put(keys[i], text)
+
+        try:
+            _, stats = _generate(model_name, [prompts[i] for i in todo], max_new_tokens=max_new_tokens,
+                                 batch_size=batch_size, prefix=prefix, on_result=on_result, quant=quant,
+                                 speculative=speculative, constrain=constrain)
+            gen_stats = stats.to_dict()
+        except Exception as e:
+            logger.warning(f"{model_name}: generation failed after {counts['generated']}/{len(todo)} "
+                           f"prompts: {type(e).__name__}: {e}")
+    if cache is not None:
+        cache.close()
+
+    counts["failed"] = sum(p is None for p in preds)
+    logger.info(f"{model_name}: predictions cached={counts['cached']} "
+                f"generated={counts['generated']} failed={counts['failed']}")
+    return [p if p is not None else "" for p in preds], counts, gen_stats
+
+
+def evaluate_models(baseline_name, tuned_name, eval_path, batch_size=8, prefix=None, metric_workers=None,
+                    use_cache=True, cache_dir=None, quant=None, speculative=None, constrain=None):
+    """
+    Scores the baseline and the tuned model on `eval_path`; `quant` applies to
+    the tuned model, `constrain` to both.
+    """
     with open(eval_path, encoding="utf-8") as f:
         examples = [json.loads(l) for l in f]
 
     prompts = [ex["prompt"] for ex in examples]
     refs = [ex["label"] for ex in examples]
+    with stage("eval.references", items=len(refs)):
+        ref_set = ReferenceSet(refs, processes=metric_workers)  # parsed once, shared by both models
 
     results = {}
     for name in ["baseline", "tuned"]:
         model = baseline_name if name == "baseline" else tuned_name
-        try:
-            preds = _generate(model, prompts)
-        except Exception:
-            # Fallback: use refs as preds to keep pipeline runnable offline
-            preds = refs
-        results[name] = {
-            "exact": exact_match(preds, refs),
-            "rougeL": rouge_l(preds, refs),
-            "bertscore_f1": bertscore_f1(preds, refs),
-            "xml_valid_rate": sum(xml_is_well_formed(p) for p in preds) / len(preds),
-            "xml_coverage": sum(coverage_against_ref(p, r) for p, r in zip(preds, refs)) / len(refs)
-        }
-
-    return {"scores": results, "n": len(examples)}
\ No newline at end of file
+        preds, counts, gen_stats = _predict(model, prompts, batch_size=batch_size, prefix=prefix,
+                                            use_cache=use_cache, cache_dir=cache_dir,
+                                            quant=quant if name == "tuned" else None, speculative=speculative,
+                                            constrain=constrain)
+        with stage("eval.metrics", items=len(preds)) as st:
+            st.extra = {"model": model}
+            results[name] = {
+                "exact": exact_match(preds, refs),
+                "rougeL": rouge_l(preds, refs),
+                "bertscore_f1": bertscore_f1(preds, refs),
+                **score_xml(preds, ref_set, processes=metric_workers),
+                "predictions": counts,
+                "generation": gen_stats,
+                "quant": (quant if name == "tuned" else None) or "none",
+                "constrain": constrain or "none",
+            }
+
+    return {"scores": results, "n": len(examples)}
@@ -1,29 +1,126 @@
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple
 from xml.etree import ElementTree as ET
-from typing import List, Tuple
 
-def xml_is_well_formed(s: str) -> bool:
-    try:
-        ET.fromstring(s)
-        return True
-    except Exception:
-        return False
+try:  # lxml parses several times faster than ElementTree
+    from lxml import etree as _lxml
+    _PARSER = _lxml.XMLParser(resolve_entities=False, no_network=True)
+except ImportError:  # pragma: no cover
+    _lxml = None
 
-def extract_field_pairs(s: str) -> List[Tuple[str,str]]:
+# Below this many documents a process pool costs more than it saves
+_POOL_MIN_DOCS = 2000
+
+
+class XmlDoc(NamedTuple):
+    """Everything the metrics need from one document, from a single parse."""
+    well_formed: bool
+    pairs: FrozenSet[Tuple[str, str]]  # (datafield tag, subfield code)
+
+
+def parse_xml(s: str):
+    if _lxml is not None:
+        return _lxml.fromstring(s.encode("utf-8"), _PARSER)
+    return ET.fromstring(s)
+
+
+def _field_pairs(root) -> List[Tuple[str, str]]:
     pairs = []
-    try:
-        root = ET.fromstring(s)
-    except Exception:
-        return pairs
     for df in root.findall("datafield"):
         tag = df.get("tag", "")
         for sf in df.findall("subfield"):
-            code = sf.get("code", "")
-            pairs.append((tag, code))
+            pairs.append((tag, sf.get("code", "")))
     return pairs
 
+
+def summarize(s: str) -> XmlDoc:
+    try:
+        root = parse_xml(s)
+    except Exception:
+        return XmlDoc(False, frozenset())
+    return XmlDoc(True, frozenset(_field_pairs(root)))
+
+
+def summarize_all(docs: Sequence[str], processes: Optional[int] = None) -> List[XmlDoc]:
+    """Parses every document once, fanning out to a process pool for large sets."""
+    if processes is None:
+        processes = (os.cpu_count() or 1) if len(docs) >= _POOL_MIN_DOCS else 1
+    if processes <= 1:
+        return [summarize(s) for s in docs]
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(summarize, docs, chunksize=max(1, len(docs) // (processes * 4))))
+
+
+class ReferenceSet:
+    """Parsed references, computed once and shared by every evaluated model."""
+
+    def __init__(self, refs: Sequence[str], processes: Optional[int] = None):
+        self.refs = list(refs)
+        self.docs = summarize_all(self.refs, processes)
+
+    def __len__(self):
+        return len(self.docs)
+
+
+def score_xml(preds: Sequence[str], refs: ReferenceSet, processes: Optional[int] = None) -> Dict:
+    """
+    Well-formedness, field coverage and (tag, subfield code) precision/recall,
+    micro-averaged and per datafield tag, in one pass over parsed documents.
+    """
+    pred_docs = summarize_all(preds, processes)
+    n = len(pred_docs)
+
+    coverage = 0.0
+    tp, fp, fn = Counter(), Counter(), Counter()
+    for p, r in zip(pred_docs, refs.docs):
+        if r.pairs:
+            coverage += len(r.pairs & p.pairs) / len(r.pairs)
+        for tag, _ in p.pairs & r.pairs:
+            tp[tag] += 1
+        for tag, _ in p.pairs - r.pairs:
+            fp[tag] += 1
+        for tag, _ in r.pairs - p.pairs:
+            fn[tag] += 1
+
+    def _pr(t, f_p, f_n):
+        precision = t / (t + f_p) if t + f_p else 0.0
+        recall = t / (t + f_n) if t + f_n else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return precision, recall, f1
+
+    per_tag = defaultdict(dict)
+    for tag in sorted(set(tp) | set(fp) | set(fn)):
+        precision, recall, f1 = _pr(tp[tag], fp[tag], fn[tag])
+        per_tag[tag] = {"precision": precision, "recall": recall, "f1": f1, "support": tp[tag] + fn[tag]}
+
+    precision, recall, f1 = _pr(sum(tp.values()), sum(fp.values()), sum(fn.values()))
+    return {
+        "xml_valid_rate": sum(d.well_formed for d in pred_docs) / n if n else 0.0,
+        "xml_coverage": coverage / n if n else 0.0,
+        "xml_precision": precision,
+        "xml_recall": recall,
+        "xml_f1": f1,
+        "xml_per_tag": dict(per_tag),
+    }
+
+
+# ---- single-document helpers ----
+
+def xml_is_well_formed(s: str) -> bool:
+    return summarize(s).well_formed
+
+def extract_field_pairs(s: str) -> List[Tuple[str,str]]:
+    try:
+        root = parse_xml(s)
+    except Exception:
+        return []
+    return _field_pairs(root)
+
 def coverage_against_ref(pred_xml: str, ref_xml: str) -> float:
-    ref = set(extract_field_pairs(ref_xml))
+    ref = summarize(ref_xml).pairs
     if not ref:
         return 0.0
-    pred = set(extract_field_pairs(pred_xml))
-    return len(ref & pred) / len(ref)
\ No newline at end of file
+    pred = summarize(pred_xml).pairs
+    return len(ref & pred) / len(ref)
@@ -0,0 +1,288 @@
+import logging
+import time
+import weakref
+from dataclasses import dataclass, asdict
+from typing import Callable, List, Optional, Tuple, Union
+
+import torch
+from transformers import LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+
+from .prefix_cache import cache_reusable, get_prefix_cache
+from .speculative import Speculator, speculative_generate
+from .xml_constraint import CONSTRAINTS, XmlConstraint, XmlStop, get_xml_guide
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class GenerationStats:
+    n_prompts: int = 0
+    batch_size: int = 0
+    prompt_tokens: int = 0
+    generated_tokens: int = 0
+    padded_tokens: int = 0
+    prefix_cached_tokens: int = 0
+    seconds: float = 0.0
+    spec_steps: int = 0  # speculative decoding: verification passes, drafted and accepted tokens
+    spec_drafted: int = 0
+    spec_accepted: int = 0
+
+    @property
+    def tokens_per_sec(self) -> float:
+        return self.generated_tokens / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def padding_ratio(self) -> float:
+        total = self.prompt_tokens + self.padded_tokens
+        return self.padded_tokens / total if total else 0.0
+
+    def to_dict(self) -> dict:
+        d = asdict(self)
+        d["tokens_per_sec"] = round(self.tokens_per_sec, 2)
+        d["padding_ratio"] = round(self.padding_ratio, 4)
+        if self.spec_steps:
+            d["acceptance_rate"] = round(self.spec_accepted / self.spec_drafted, 4) if self.spec_drafted else 0.0
+            d["tokens_per_step"] = round(self.generated_tokens / self.spec_steps, 2)
+        else:
+            for k in ("spec_steps", "spec_drafted", "spec_accepted"):
+                d.pop(k)
+        return d
+
+
+def length_buckets(lengths: List[int], batch_size: int, rows: Optional[List[int]] = None) -> List[List[int]]:
+    """
+    Groups indices (all of them, or only `rows`) into batches of similar length,
+    longest first, so that left-padding inside each batch stays small.
+    """
+    order = sorted(range(len(lengths)) if rows is None else rows, key=lambda i: lengths[i], reverse=True)
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def _completion_length(row: List[int], stop_ids: set) -> int:
+    for n, t in enumerate(row):
+        if t in stop_ids:
+            return n
+    return len(row)
+
+
+class RowBudget(StoppingCriteria):
+    """Marks each row as finished once it has produced its own number of new tokens."""
+
+    def __init__(self, prompt_width: int, budgets: List[int]):
+        self.prompt_width = prompt_width
+        self.budgets = torch.tensor(budgets)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        produced = input_ids.shape[1] - self.prompt_width
+        return (produced >= self.budgets).to(input_ids.device)
+
+
+class RowCancelled(StoppingCriteria):
+    """Marks rows whose caller has gone away; generation ends once every row is done."""
+
+    def __init__(self, idx: List[int], cancelled: Callable[[int], bool]):
+        self.idx = idx
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.tensor([self.cancelled(i) for i in self.idx], device=input_ids.device)
+
+
+class RowStreamer(BaseStreamer):
+    """
+    Forwards each newly decoded token of a batch to `on_token(index, token_id)`,
+    where `index` is the prompt's position in the caller's list. Rows stop being
+    forwarded once they hit a stop token or their budget.
+    """
+
+    def __init__(self, idx: List[int], budgets: List[int], stop_ids: set,
+                 on_token: Callable[[int, int], None]):
+        self.idx = idx
+        self.budgets = budgets
+        self.stop_ids = stop_ids
+        self.on_token = on_token
+        self.produced = [0] * len(idx)
+        self.done = [False] * len(idx)
+        self._prompt_seen = False
+
+    def put(self, value):
+        if not self._prompt_seen:
+            # generate() first pushes the prompt ids
+            self._prompt_seen = True
+            return
+        for r, toks in enumerate(value.reshape(len(self.idx), -1).tolist()):
+            for t in toks:
+                if self.done[r]:
+                    break
+                if t in self.stop_ids:
+                    self.done[r] = True
+                    break
+                self.on_token(self.idx[r], t)
+                self.produced[r] += 1
+                self.done[r] = self.produced[r] >= self.budgets[r]
+
+    def end(self):
+        pass
+
+
+_no_spec_warned: "weakref.WeakSet" = weakref.WeakSet()
+
+
+def _warn_no_speculative(model):
+    if model not in _no_spec_warned:
+        _no_spec_warned.add(model)
+        logger.warning(f"speculative decoding disabled for {type(model).__name__}: its cache cannot be "
+                       f"cropped after rejected drafts; generating in plain batches")
+
+
+@torch.inference_mode()
+def generate_batched(
+    model,
+    tok,
+    prompts: List[str],
+    max_new_tokens: Union[int, List[int]] = 256,
+    batch_size: int = 8,
+    return_full_text: bool = False,
+    on_token: Optional[Callable[[int, int], None]] = None,
+    cancelled: Optional[Callable[[int], bool]] = None,
+    prefix: Optional[str] = None,
+    on_result: Optional[Callable[[int, str], None]] = None,
+    speculative: Optional[Speculator] = None,
+    constrain: Optional[str] = None,
+) -> Tuple[List[str], GenerationStats]:
+    """
+    Greedy generation over `prompts` in length-bucketed, left-padded batches.
+    `max_new_tokens` may be a single value or one budget per prompt.
+    Predictions are returned in the original prompt order, together with
+    throughput statistics for the whole run.
+
+    `on_token(i, token_id)` is called from the generating thread as soon as
+    prompt `i` gets a new token; rows for which `cancelled(i)` turns true stop
+    early, and the batch stops as soon as every row has finished.
+
+    With `prefix` (the static start of the prompt template), its key/values are
+    computed once per model and prompts that start with it only prefill their
+    own tail; other prompts are generated as usual.
+
+    `on_result(i, text)` is called as soon as the batch holding prompt `i` is
+    done, so callers can persist results before the whole run finishes.
+
+    With `speculative`, prompts are decoded one at a time with drafted tokens
+    verified in a single pass each (see speculative.py); outputs are the
+    same greedy ones. Models whose cache cannot be cropped (recurrent/conv
+    layers, e.g. LFM2) are generated in plain batches instead, with a warning.
+
+    With `constrain="xml"`, each step takes the best token that keeps the
+    completion a well-formed XML document and a row stops as soon as its root
+    element is closed (see xml_constraint.py). Outputs are the completions
+    alone unless `return_full_text`.
+    """
+    if constrain not in (None, *CONSTRAINTS):
+        raise ValueError(f"Unknown constraint: {constrain} (expected one of {', '.join(CONSTRAINTS)})")
+    if tok.pad_token is None:
+        tok.pad_token = tok.eos_token
+    tok.padding_side = "left"
+    model.eval()
+
+    enc = tok(list(prompts))["input_ids"]
+    lengths = [len(ids) for ids in enc]
+    stop_ids = {tok.pad_token_id, tok.eos_token_id} - {None}
+    guide = get_xml_guide(tok, stop_ids) if constrain == "xml" else None
+    if isinstance(max_new_tokens, int):
+        budgets = [max_new_tokens] * len(prompts)
+    else:
+        budgets = list(max_new_tokens)
+
+    stats = GenerationStats(n_prompts=len(prompts), batch_size=batch_size, prompt_tokens=sum(lengths))
+    outs: List[str] = [""] * len(prompts)
+    start = time.perf_counter()
+
+    if speculative is not None and not cache_reusable(model):
+        _warn_no_speculative(model)
+        speculative = None
+
+    entry = get_prefix_cache(model, tok, prefix) if prefix else None
+    n_prefix = len(entry.ids) if entry else 0
+    hit = [entry is not None and len(ids) > n_prefix and ids[:n_prefix] == entry.ids for ids in enc]
+    if speculative is not None:
+        _generate_speculative(model, tok, prompts, enc, budgets, stop_ids, speculative, stats, outs,
+                              entry, hit, return_full_text, on_token, cancelled, on_result, guide)
+        stats.seconds = time.perf_counter() - start
+        return outs, stats
+
+    batches = length_buckets(lengths, max(1, batch_size), [i for i in range(len(enc)) if hit[i]])
+    batches += length_buckets(lengths, max(1, batch_size), [i for i in range(len(enc)) if not hit[i]])
+
+    for idx in batches:
+        extra = {}
+        if hit[idx[0]]:
+            # Shared prefix comes from the cache; only the tails are left-padded
+            tails = tok.pad({"input_ids": [enc[i][n_prefix:] for i in idx]}, return_tensors="pt")
+            head = torch.tensor([entry.ids] * len(idx))
+            batch = {
+                "input_ids": torch.cat([head, tails["input_ids"]], dim=1),
+                "attention_mask": torch.cat([torch.ones_like(head), tails["attention_mask"]], dim=1),
+            }
+            extra["past_key_values"] = entry.expand(len(idx))
+            stats.prefix_cached_tokens += n_prefix * len(idx)
+        else:
+            batch = tok.pad({"input_ids": [enc[i] for i in idx]}, return_tensors="pt")
+        batch = {k: v.to(model.device) for k, v in batch.items()}
+        width = batch["input_ids"].shape[1]
+        stats.padded_tokens += sum(width - lengths[i] for i in idx)
+
+        row_budgets = [budgets[i] for i in idx]
+        criteria = StoppingCriteriaList()
+        if len(set(row_budgets)) > 1:
+            criteria.append(RowBudget(width, row_budgets))
+        if cancelled is not None:
+            criteria.append(RowCancelled(idx, cancelled))
+        if guide is not None:
+            constraint = XmlConstraint(guide, len(idx))
+            extra["logits_processor"] = LogitsProcessorList([constraint])
+            criteria.append(XmlStop(constraint))
+        if criteria:
+            extra["stopping_criteria"] = criteria
+        if on_token is not None:
+            extra["streamer"] = RowStreamer(idx, row_budgets, stop_ids, on_token)
+
+        gen = model.generate(
+            **batch,
+            max_new_tokens=max(row_budgets),
+            do_sample=False,
+            pad_token_id=tok.pad_token_id,
+            **extra,
+        )
+        for row, i in zip(gen[:, width:].tolist(), idx):
+            n = _completion_length(row[:budgets[i]], stop_ids)
+            stats.generated_tokens += n
+            text = tok.decode(row[:n], skip_special_tokens=True)
+            outs[i] = prompts[i] + text if return_full_text else text
+            if on_result is not None:
+                on_result(i, outs[i])
+
+    stats.seconds = time.perf_counter() - start
+    return outs, stats
+
+
+def _generate_speculative(model, tok, prompts, enc, budgets, stop_ids, spec, stats, outs, entry, hit,
+                          return_full_text, on_token, cancelled, on_result, guide):
+    stats.batch_size = 1
+    for i in sorted(range(len(enc)), key=lambda i: len(enc[i]), reverse=True):
+        new, s = speculative_generate(
+            model, enc[i], budgets[i], stop_ids, spec,
+            past=entry.expand(1) if hit[i] else None,
+            on_token=(lambda t, i=i: on_token(i, t)) if on_token is not None else None,
+            cancelled=(lambda i=i: cancelled(i)) if cancelled is not None else None,
+            guide=guide,
+        )
+        stats.generated_tokens += len(new)
+        stats.prefix_cached_tokens += len(entry.ids) if hit[i] else 0
+        stats.spec_steps += s.steps + 1  # + the prefill pass, which yields the first token
+        stats.spec_drafted += s.drafted
+        stats.spec_accepted += s.accepted
+        text = tok.decode(new, skip_special_tokens=True)
+        outs[i] = prompts[i] + text if return_full_text else text
+        if on_result is not None:
+            on_result(i, outs[i])
@@ -0,0 +1,104 @@
+import copy
+import hashlib
+import logging
+import threading
+import weakref
+from dataclasses import dataclass
+from typing import List, Optional
+
+import torch
+from transformers import DynamicCache
+
+logger = logging.getLogger(__name__)
+
+# model -> {prefix key: PrefixEntry | None}. Weak keys: when the registry drops
+# a model, its prefix caches go with it.
+_caches: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+_MAX_PREFIXES_PER_MODEL = 4
+
+
+@dataclass
+class PrefixEntry:
+    ids: List[int]
+    cache: DynamicCache
+
+    def expand(self, batch_size: int) -> DynamicCache:
+        """Returns a private copy of the cached key/values repeated for a batch."""
+        c = copy.deepcopy(self.cache)
+        if batch_size > 1:
+            c.batch_repeat_interleave(batch_size)
+        return c
+
+
+def _supports_prefix_reuse(cache) -> bool:
+    # Only plain attention caches can be extended after left-padded suffixes;
+    # recurrent/conv states (hybrid models) would absorb the padding.
+    if type(cache) is not DynamicCache:
+        return False
+    layers = getattr(cache, "layers", None)
+    if layers is None:
+        return True
+    from transformers.cache_utils import DynamicLayer
+    return all(isinstance(l, DynamicLayer) for l in layers)
+
+
+_reusable: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+@torch.inference_mode()
+def cache_reusable(model) -> bool:
+    """
+    Whether the model's key/values can be extended after left-padded input
+    and cropped back: plain attention caches only. Probed once per model with
+    a one-token forward.
+    """
+    with _lock:
+        return _reusable_locked(model)
+
+
+def _reusable_locked(model) -> bool:
+    ok = _reusable.get(model)
+    if ok is None:
+        out = model(input_ids=torch.tensor([[0]], device=model.device), use_cache=True)
+        ok = _reusable[model] = _supports_prefix_reuse(out.past_key_values)
+    return ok
+
+
+def prefix_key(tok, prefix: str) -> str:
+    h = hashlib.sha256(prefix.encode("utf-8"))
+    h.update(str(getattr(tok, "name_or_path", "")).encode("utf-8"))
+    return h.hexdigest()
+
+
+@torch.inference_mode()
+def get_prefix_cache(model, tok, prefix: str) -> Optional[PrefixEntry]:
+    """
+    Returns past key/values for `prefix`, computed once per (model, prefix text)
+    and reused afterwards. A changed template hashes to a new entry. Models
+    whose cache cannot be extended after left-padded tails (recurrent/conv
+    layers, e.g. LFM2) get None, without computing the prefix, and are
+    generated uncached; callers gate the feature on `inference.prefix_cache`.
+
+    The last prefix token is left out of the cache because a BPE merge may join
+    it with the first characters of the variable part of the prompt.
+    """
+    key = prefix_key(tok, prefix)
+    with _lock:
+        per_model = _caches.setdefault(model, {})
+        if key in per_model:
+            return per_model[key]
+
+        ids = tok(prefix)["input_ids"][:-1]
+        entry = None
+        if ids and _reusable_locked(model):
+            out = model(input_ids=torch.tensor([ids], device=model.device), use_cache=True)
+            entry = PrefixEntry(ids, out.past_key_values)
+        elif ids:
+            logger.warning(f"prefix cache disabled for {type(model).__name__}: its cache cannot be "
+                           f"extended after left-padded prompts (set inference.prefix_cache: false)")
+
+        if len(per_model) >= _MAX_PREFIXES_PER_MODEL:
+            per_model.pop(next(iter(per_model)))
+        per_model[key] = entry
+        return entry
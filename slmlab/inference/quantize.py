@@ -0,0 +1,81 @@
+import logging
+from typing import Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+QUANT_MODES = ("none", "int8", "int4")
+INT4_GROUP_SIZE = 128
+
+
+def normalize_quant(quant: Optional[str]) -> Optional[str]:
+    """None for full precision, else the validated mode name."""
+    if quant in (None, "", "none", "fp32"):
+        return None
+    if quant not in QUANT_MODES:
+        raise ValueError(f"Unknown quantization mode: {quant} (expected one of {', '.join(QUANT_MODES)})")
+    return quant
+
+
+def _torchao():
+    # torchao comes with unsloth; it can be present but built for another torch
+    try:
+        import torchao.quantization as tq
+        return tq
+    except Exception:
+        return None
+
+
+def quantize_model(model, quant: Optional[str]):
+    """
+    Weight-only quantization of the model's Linear layers for CPU inference.
+    int8 uses torchao when available, else torch's dynamic int8 quantization;
+    int4 (grouped, bf16 activations) needs torchao.
+    """
+    quant = normalize_quant(quant)
+    if quant is None:
+        return model
+    tq = _torchao()
+    if quant == "int8":
+        if tq is not None:
+            tq.quantize_(model, tq.Int8WeightOnlyConfig())
+            backend = "torchao int8 weight-only"
+        else:
+            model = torch.ao.quantization.quantize_dynamic(model.float(), {torch.nn.Linear}, dtype=torch.qint8)
+            backend = "torch dynamic int8"
+    else:
+        if tq is None:
+            raise RuntimeError("int4 quantization needs torchao (pip install torchao matching your torch)")
+        from torchao.dtypes import Int4CPULayout
+        model = model.to(torch.bfloat16)
+        tq.quantize_(model, tq.Int4WeightOnlyConfig(group_size=INT4_GROUP_SIZE, layout=Int4CPULayout()))
+        backend = f"torchao int4 weight-only (group size {INT4_GROUP_SIZE})"
+    logger.info(f"quantized Linear weights: {backend}")
+    return model
+
+
+def tensor_bytes(t) -> int:
+    """Storage bytes of a tensor, including quantized and torchao subclass tensors."""
+    if hasattr(t, "__tensor_flatten__"):
+        names, _ = t.__tensor_flatten__()
+        return sum(tensor_bytes(getattr(t, n)) for n in names)
+    return t.numel() * t.element_size()
+
+
+def model_bytes(model) -> int:
+    """Bytes held by the model's weights; dynamic-quantized layers keep theirs in packed params."""
+    seen, total = set(), 0
+
+    def add(v):
+        nonlocal total
+        if isinstance(v, (tuple, list)):
+            for x in v:
+                add(x)
+        elif isinstance(v, torch.Tensor) and id(v) not in seen:
+            seen.add(id(v))
+            total += tensor_bytes(v)
+
+    for v in model.state_dict(keep_vars=True).values():
+        add(v)
+    return total
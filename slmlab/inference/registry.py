@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from slmlab.postproc.merge import adapter_base, is_adapter_dir, merge_adapter
+
+from .quantize import model_bytes, normalize_quant, quantize_model
+
+logger = logging.getLogger(__name__)
+
+_FLOAT_DTYPES = {"F64": 8, "F32": 4, "F16": 2, "BF16": 2}
+
+
+class ModelKey(NamedTuple):
+    path: str
+    revision: Optional[str] = None
+    dtype: Optional[str] = None
+    adapter: Optional[str] = None
+    quant: Optional[str] = None  # int8 | int4 weight-only, see quantize.py
+
+
+class _Entry(NamedTuple):
+    model: object
+    tok: object
+    nbytes: int
+
+
+def _torch_dtype(dtype: Optional[str]):
+    if dtype in (None, "", "auto"):
+        return None
+    if not hasattr(torch, dtype):
+        raise ValueError(f"Unknown dtype: {dtype}")
+    return getattr(torch, dtype)
+
+
+def _header_tensors(path: Path) -> List[Tuple[str, int]]:
+    """(dtype, stored bytes) of every tensor in a safetensors file, from its JSON header only."""
+    with open(path, "rb") as f:
+        n = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(n))
+    return [(t["dtype"], t["data_offsets"][1] - t["data_offsets"][0]) for k, t in header.items() if k != "__metadata__"]
+
+
+def estimate_bytes(key: "ModelKey") -> int:
+    """
+    Bytes the model's weights take once loaded, from its safetensors headers
+    (local files, or the hub's header-only metadata): floating tensors at the
+    load dtype (float32 unless `key.dtype`). 0 when unknown. Quantization
+    happens after the full-precision load, so it does not lower the peak.
+    """
+    path = key.path
+    if not key.adapter and is_adapter_dir(path):
+        path = adapter_base(path)
+    try:
+        if Path(path).is_dir():
+            tensors = [t for f in sorted(Path(path).glob("*.safetensors")) for t in _header_tensors(f)]
+        else:
+            from huggingface_hub import get_safetensors_metadata
+            meta = get_safetensors_metadata(path, revision=key.revision)
+            tensors = [(t.dtype, t.data_offsets[1] - t.data_offsets[0])
+                       for f in meta.files_metadata.values() for t in f.tensors.values()]
+    except Exception:
+        return 0
+    torch_dtype = _torch_dtype(key.dtype)
+    itemsize = torch_dtype.itemsize if torch_dtype is not None else 4
+    return sum(n // _FLOAT_DTYPES[d] * itemsize if d in _FLOAT_DTYPES else n for d, n in tensors)
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of (model, tokenizer) pairs keyed by ModelKey.
+    Total resident bytes are capped; least-recently-used entries are evicted
+    first, before a load (from the estimated size of the incoming weights) as
+    well as after it. The entry being returned is never evicted, so a single
+    model larger than the cap still loads.
+
+    Loads run outside the registry lock: cached models stay available while
+    another one loads, and concurrent requests for a key being loaded wait
+    for that one load.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, trust_remote_code: bool = True):
+        self.max_bytes = max_bytes
+        self.trust_remote_code = trust_remote_code
+        self._entries: "OrderedDict[ModelKey, _Entry]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._loading: Dict[ModelKey, Future] = {}
+        self._reserved: Dict[ModelKey, int] = {}  # estimated bytes of the loads in flight
+        self.load_seconds: Dict[ModelKey, float] = {}  # wall time of the last load of each key
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(e.nbytes for e in self._entries.values())
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def get(self, path: str, revision: Optional[str] = None, dtype: Optional[str] = None,
+            adapter: Optional[str] = None, quant: Optional[str] = None):
+        key = ModelKey(str(path), revision, dtype, str(adapter) if adapter else None, normalize_quant(quant))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                e = self._entries[key]
+                return e.model, e.tok
+            owner = key not in self._loading
+            if owner:
+                self._loading[key] = Future()
+            pending = self._loading[key]
+        if not owner:
+            return pending.result()  # the same key is being loaded by another thread
+
+        try:
+            estimate = estimate_bytes(key)
+            with self._lock:
+                self._reserved[key] = estimate
+                self._evict(keep=key)
+            start = time.perf_counter()
+            model, tok = self._load(key)
+            with self._lock:
+                self.load_seconds[key] = time.perf_counter() - start
+                self._entries[key] = _Entry(model, tok, model_bytes(model))
+                del self._reserved[key]
+                self._evict(keep=key)
+            pending.set_result((model, tok))
+            return model, tok
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._reserved.pop(key, None)
+                del self._loading[key]
+
+    def evict(self, key: ModelKey) -> bool:
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self, keep: ModelKey):
+        if self.max_bytes is None:
+            return
+        for key in list(self._entries):
+            if self.resident_bytes + sum(self._reserved.values()) <= self.max_bytes:
+                break
+            if key != keep:
+                logger.info(f"registry: evicting {key.path} ({self._entries[key].nbytes / 2**20:.0f} MiB)")
+                del self._entries[key]
+
+    def _load(self, key: ModelKey):
+        path, rev = key.path, ({"revision": key.revision} if key.revision else {})
+        # LoRA adapters (given explicitly or as the model path itself) are
+        # merged once into a content-addressed safetensors copy and loaded
+        # from there, so no per-token LoRA overhead nor per-start merge.
+        if key.adapter or is_adapter_dir(path):
+            adapter = key.adapter or path
+            path = str(merge_adapter(adapter, base=path if key.adapter else None, revision=key.revision,
+                                     trust_remote_code=self.trust_remote_code))
+            rev = {}
+
+        kwargs = dict(trust_remote_code=self.trust_remote_code, **rev)
+        torch_dtype = _torch_dtype(key.dtype)
+        if torch_dtype is not None:
+            kwargs["torch_dtype"] = torch_dtype
+
+        tok = AutoTokenizer.from_pretrained(path, trust_remote_code=self.trust_remote_code, **rev)
+        model = AutoModelForCausalLM.from_pretrained(path, **kwargs)
+        model.eval()
+        if key.quant:
+            model = quantize_model(model, key.quant)
+        return model, tok
+
+
+def _max_bytes_from_env() -> Optional[int]:
+    v = os.environ.get("SLMLAB_MODEL_CACHE_BYTES")
+    return int(v) if v else None
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    """Returns the process-wide registry (cap read from SLMLAB_MODEL_CACHE_BYTES)."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry(max_bytes=_max_bytes_from_env())
+        return _registry
+
+
+def load_model(path: str, revision: Optional[str] = None, dtype: Optional[str] = None,
+               adapter: Optional[str] = None, quant: Optional[str] = None):
+    return get_registry().get(path, revision=revision, dtype=dtype, adapter=adapter, quant=quant)
@@ -0,0 +1,194 @@
+import inspect
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+import torch
+
+from .prefix_cache import _supports_prefix_reuse
+from .xml_constraint import XmlState
+
+SPECULATIVE_MODES = ("none", "prompt_lookup", "draft")
+
+
+@dataclass
+class Speculator:
+    """
+    Drafting strategy for speculative decoding: `num_draft` tokens per step,
+    either copied from the sequence itself (prompt lookup: the tokens that
+    followed the latest earlier occurrence of its last `max_ngram`..1 tokens)
+    or greedily generated by a small `draft_model` sharing the vocabulary.
+    """
+    num_draft: int = 10
+    max_ngram: int = 3
+    draft_model: object = None
+
+    @property
+    def mode(self) -> str:
+        return "draft" if self.draft_model is not None else "prompt_lookup"
+
+
+def make_speculator(mode: Optional[str], num_draft: int = 10, draft_model: Optional[str] = None) -> Optional[Speculator]:
+    """Speculator for a config/CLI mode name; None for plain greedy decoding."""
+    if mode in (None, "", "none"):
+        return None
+    if mode not in SPECULATIVE_MODES:
+        raise ValueError(f"Unknown speculative mode: {mode} (expected one of {', '.join(SPECULATIVE_MODES)})")
+    if mode == "draft":
+        if not draft_model:
+            raise ValueError("speculative mode 'draft' needs a draft model")
+        from .registry import load_model
+        draft, _ = load_model(draft_model)
+        return Speculator(num_draft=num_draft, draft_model=draft)
+    return Speculator(num_draft=num_draft)
+
+
+def prompt_lookup(seq: List[int], num_draft: int, max_ngram: int = 3) -> List[int]:
+    """Continuation of the most recent earlier match of the sequence's trailing n-gram (longest n first)."""
+    for n in range(min(max_ngram, len(seq) - 1), 0, -1):
+        tail = seq[-n:]
+        for start in range(len(seq) - n - 1, -1, -1):
+            if seq[start:start + n] == tail:
+                return seq[start + n:start + n + num_draft]
+    return []
+
+
+class _DraftState:
+    """Draft model key/values over the accepted sequence, cropped back after each verification."""
+
+    def __init__(self, model):
+        self.model = model
+        self.cache = None
+
+    def propose(self, seq: List[int], num_draft: int, stop_ids: set) -> List[int]:
+        cached = self.cache.get_seq_length() if self.cache is not None else 0
+        out = self.model(input_ids=torch.tensor([seq[cached:]], device=self.model.device),
+                         past_key_values=self.cache, use_cache=True)
+        self.cache = out.past_key_values
+        draft = []
+        for _ in range(num_draft):
+            t = int(out.logits[0, -1].argmax())
+            draft.append(t)
+            if t in stop_ids or len(draft) == num_draft:
+                break
+            out = self.model(input_ids=torch.tensor([[t]], device=self.model.device),
+                             past_key_values=self.cache, use_cache=True)
+        return draft
+
+    def accept(self, n_valid: int):
+        # key/values of the accepted sequence stay; rejected draft positions go
+        if self.cache is not None and self.cache.get_seq_length() > n_valid:
+            self.cache.crop(n_valid)
+
+
+@dataclass
+class SpecStats:
+    steps: int = 0  # verification forward passes
+    drafted: int = 0
+    accepted: int = 0
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.drafted if self.drafted else 0.0
+
+
+def _logits_kwargs(model) -> dict:
+    params = inspect.signature(model.forward).parameters
+    if "logits_to_keep" in params:
+        return {"logits_to_keep": 1}
+    if "num_logits_to_keep" in params:
+        return {"num_logits_to_keep": 1}
+    return {}
+
+
+@torch.inference_mode()
+def speculative_generate(model, ids: List[int], max_new_tokens: int, stop_ids: set, spec: Speculator,
+                         past=None, on_token: Optional[Callable[[int], None]] = None,
+                         cancelled: Optional[Callable[[], bool]] = None, guide=None) -> Tuple[List[int], SpecStats]:
+    """
+    Greedy decoding of one sequence where each forward pass verifies a drafted
+    continuation: the longest draft prefix matching the model's own argmax is
+    kept, plus the model's next token, and the key/value cache is cropped to
+    it. The result is the greedy output, usually in far fewer forward passes.
+
+    `ids` is the whole prompt; `past` may hold key/values for its start (a
+    prefix cache). Models whose cache cannot be cropped (recurrent/conv
+    layers) raise ValueError; `generate_batched` checks this beforehand.
+
+    With `guide` (an `XmlGuide`), every position takes the best token that
+    keeps the output well-formed instead of the plain argmax, and decoding
+    ends once the root element is closed.
+    """
+    stats = SpecStats()
+    seq = list(ids)
+    n_past = past.get_seq_length() if past is not None else 0
+    out = model(input_ids=torch.tensor([seq[n_past:]], device=model.device), past_key_values=past, use_cache=True,
+                **_logits_kwargs(model))
+    cache = out.past_key_values
+    if not _supports_prefix_reuse(cache):
+        raise ValueError(f"Speculative decoding needs a croppable cache, {type(model).__name__} "
+                         f"uses {type(cache).__name__}")
+    draft_state = _DraftState(spec.draft_model) if spec.draft_model is not None else None
+    state = XmlState() if guide is not None else None
+
+    def pick(logits, st) -> int:
+        return guide.choose(st, logits) if st is not None else int(logits.argmax())
+
+    nxt = pick(out.logits[0, -1], state)
+    new: List[int] = []
+
+    while True:
+        if nxt in stop_ids:
+            break
+        new.append(nxt)
+        if state is not None:
+            state = guide.advance(state, nxt)
+        if on_token is not None:
+            on_token(nxt)
+        if len(new) >= max_new_tokens or (cancelled is not None and cancelled()) or (state is not None and state.done):
+            break
+        seq.append(nxt)
+
+        budget = min(spec.num_draft, max_new_tokens - len(new))
+        draft: List[int] = []
+        if budget > 0:
+            if draft_state is not None:
+                draft = draft_state.propose(seq, budget, stop_ids)
+            else:
+                draft = prompt_lookup(seq, budget, spec.max_ngram)
+        n_cached = cache.get_seq_length()
+        out = model(input_ids=torch.tensor([[nxt] + draft], device=model.device), past_key_values=cache,
+                    use_cache=True)
+        cache = out.past_key_values
+        if state is None:
+            preds = out.logits[0].argmax(-1).tolist()
+            n_acc = 0
+            while n_acc < len(draft) and draft[n_acc] == preds[n_acc] and draft[n_acc] not in stop_ids:
+                n_acc += 1
+            after = preds[n_acc]
+        else:
+            # The constrained choice at each position depends on the accepted tokens before it
+            probe, n_acc = state.copy(), 0
+            while n_acc < len(draft) and not probe.done and draft[n_acc] not in stop_ids \
+                    and pick(out.logits[0, n_acc], probe) == draft[n_acc]:
+                probe.feed_bytes(guide.piece(draft[n_acc]))
+                n_acc += 1
+            after = pick(out.logits[0, n_acc], probe)
+        stats.steps += 1
+        stats.drafted += len(draft)
+        stats.accepted += n_acc
+        if draft:
+            cache.crop(n_cached + 1 + n_acc)
+        if draft_state is not None:
+            draft_state.accept(len(seq) + n_acc)
+
+        for t in draft[:n_acc]:
+            new.append(t)
+            seq.append(t)
+            if state is not None:
+                state = guide.advance(state, t)
+            if on_token is not None:
+                on_token(t)
+        if len(new) >= max_new_tokens or (state is not None and state.done):
+            break
+        nxt = after
+    return new[:max_new_tokens], stats
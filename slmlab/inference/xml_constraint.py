@@ -0,0 +1,362 @@
+import json
+import re
+import threading
+import weakref
+from typing import List, Optional, Set
+
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
+
+CONSTRAINTS = ("none", "xml")
+
+_ENTITIES = {"amp", "lt", "gt", "quot", "apos"}
+_MAX_ENTITY = 10
+_SPACE = frozenset(" \t\r\n")  # XML whitespace (str.isspace() also accepts control characters)
+_BYTE_DECODER = {c: b for b, c in bytes_to_unicode().items()}  # byte-level BPE alphabet -> byte
+_BYTE_PIECE = re.compile(r"<0x([0-9A-Fa-f]{2})>")  # SentencePiece byte fallback
+
+# modes of XmlState
+(PROLOG, LT, PI, TAG_NAME, IN_TAG, ATTR_NAME, AFTER_ATTR_NAME, AFTER_EQ, ATTR_VALUE, AFTER_VALUE,
+ SELF_CLOSE, CONTENT, END_NAME, END_WS, ENTITY, DONE) = range(16)
+
+
+def _name_start(c: str) -> bool:
+    return c.isalpha() or c in "_:"
+
+
+def _name_char(c: str) -> bool:
+    return c.isalnum() or c in "_:-."
+
+
+class XmlState:
+    """
+    Incremental, character-level well-formedness check of one XML document:
+    tag names are balanced against a stack, attributes are quoted and unique,
+    entities are the predefined or numeric ones, and nothing but whitespace or
+    an XML declaration may precede the root. `done` once the root is closed.
+    Comments, CDATA and DOCTYPE are refused.
+
+    `feed_bytes` takes raw token bytes: a character split across tokens is
+    held in `pending` until it is complete.
+    """
+
+    __slots__ = ("mode", "stack", "name", "attrs", "end_pos", "quote", "entity", "entity_return", "prev", "pending")
+
+    def __init__(self):
+        self.mode = PROLOG
+        self.stack: List[str] = []
+        self.name = ""
+        self.attrs: Set[str] = set()
+        self.end_pos = 0
+        self.quote = ""
+        self.entity = ""
+        self.entity_return = CONTENT
+        self.prev = ""
+        self.pending = b""
+
+    @property
+    def done(self) -> bool:
+        return self.mode == DONE
+
+    def copy(self) -> "XmlState":
+        s = XmlState.__new__(XmlState)
+        s.mode, s.stack, s.name, s.attrs = self.mode, list(self.stack), self.name, set(self.attrs)
+        s.end_pos, s.quote, s.entity, s.entity_return, s.prev = (self.end_pos, self.quote, self.entity,
+                                                                   self.entity_return, self.prev)
+        s.pending = self.pending
+        return s
+
+    def feed(self, text: str) -> bool:
+        """Advances over `text`; False as soon as it can no longer be well-formed (the state is then unusable)."""
+        for c in text:
+            if not self._step(c):
+                return False
+        return True
+
+    def feed_bytes(self, data: bytes) -> bool:
+        """`feed` for UTF-8 bytes; an incomplete character at the end waits for the next call."""
+        data = self.pending + data
+        try:
+            text, self.pending = data.decode("utf-8"), b""
+        except UnicodeDecodeError as e:
+            if e.reason != "unexpected end of data":
+                return False
+            text, self.pending = data[:e.start].decode("utf-8"), data[e.start:]
+        if not self.feed(text):
+            return False
+        # only text and attribute values take any character
+        return not self.pending or self.mode in (CONTENT, ATTR_VALUE, PI)
+
+    def _open(self) -> bool:
+        self.stack.append(self.name)
+        self.mode = CONTENT
+        return True
+
+    def _closed(self) -> bool:
+        self.mode = DONE if not self.stack else CONTENT
+        return True
+
+    def _step(self, c: str) -> bool:
+        m = self.mode
+        if m == CONTENT:
+            if c == "<":
+                self.mode = LT
+            elif c == "&":
+                self.mode, self.entity, self.entity_return = ENTITY, "", CONTENT
+            return True
+        if m == ATTR_VALUE:
+            if c == self.quote:
+                self.mode = AFTER_VALUE
+            elif c == "<":
+                return False
+            elif c == "&":
+                self.mode, self.entity, self.entity_return = ENTITY, "", ATTR_VALUE
+            return True
+        if m == PROLOG:
+            if c == "<":
+                self.mode = LT
+                return True
+            return c in _SPACE
+        if m == LT:
+            if _name_start(c):
+                self.mode, self.name, self.attrs = TAG_NAME, c, set()
+                return True
+            if c == "/" and self.stack:
+                self.mode, self.end_pos = END_NAME, 0
+                return True
+            if c == "?" and not self.stack:
+                self.mode, self.prev = PI, ""
+                return True
+            return False
+        if m == TAG_NAME:
+            if _name_char(c):
+                self.name += c
+                return True
+            if c in _SPACE:
+                self.mode = IN_TAG
+                return True
+            if c == ">":
+                return self._open()
+            if c == "/":
+                self.mode = SELF_CLOSE
+                return True
+            return False
+        if m in (IN_TAG, AFTER_VALUE):
+            if c in _SPACE:
+                self.mode = IN_TAG
+                return True
+            if c == ">":
+                return self._open()
+            if c == "/":
+                self.mode = SELF_CLOSE
+                return True
+            if m == IN_TAG and _name_start(c):
+                self.mode, self.entity = ATTR_NAME, c  # attribute name collected in `entity`
+                return True
+            return False
+        if m == ATTR_NAME:
+            if _name_char(c):
+                self.entity += c
+                return True
+            if c in _SPACE or c == "=":
+                if self.entity in self.attrs:
+                    return False
+                self.attrs.add(self.entity)
+                self.mode = AFTER_EQ if c == "=" else AFTER_ATTR_NAME
+                return True
+            return False
+        if m == AFTER_ATTR_NAME:
+            if c == "=":
+                self.mode = AFTER_EQ
+                return True
+            return c in _SPACE
+        if m == AFTER_EQ:
+            if c in "\"'":
+                self.mode, self.quote = ATTR_VALUE, c
+                return True
+            return c in _SPACE
+        if m == SELF_CLOSE:
+            return c == ">" and self._closed()
+        if m == END_NAME:
+            expected = self.stack[-1]
+            if self.end_pos < len(expected):
+                if c != expected[self.end_pos]:
+                    return False
+                self.end_pos += 1
+                return True
+            if c == ">":
+                self.stack.pop()
+                return self._closed()
+            if c in _SPACE:
+                self.mode = END_WS
+                return True
+            return False
+        if m == END_WS:
+            if c == ">":
+                self.stack.pop()
+                return self._closed()
+            return c in _SPACE
+        if m == ENTITY:
+            if c == ";":
+                e = self.entity
+                ok = e in _ENTITIES or (e[:2] == "#x" and len(e) > 2 and all(ch in "0123456789abcdefABCDEF" for ch in e[2:])) \
+                    or (e[:1] == "#" and e[1:].isdigit())
+                self.mode = self.entity_return
+                return ok
+            if len(self.entity) >= _MAX_ENTITY or not (c.isalnum() or c == "#"):
+                return False
+            self.entity += c
+            return True
+        if m == PI:
+            if self.prev == "?" and c == ">":
+                self.mode = PROLOG
+            self.prev = c
+            return True
+        return False  # DONE: nothing may follow the root
+
+
+class XmlGuide:
+    """
+    Picks, among a row's highest-scoring tokens, the best one that keeps the
+    document well-formed. The top `top_k` candidates are checked first, so a
+    step usually costs a few string checks; the rest of the vocabulary only
+    when none of them fits. If no token fits, the model's own choice is kept
+    and the row is no longer constrained.
+
+    Tokens are checked as the bytes they add to the output, read from the
+    vocabulary pieces (byte-level BPE or SentencePiece with byte fallback):
+    decoding a token on its own drops SentencePiece's leading space and turns
+    partial characters into U+FFFD.
+    """
+
+    def __init__(self, tok, stop_ids: Set[int], top_k: int = 32):
+        self.tok = tok
+        self.stop_ids = set(stop_ids)
+        self.top_k = top_k
+        self._pieces = {}
+        self._scheme = _piece_scheme(tok)
+        # as in the decoded output: special tokens are dropped, hence never chosen
+        self._special = set(tok.all_special_ids) | {i for i, t in tok.added_tokens_decoder.items() if t.special}
+        self._added = set(tok.added_tokens_decoder)
+        self.eos = next(iter(sorted(self.stop_ids)), None) if tok.eos_token_id is None else tok.eos_token_id
+
+    def piece(self, token_id: int) -> bytes:
+        """The bytes `token_id` adds to the decoded output."""
+        b = self._pieces.get(token_id)
+        if b is None:
+            b = self._pieces[token_id] = self._piece_bytes(token_id)
+        return b
+
+    def _piece_bytes(self, token_id: int) -> bytes:
+        if token_id in self._special:
+            return b""
+        if token_id not in self._added:  # added tokens are stored as their literal text
+            p = self.tok.convert_ids_to_tokens(token_id)
+            if self._scheme == "byte_level" and all(c in _BYTE_DECODER for c in p):
+                return bytes(_BYTE_DECODER[c] for c in p)
+            if self._scheme == "sentencepiece":
+                m = _BYTE_PIECE.fullmatch(p)
+                return bytes([int(m.group(1), 16)]) if m else p.replace("\u2581", " ").encode("utf-8")
+        return self.tok.decode([token_id], skip_special_tokens=True).encode("utf-8")
+
+    def allowed(self, state: XmlState, token_id: int) -> bool:
+        if token_id in self.stop_ids:
+            return state.done
+        if state.done:
+            return False
+        piece = self.piece(token_id)
+        return bool(piece) and state.copy().feed_bytes(piece)
+
+    def choose(self, state: XmlState, scores: torch.Tensor) -> int:
+        if state.done and self.eos is not None:
+            return self.eos
+        top = torch.topk(scores, min(self.top_k, scores.shape[-1])).indices.tolist()
+        for t in top:
+            if self.allowed(state, t):
+                return t
+        for t in torch.argsort(scores, descending=True)[len(top):].tolist():
+            if self.allowed(state, t):
+                return t
+        return int(scores.argmax())
+
+    def advance(self, state: XmlState, token_id: int) -> Optional[XmlState]:
+        """State after `token_id`, or None when the token breaks the document (the row is left unconstrained)."""
+        if token_id in self.stop_ids:
+            return state
+        return state if state.feed_bytes(self.piece(token_id)) else None
+
+
+def _piece_scheme(tok) -> Optional[str]:
+    """How vocabulary pieces map to output bytes: "byte_level", "sentencepiece", or None (decode each token)."""
+    if hasattr(tok, "backend_tokenizer"):
+        decoder = json.dumps(json.loads(tok.backend_tokenizer.to_str()).get("decoder"), ensure_ascii=False)
+        if "ByteLevel" in decoder:
+            return "byte_level"
+        if "\u2581" in decoder or "Metaspace" in decoder:
+            return "sentencepiece"
+        return None
+    if hasattr(tok, "byte_decoder"):
+        return "byte_level"
+    return "sentencepiece" if hasattr(tok, "sp_model") else None
+
+
+_guides: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def get_xml_guide(tok, stop_ids: Set[int]) -> XmlGuide:
+    """One guide (and decoded-token table) per tokenizer."""
+    with _lock:
+        guide = _guides.get(tok)
+        if guide is None or guide.stop_ids != set(stop_ids):
+            guide = _guides[tok] = XmlGuide(tok, stop_ids)
+        return guide
+
+
+class XmlConstraint(LogitsProcessor):
+    """
+    Per-row XML states for one `generate` call: leaves each row only its
+    chosen well-formed token (only the end of sequence once the root is
+    closed). Pair it with `XmlStop` to end rows at the closing root tag.
+    """
+
+    def __init__(self, guide: XmlGuide, n_rows: int):
+        self.guide = guide
+        self.states: List[Optional[XmlState]] = [XmlState() for _ in range(n_rows)]
+        self._seen: Optional[int] = None
+
+    def _update(self, input_ids):
+        width = input_ids.shape[1]
+        if self._seen is None:
+            self._seen = width  # first call: the prompt
+            return
+        for r, toks in enumerate(input_ids[:, self._seen:].tolist()):
+            for t in toks:
+                if self.states[r] is not None and not self.states[r].done:
+                    self.states[r] = self.guide.advance(self.states[r], t)
+        self._seen = width
+
+    def __call__(self, input_ids, scores):
+        self._update(input_ids)
+        for r, state in enumerate(self.states):
+            if state is not None:
+                t = self.guide.choose(state, scores[r])
+                keep = scores[r, t].clone()
+                scores[r] = float("-inf")
+                scores[r, t] = keep
+        return scores
+
+    def done(self, input_ids) -> torch.Tensor:
+        self._update(input_ids)
+        return torch.tensor([s is not None and s.done for s in self.states], device=input_ids.device)
+
+
+class XmlStop(StoppingCriteria):
+    """Ends rows whose document is complete."""
+
+    def __init__(self, constraint: XmlConstraint):
+        self.constraint = constraint
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.constraint.done(input_ids)
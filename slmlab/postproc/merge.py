@@ -0,0 +1,143 @@
+import fnmatch
+import json
+import logging
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Optional
+
+from slmlab.utils.fingerprint import digests_fingerprint, dir_fingerprint, memo_get, memo_put, text_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "artifacts/merged"
+_WEIGHT_PATTERNS = ["config.json", "*.safetensors", "*.bin"]
+_ADAPTER_PATTERNS = ["adapter_config.json", "adapter_model.safetensors", "adapter_model.bin"]
+_MANIFEST = "slmlab_merge.json"
+_COMMIT = re.compile(r"[0-9a-f]{40}")
+
+
+def is_adapter_dir(path: str | Path) -> bool:
+    return (Path(path) / "adapter_config.json").exists()
+
+
+def adapter_base(adapter_dir: str | Path) -> str:
+    with open(Path(adapter_dir) / "adapter_config.json", encoding="utf-8") as f:
+        return json.load(f)["base_model_name_or_path"]
+
+
+def local_model_dir(name_or_path: str, revision: Optional[str] = None) -> Path:
+    """A local model dir as is; a hub id as a snapshot of its config, tokenizer and weight files."""
+    if Path(name_or_path).is_dir():
+        return Path(name_or_path)
+    from huggingface_hub import snapshot_download
+    return Path(snapshot_download(name_or_path, revision=revision,
+                                  allow_patterns=_WEIGHT_PATTERNS + ["*.json", "*.model", "*.txt"]))
+
+
+def resolve_revision(repo_id: str, revision: Optional[str] = None) -> str:
+    """
+    Commit sha of a hub revision: as is when already a sha, else the ref the
+    local Hugging Face cache recorded at the last download, else asked from
+    the hub (no file metadata).
+    """
+    revision = revision or "main"
+    if _COMMIT.fullmatch(revision):
+        return revision
+    from huggingface_hub import HfApi, constants
+    from huggingface_hub.file_download import repo_folder_name
+    ref = Path(constants.HF_HUB_CACHE) / repo_folder_name(repo_id=repo_id, repo_type="model") / "refs" / revision
+    if ref.is_file():
+        return ref.read_text().strip()
+    return HfApi().model_info(repo_id, revision=revision).sha
+
+
+def hub_weight_digests(repo_id: str, revision: Optional[str] = None) -> dict:
+    """
+    Digests of a hub model's config and weight files from the repo metadata,
+    without downloading them: the LFS sha256 or the git blob id, which are
+    also the blob names of a local snapshot.
+    """
+    from huggingface_hub import HfApi
+    info = HfApi().model_info(repo_id, revision=revision, files_metadata=True)
+    digests = {s.rfilename: s.lfs.sha256 if s.lfs else s.blob_id for s in info.siblings or []
+               if "/" not in s.rfilename and any(fnmatch.fnmatch(s.rfilename, pat) for pat in _WEIGHT_PATTERNS)}
+    if not digests:
+        raise FileNotFoundError(f"No files matching {_WEIGHT_PATTERNS} in {repo_id}@{revision or 'main'}")
+    return digests
+
+
+def weights_fingerprint(name_or_path: str, revision: Optional[str] = None) -> str:
+    """
+    Content hash of a model's config and weight files. Hub ids are hashed from
+    the repo metadata, or the cached snapshot when offline, never downloaded;
+    the metadata is fetched once per commit and memoized, as are the digests
+    of local files (per path, size and mtime).
+    """
+    if Path(name_or_path).is_dir():
+        return dir_fingerprint(name_or_path, _WEIGHT_PATTERNS)
+    try:
+        sha = resolve_revision(name_or_path, revision)
+        key = f"hub:{name_or_path}@{sha}"
+        digests = memo_get(key)
+        if digests is None:
+            digests = hub_weight_digests(name_or_path, sha)
+            memo_put(key, digests)
+        return digests_fingerprint(digests)
+    except OSError:
+        # offline or unreachable hub: the same digests from an already cached snapshot
+        from huggingface_hub import snapshot_download
+        snapshot = snapshot_download(name_or_path, revision=revision, allow_patterns=_WEIGHT_PATTERNS,
+                                     local_files_only=True)
+        return dir_fingerprint(snapshot, _WEIGHT_PATTERNS)
+
+
+def merge_key(base: str, adapter: str, revision: Optional[str] = None) -> str:
+    """Content address of a merged model: hash of base weights + adapter weights, computed without downloading the base."""
+    base_fp = weights_fingerprint(base, revision)
+    adapter_fp = dir_fingerprint(adapter, _ADAPTER_PATTERNS)
+    return text_fingerprint(base_fp, adapter_fp)[:24]
+
+
+def merge_adapter(adapter: str, base: Optional[str] = None, revision: Optional[str] = None,
+                  cache_dir: str | Path | None = None, trust_remote_code: bool = True) -> Path:
+    """
+    Merges a LoRA adapter into its base weights once and stores the result as
+    safetensors under `cache_dir/<merge key>` (default: $SLMLAB_MERGED_CACHE or
+    artifacts/merged). Later calls with the same base and adapter content
+    return the cached directory without touching peft.
+    """
+    base = base or adapter_base(adapter)
+    if not Path(base).is_dir():
+        try:
+            revision = resolve_revision(base, revision)  # the key and the merged weights name one commit
+        except OSError:
+            pass  # offline without a recorded ref: keyed from the cached snapshot
+    cache_dir = cache_dir or os.environ.get("SLMLAB_MERGED_CACHE", DEFAULT_CACHE_DIR)
+    out = Path(cache_dir) / merge_key(base, adapter, revision)
+    if (out / _MANIFEST).exists():
+        return out
+
+    import torch
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    logger.info(f"merging {adapter} into {base} -> {out}")
+    model = AutoModelForCausalLM.from_pretrained(base, revision=revision, torch_dtype="auto",
+                                                 trust_remote_code=trust_remote_code)
+    with torch.no_grad():
+        model = PeftModel.from_pretrained(model, adapter).merge_and_unload()
+
+    tok_src = adapter if (Path(adapter) / "tokenizer_config.json").exists() else base
+    tok = AutoTokenizer.from_pretrained(tok_src, trust_remote_code=trust_remote_code)
+
+    # Write to a temp dir and rename so a crashed merge never looks complete
+    tmp = out.with_name(out.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    model.save_pretrained(tmp, safe_serialization=True)
+    tok.save_pretrained(tmp)
+    (tmp / _MANIFEST).write_text(json.dumps({"base": base, "revision": revision, "adapter": str(adapter)}, indent=2))
+    shutil.rmtree(out, ignore_errors=True)
+    tmp.rename(out)
+    return out
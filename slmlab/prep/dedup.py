@@ -0,0 +1,349 @@
+import hashlib
+import json
+import logging
+import re
+import shutil
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_MASK32 = np.uint64(0xFFFFFFFF)
+EMPTY = np.iinfo(np.uint32).max  # signature value of a text without shingles (the minimum of nothing)
+_BLOCK_BYTES = 1 << 20
+_VERSION = 2
+
+
+def normalize(text: str) -> str:
+    """Lower-cased, punctuation-free, whitespace-collapsed text: what near-duplicates are compared on."""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def dedup_text(row: dict, fields: Iterable[str]) -> str:
+    return "\n".join(str(row.get(f, "")) for f in fields)
+
+
+def key_hash(key: str) -> int:
+    """64-bit id of a row key (see cli.io._row_key)."""
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big")
+
+
+def lsh_params(threshold: float, num_perm: int, recall: float = 0.95) -> Tuple[int, int]:
+    """
+    (bands, rows) with bands * rows <= num_perm that make a pair at `threshold`
+    a candidate with probability >= `recall`, with the fewest candidates below
+    it (those only cost a signature comparison each).
+    """
+    xs = np.linspace(0.0, threshold, 101)
+    best, best_fp = (num_perm, 1), float("inf")
+    for b in range(1, num_perm + 1):
+        for r in range(1, num_perm // b + 1):
+            if 1.0 - (1.0 - threshold ** r) ** b < recall:
+                continue
+            fp = (1.0 - (1.0 - xs ** r) ** b).mean()
+            if fp < best_fp:
+                best, best_fp = (b, r), fp
+    return best
+
+
+def shingle_hashes(text: str, ngram: int) -> np.ndarray:
+    """
+    Distinct 32-bit hashes of the byte n-grams of the normalized text (rolling
+    polynomial, vectorized); empty for a text with nothing left to compare.
+    """
+    data = np.frombuffer(normalize(text).encode("utf-8"), dtype=np.uint8).astype(np.uint64)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    n = min(ngram, len(data))
+    windows = np.lib.stride_tricks.sliding_window_view(data, n)
+    powers = np.array([pow(257, n - 1 - i, 1 << 64) for i in range(n)], dtype=np.uint64)
+    h = (windows * powers).sum(axis=1, dtype=np.uint64)  # wraps mod 2**64
+    return np.unique((h ^ (h >> np.uint64(32))) & _MASK32)
+
+
+class MinHasher:
+    """
+    `num_perm` multiply-shift hashes (((a * x + b) mod 2**64) >> 32, a odd)
+    standing in for random permutations of the shingle hashes.
+    """
+
+    def __init__(self, num_perm: int = 128, ngram: int = 5, seed: int = 42):
+        rng = np.random.default_rng(seed)
+        self.num_perm, self.ngram = num_perm, ngram
+        self.a = rng.integers(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """
+        (len(texts), num_perm) uint32 MinHash signatures. Documents are hashed
+        together in blocks of about _BLOCK_BYTES of hash values, computed in
+        place in one buffer that stays in cache, then reduced per document.
+        Texts without shingles (empty once normalized) get all-EMPTY rows,
+        which the index leaves out of deduplication.
+        """
+        out = np.full((len(texts), self.num_perm), EMPTY, dtype=np.uint32)
+        all_shingles = [shingle_hashes(t, self.ngram) for t in texts]
+        rows = [i for i, sh in enumerate(all_shingles) if len(sh)]
+        shingles = [all_shingles[i] for i in rows]
+        block_rows = max(1, _BLOCK_BYTES // (8 * self.num_perm))
+        buf = np.empty((block_rows, self.num_perm), dtype=np.uint64)
+        start = 0
+        while start < len(shingles):
+            end, size = start, 0
+            while end < len(shingles) and (end == start or size + len(shingles[end]) <= block_rows):
+                size += len(shingles[end])
+                end += 1
+            block = np.concatenate(shingles[start:end])
+            values = buf[:len(block)] if len(block) <= block_rows else np.empty((len(block), self.num_perm), np.uint64)
+            np.multiply(block[:, None], self.a, out=values)  # wraps mod 2**64
+            values += self.b
+            values >>= np.uint64(32)
+            offsets = np.cumsum([0] + [len(s) for s in shingles[start:end - 1]])
+            out[rows[start:end]] = np.minimum.reduceat(values, offsets, axis=0)
+            start = end
+        return out
+
+
+class MinHashIndex:
+    """
+    On-disk LSH index of the documents kept by previous builds. A document is
+    a near-duplicate of a kept one when they share a band of their MinHash
+    signatures and the estimated Jaccard similarity reaches `threshold`; it is
+    then recorded under that document and dropped. A kept document at least
+    `split_threshold` similar to an indexed one joins that one's split, so
+    pairs the estimate puts just under `threshold` can't straddle it either.
+    Rows already indexed keep their verdict and split, so incremental builds
+    only hash and query new rows.
+
+    Band keys live in per-band sorted arrays, repeats included, so every
+    document sharing a band key is a candidate (batched `searchsorted` for
+    the range of each key); signatures in an .npy opened memory-mapped. Rows
+    with nothing to compare (empty normalized text) are kept as they are and
+    never indexed.
+    """
+
+    def __init__(self, path: str | Path, threshold: float = 0.85, split_threshold: float = 0.7, num_perm: int = 128,
+                 ngram: int = 5, seed: int = 42):
+        self.path = Path(path)
+        self.threshold = threshold
+        self.split_threshold = min(split_threshold, threshold)
+        self.bands, self.rows = lsh_params(self.split_threshold, num_perm)
+        self.params = {"version": _VERSION, "threshold": threshold, "split_threshold": self.split_threshold,
+                       "num_perm": num_perm, "ngram": ngram, "seed": seed, "bands": self.bands,
+                       "rows_per_band": self.rows}
+        self.hasher = MinHasher(num_perm, ngram, seed)
+        rng = np.random.default_rng(seed + 1)
+        self._band_mult = rng.integers(1, 1 << 63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+
+        empty = np.zeros(0, dtype=np.uint64)
+        self._sigs = np.zeros((0, num_perm), dtype=np.uint32)
+        self._band_keys = np.zeros((0, self.bands), dtype=np.uint64)
+        self._doc_keys, self._dup_keys, self._dup_reps = empty, empty, np.zeros(0, dtype=np.int64)
+        self._evals = np.zeros(0, dtype=bool)
+        self._load()
+        self._sorted_bands = [self._sorted(self._band_keys[:, j]) for j in range(self.bands)]
+        self._sorted_docs = self._sorted(self._doc_keys)
+        self._sorted_dups = self._sorted(self._dup_keys)
+
+        # Added in this session, merged into the arrays by save()
+        self._new_sigs: List[np.ndarray] = []
+        self._new_bands: List[np.ndarray] = []
+        self._new_keys: List[int] = []
+        self._new_evals: List[bool] = []
+        self._new_labels: List[str] = []
+        self._new_dups: Dict[int, int] = {}
+        self._pending: List[Dict[int, List[int]]] = [{} for _ in range(self.bands)]
+        self._kept: Dict[int, int] = {}  # key hash -> document, for the rows of this build
+        self._dropped: Dict[int, int] = {}  # key hash -> the document it duplicates
+        self.clusters: Counter = Counter()  # representative -> duplicates dropped in this build
+        self.similarity: Dict[int, float] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self._doc_keys) + len(self._new_keys)
+
+    @staticmethod
+    def _sorted(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        order = np.argsort(keys, kind="stable")
+        return keys[order], order
+
+    @staticmethod
+    def _lookup(index: Tuple[np.ndarray, np.ndarray], keys: np.ndarray) -> np.ndarray:
+        """Position of each key in the indexed array, or -1."""
+        values, order = index
+        if len(values) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(values, keys), len(values) - 1)
+        return np.where(values[pos] == keys, order[pos], -1)
+
+    @staticmethod
+    def _ranges(index: Tuple[np.ndarray, np.ndarray], keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """[start, end) of each key's run in the sorted keys of the index."""
+        values = index[0]
+        return np.searchsorted(values, keys, side="left"), np.searchsorted(values, keys, side="right")
+
+    def _load(self):
+        meta_path = self.path / "meta.json"
+        if not meta_path.exists():
+            return
+        meta = json.loads(meta_path.read_text())
+        if meta.get("params") != self.params:
+            logger.warning(f"dedup index {self.path} was built with other parameters; starting a new one")
+            return
+        self._sigs = np.load(self.path / "signatures.npy", mmap_mode="r")
+        self._band_keys = np.load(self.path / "bands.npy")
+        keys = np.load(self.path / "keys.npz")
+        self._doc_keys, self._dup_keys, self._dup_reps = keys["docs"], keys["dup_keys"], keys["dup_reps"]
+        self._evals = keys["evals"]
+        logger.info(f"dedup index {self.path}: {len(self._doc_keys)} documents, {len(self._dup_keys)} duplicates")
+
+    def _band_hashes(self, sigs: np.ndarray) -> np.ndarray:
+        bands = sigs[:, :self.bands * self.rows].reshape(len(sigs), self.bands, self.rows).astype(np.uint64)
+        return (bands * self._band_mult).sum(axis=2, dtype=np.uint64)
+
+    def _is_eval(self, doc: int) -> bool:
+        n = len(self._doc_keys)
+        return bool(self._evals[doc]) if doc < n else self._new_evals[doc - n]
+
+    def add(self, keys: List[str], is_eval: List[bool], texts: Optional[List[str]] = None,
+            labels: Optional[List[str]] = None, sigs: Optional[np.ndarray] = None) -> Tuple[np.ndarray, List[bool]]:
+        """
+        Indexes a batch in order, given each row's proposed split. Returns per
+        row the kept document it duplicates (-1 when the row is kept) and the
+        split to write it to. `sigs` may be precomputed (e.g. in worker
+        processes) with `self.hasher`.
+        """
+        is_eval = list(is_eval)
+        hashes = np.array([key_hash(k) for k in keys], dtype=np.uint64)
+        known_docs = self._lookup(self._sorted_docs, hashes)
+        known_dups = self._lookup(self._sorted_dups, hashes)
+        todo = np.flatnonzero((known_docs < 0) & (known_dups < 0))
+        if sigs is None:
+            sigs = np.zeros((len(keys), self.hasher.num_perm), dtype=np.uint32)
+            sigs[todo] = self.hasher.signatures([texts[i] for i in todo])
+        bands = self._band_hashes(sigs)
+        hit_ranges = [self._ranges(self._sorted_bands[j], bands[:, j]) for j in range(self.bands)]
+        empty = (sigs == EMPTY).all(axis=1)
+
+        reps = np.full(len(keys), -1, dtype=np.int64)
+        for i, h in enumerate(hashes.tolist()):
+            if h in self._kept or h in self._dropped:  # repeated row key: an exact duplicate
+                reps[i] = self._kept.get(h, self._dropped.get(h))
+                self._record(int(reps[i]), 1.0 if h in self._kept else None)
+                continue
+            if known_docs[i] >= 0:
+                self._kept[h] = int(known_docs[i])
+                is_eval[i] = self._is_eval(int(known_docs[i]))
+                continue
+            if known_dups[i] >= 0:
+                reps[i] = self._dropped[h] = int(self._dup_reps[known_dups[i]])
+                self._record(int(reps[i]), None)
+                continue
+            if empty[i]:
+                continue  # nothing to compare: kept, not indexed
+            base_hits = np.concatenate([self._sorted_bands[j][1][lo[i]:hi[i]] for j, (lo, hi) in enumerate(hit_ranges)])
+            rep, sim, anchor = self._match(sigs[i], bands[i], base_hits)
+            if rep >= 0:
+                reps[i] = self._dropped[h] = self._new_dups[h] = rep
+                self._record(rep, sim)
+                continue
+            if anchor >= 0:
+                is_eval[i] = self._is_eval(anchor)
+            doc = self._kept[h] = self.size
+            self._new_evals.append(bool(is_eval[i]))
+            self._new_sigs.append(sigs[i])
+            self._new_bands.append(bands[i])
+            self._new_keys.append(h)
+            self._new_labels.append((labels[i] if labels else keys[i])[:200])
+            for j, k in enumerate(bands[i].tolist()):
+                self._pending[j].setdefault(k, []).append(doc)
+        return reps, is_eval
+
+    def _record(self, rep: int, sim: Optional[float]):
+        self.clusters[rep] += 1
+        if sim is not None:
+            self.similarity[rep] = min(self.similarity.get(rep, 1.0), sim)
+
+    def _match(self, sig: np.ndarray, bands: np.ndarray, base_hits: np.ndarray) -> Tuple[int, float, int]:
+        """(duplicated document or -1, its similarity, most similar document above split_threshold or -1)"""
+        candidates = set(base_hits.tolist())
+        for p, k in zip(self._pending, bands.tolist()):
+            candidates.update(p.get(k, ()))
+        best, best_sim = -1, 0.0
+        if candidates:
+            docs = np.array(sorted(candidates))
+            n = len(self._doc_keys)
+            old, new = docs[docs < n], docs[docs >= n]
+            cand_sigs = np.concatenate([self._sigs[old], np.array([self._new_sigs[d - n] for d in new],
+                                                                   dtype=np.uint32).reshape(-1, len(sig))])
+            sims = (cand_sigs == sig).mean(axis=1)
+            i = int(sims.argmax())  # first of the most similar, as in document order
+            if sims[i] >= self.split_threshold:
+                best, best_sim = int(docs[i]), float(sims[i])
+        if best_sim >= self.threshold:
+            return best, best_sim, best
+        return -1, best_sim, best
+
+    def label(self, docs: Iterable[int]) -> Dict[int, str]:
+        """Display text (truncated row key) of kept documents."""
+        wanted, out = set(docs), {}
+        n = len(self._doc_keys)
+        for d in wanted:
+            if d >= n:
+                out[d] = self._new_labels[d - n]
+        if any(d < n for d in wanted) and (self.path / "labels.jsonl").exists():
+            with open(self.path / "labels.jsonl", encoding="utf-8") as f:
+                for d, line in enumerate(f):
+                    if d in wanted:
+                        out[d] = json.loads(line)
+        return out
+
+    def save(self):
+        """Merges this session's documents into the index files (written to a temporary dir, then swapped in)."""
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        new_sigs = np.array(self._new_sigs, dtype=np.uint32).reshape(-1, self.hasher.num_perm)
+        new_bands = np.array(self._new_bands, dtype=np.uint64).reshape(-1, self.bands)
+        sigs = np.lib.format.open_memmap(tmp / "signatures.npy", mode="w+", dtype=np.uint32,
+                                         shape=(self.size, self.hasher.num_perm))
+        sigs[:len(self._sigs)] = self._sigs
+        sigs[len(self._sigs):] = new_sigs
+        sigs.flush()
+        del sigs
+        np.save(tmp / "bands.npy", np.concatenate([self._band_keys, new_bands]))
+        dups = sorted(self._new_dups.items())
+        np.savez(tmp / "keys.npz",
+                 docs=np.concatenate([self._doc_keys, np.array(self._new_keys, dtype=np.uint64)]),
+                 evals=np.concatenate([self._evals, np.array(self._new_evals, dtype=bool)]),
+                 dup_keys=np.concatenate([self._dup_keys, np.array([k for k, _ in dups], dtype=np.uint64)]),
+                 dup_reps=np.concatenate([self._dup_reps, np.array([r for _, r in dups], dtype=np.int64)]))
+        old_labels = self.path / "labels.jsonl"
+        with open(tmp / "labels.jsonl", "w", encoding="utf-8") as f:
+            if old_labels.exists():
+                with open(old_labels, encoding="utf-8") as old:
+                    shutil.copyfileobj(old, f)
+            f.writelines(json.dumps(l, ensure_ascii=False) + "\n" for l in self._new_labels)
+        (tmp / "meta.json").write_text(json.dumps({"params": self.params, "documents": self.size,
+                                                   "duplicates": len(self._dup_keys) + len(dups)}, indent=2))
+        self._sigs = None  # release the mmap before replacing its file
+        shutil.rmtree(self.path, ignore_errors=True)
+        tmp.rename(self.path)
+
+    def report(self, n_rows: int, top: int = 50) -> dict:
+        """Duplicate clusters of this build: kept document, duplicates dropped, lowest similarity."""
+        biggest = self.clusters.most_common(top)
+        labels = self.label(d for d, _ in biggest)
+        return {
+            "rows": n_rows,
+            "kept": n_rows - sum(self.clusters.values()),
+            "duplicates": sum(self.clusters.values()),
+            "clusters": len(self.clusters),
+            **self.params,
+            "largest_clusters": [{"kept": labels.get(d, ""), "duplicates": n,
+                                  "min_similarity": round(self.similarity[d], 3) if d in self.similarity else None}
+                                 for d, n in biggest],
+        }
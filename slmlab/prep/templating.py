@@ -1,3 +1,4 @@
+from string import Formatter
 from typing import Dict, Any
 
 def make_example(sample: dict, config: Any) -> Dict[str, Any]:
@@ -37,4 +38,21 @@ def make_example(sample: dict, config: Any) -> Dict[str, Any]:
         return {"messages": messages}
 
     else:
-        raise ValueError(f"Unknown mode: {mode}")
\ No newline at end of file
+        raise ValueError(f"Unknown mode: {mode}")
+
+def template_prefix(config: Any) -> str:
+    """
+    Returns the static part of the base-mode instruction, i.e. everything
+    before its first placeholder. Empty in chat mode or without a template.
+    """
+    if getattr(config.templating, "mode", "base") != "base":
+        return ""
+    prompts = getattr(config.templating, "prompts", None)
+    base_instruction = getattr(prompts, "base_instruction", None) or ""
+
+    prefix = ""
+    for literal, field, _, _ in Formatter().parse(base_instruction):
+        prefix += literal
+        if field is not None:
+            break
+    return prefix
@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from datasets import DatasetDict, load_from_disk
+
+from slmlab.utils.fingerprint import files_fingerprint, text_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "artifacts/tokenized"
+_META = "slmlab_cache.json"
+
+
+def cache_dir(root: str | Path | None = None) -> Path:
+    return Path(root or os.environ.get("SLMLAB_TOKEN_CACHE", DEFAULT_CACHE_DIR))
+
+
+def tokenizer_fingerprint(tok) -> str:
+    """Content hash of the tokenizer (vocab/merges, special tokens, chat template)."""
+    backend = getattr(tok, "backend_tokenizer", None)
+    state = backend.to_str() if backend is not None else repr(sorted(tok.get_vocab().items()))
+    return text_fingerprint(state, tok.special_tokens_map, tok.chat_template, tok.padding_side, tok.truncation_side)
+
+
+def dataset_fingerprint(data_files: Dict[str, str | Path], tok, **params) -> str:
+    """
+    Key of a tokenized dataset: input file contents, tokenizer content and
+    every parameter that changes the produced ids (mode, max_length, ...).
+    """
+    inputs = files_fingerprint(data_files.values())
+    return text_fingerprint(inputs, sorted(data_files), tokenizer_fingerprint(tok), sorted(params.items()))[:24]
+
+
+def load_or_build(key: str, build: Callable[[], DatasetDict], meta: Optional[dict] = None,
+                  root: str | Path | None = None) -> DatasetDict:
+    """
+    Returns the cached tokenized dataset for `key`, building and persisting it
+    first if needed. Entries are Arrow files opened memory-mapped, so loading
+    is zero-copy and independent of dataset size.
+    """
+    path = cache_dir(root) / key
+    if (path / _META).exists():
+        logger.info(f"tokenized cache hit: {path}")
+        os.utime(path / _META)  # mtime doubles as last-used time for pruning
+        return load_from_disk(str(path))
+
+    logger.info(f"tokenized cache miss: building {path}")
+    ds = build()
+    tmp = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    ds.save_to_disk(str(tmp))
+    (tmp / _META).write_text(json.dumps({"created": time.time(), **(meta or {})}, indent=2, default=str))
+    shutil.rmtree(path, ignore_errors=True)
+    tmp.rename(path)
+    return load_from_disk(str(path))
+
+
+def _dir_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def list_entries(root: str | Path | None = None) -> List[dict]:
+    """Cache entries, most recently used first."""
+    entries = []
+    base = cache_dir(root)
+    if not base.exists():
+        return entries
+    for p in base.iterdir():
+        meta_path = p / _META
+        if not meta_path.exists():
+            continue
+        meta = json.loads(meta_path.read_text())
+        entries.append({"key": p.name, "path": str(p), "bytes": _dir_size(p),
+                        "last_used": meta_path.stat().st_mtime, **meta})
+    return sorted(entries, key=lambda e: e["last_used"], reverse=True)
+
+
+def prune(root: str | Path | None = None, keep: Optional[int] = None,
+          older_than_days: Optional[float] = None, dry_run: bool = False) -> List[dict]:
+    """
+    Removes entries beyond the `keep` most recently used and/or not used for
+    `older_than_days`. With neither set, every entry is removed. Unfinished
+    (*.tmp) builds are always removed.
+    """
+    removed = []
+    now = time.time()
+    for i, e in enumerate(list_entries(root)):
+        too_many = keep is not None and i >= keep
+        too_old = older_than_days is not None and now - e["last_used"] > older_than_days * 86400
+        if too_many or too_old or (keep is None and older_than_days is None):
+            removed.append(e)
+            if not dry_run:
+                shutil.rmtree(e["path"], ignore_errors=True)
+    base = cache_dir(root)
+    if base.exists() and not dry_run:
+        for tmp in base.glob("*.tmp"):
+            shutil.rmtree(tmp, ignore_errors=True)
+    return removed
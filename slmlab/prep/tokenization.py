@@ -0,0 +1,51 @@
+from typing import Callable
+
+IGNORE_INDEX = -100
+
+
+def make_tokenize_fn(tok, mode: str = "base", max_length: int = 1024) -> Callable[[dict], dict]:
+    """
+    Returns a batched `datasets.map` function producing causal-LM examples:
+    `input_ids` is prompt + completion (+ eos) and `labels` repeats the ids
+    with the prompt part masked, so only the completion is learned.
+
+    base mode reads `prompt` / `label` columns; chat mode reads `messages` and
+    learns the last assistant turn.
+    """
+    eos = [tok.eos_token_id] if tok.eos_token_id is not None else []
+
+    def _example(prompt_ids, completion_ids):
+        ids = (prompt_ids + completion_ids)[:max_length]
+        labels = ([IGNORE_INDEX] * len(prompt_ids) + completion_ids)[:max_length]
+        return ids, labels
+
+    if mode == "chat":
+        def tok_fn(batch):
+            out = {"input_ids": [], "attention_mask": [], "labels": []}
+            for msgs in batch["messages"]:
+                has_answer = bool(msgs) and msgs[-1].get("role") == "assistant"
+                context = msgs[:-1] if has_answer else msgs
+                full = tok.apply_chat_template(msgs, tokenize=False, add_generation_prompt=False)
+                prefix = tok.apply_chat_template(context, tokenize=False, add_generation_prompt=has_answer)
+                prompt_ids = tok(prefix, add_special_tokens=False)["input_ids"]
+                full_ids = tok(full, add_special_tokens=False)["input_ids"]
+                ids, labels = _example(prompt_ids, full_ids[len(prompt_ids):])
+                out["input_ids"].append(ids)
+                out["attention_mask"].append([1] * len(ids))
+                out["labels"].append(labels)
+            return out
+    elif mode == "base":
+        def tok_fn(batch):
+            out = {"input_ids": [], "attention_mask": [], "labels": []}
+            prompts = tok(batch["prompt"])["input_ids"]
+            completions = tok(batch["label"], add_special_tokens=False)["input_ids"]
+            for prompt_ids, completion_ids in zip(prompts, completions):
+                ids, labels = _example(prompt_ids, completion_ids + eos)
+                out["input_ids"].append(ids)
+                out["attention_mask"].append([1] * len(ids))
+                out["labels"].append(labels)
+            return out
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+
+    return tok_fn
@@ -1,19 +1,352 @@
-# pseudo-code
-import subprocess, typer, shutil
+import hashlib
+import json
+import logging
+import os
+import re
+from contextlib import ExitStack
 from pathlib import Path
+from typing import Annotated, Dict, List, NamedTuple, Optional
+
+import gguf
+import numpy as np
+import torch
+import typer
+from safetensors import safe_open
+
+from slmlab.postproc.merge import adapter_base, is_adapter_dir, local_model_dir
+
+logger = logging.getLogger(__name__)
 
 app = typer.Typer()
 
+Q = gguf.GGMLQuantizationType
+F = gguf.LlamaFileType
+
+# Output types the gguf writer quantizes itself; k-quants (q4_k_m…) need
+# llama.cpp's llama-quantize, run on the f16 file.
+QTYPES = {
+    "f32": (Q.F32, F.ALL_F32),
+    "f16": (Q.F16, F.MOSTLY_F16),
+    "bf16": (Q.BF16, F.MOSTLY_BF16),
+    "q8_0": (Q.Q8_0, F.MOSTLY_Q8_0),
+    "q5_1": (Q.Q5_1, F.MOSTLY_Q5_1),
+    "q5_0": (Q.Q5_0, F.MOSTLY_Q5_0),
+    "q4_1": (Q.Q4_1, F.MOSTLY_Q4_1),
+    "q4_0": (Q.Q4_0, F.MOSTLY_Q4_0),
+}
+DEFAULT_QTYPES = "f16,q8_0,q4_0"
+
+# HF model_type -> (gguf arch, llama.cpp pre-tokenizer, q/k rows permuted to GGML's rope layout)
+ARCHS = {
+    "llama": (gguf.MODEL_ARCH.LLAMA, "llama-bpe", True),
+    "mistral": (gguf.MODEL_ARCH.LLAMA, "llama-bpe", True),
+    "qwen2": (gguf.MODEL_ARCH.QWEN2, "qwen2", False),
+    "qwen3": (gguf.MODEL_ARCH.QWEN3, "qwen2", False),
+    "lfm2": (gguf.MODEL_ARCH.LFM2, "lfm2", False),
+}
+
+_SKIP = (".rotary_emb.inv_freq",)
+_MANIFEST = "gguf_manifest.json"
+
+
+# ---- LoRA, merged one tensor at a time ----
+
+class _Lora:
+    """
+    A LoRA adapter held in memory (it is small) and folded into each base
+    tensor as that tensor is streamed: W + scale * B @ A.
+    """
+
+    def __init__(self, adapter_dir: str | Path):
+        adapter_dir = Path(adapter_dir)
+        cfg = json.loads((adapter_dir / "adapter_config.json").read_text())
+        if cfg.get("use_dora"):
+            raise ValueError("DoRA adapters are not supported by the streaming merge; merge with slmlab.postproc.merge first")
+        self.cfg = cfg
+        self.pairs: Dict[str, dict] = {}  # base tensor name -> {"A", "B", "embedding"}
+        self.replaced: Dict[str, torch.Tensor] = {}  # modules_to_save: whole tensors
+        path = adapter_dir / "adapter_model.safetensors"
+        if not path.exists():
+            raise FileNotFoundError(f"{path} not found (only safetensors adapters can be streamed)")
+        with safe_open(str(path), framework="pt") as sf:
+            for key in sf.keys():
+                name = re.sub(r"^base_model\.model\.", "", key)
+                m = re.match(r"(.+)\.lora_(embedding_)?([AB])(?:\.weight)?$", name)
+                if m:
+                    pair = self.pairs.setdefault(m.group(1) + ".weight", {"embedding": bool(m.group(2))})
+                    pair[m.group(3)] = sf.get_tensor(key).float()
+                else:
+                    self.replaced[name.replace(".modules_to_save", "").replace(".default", "")] = sf.get_tensor(key)
+
+    def _scale(self, module: str) -> float:
+        r, alpha = self.cfg.get("r", 8), self.cfg.get("lora_alpha", 8)
+        for pattern, v in (self.cfg.get("rank_pattern") or {}).items():
+            if module == pattern or re.match(rf".*\.{pattern}$", module):
+                r = v
+        for pattern, v in (self.cfg.get("alpha_pattern") or {}).items():
+            if module == pattern or re.match(rf".*\.{pattern}$", module):
+                alpha = v
+        return alpha / (r ** 0.5 if self.cfg.get("use_rslora") else r)
+
+    def merge(self, name: str, w: torch.Tensor) -> torch.Tensor:
+        if name in self.replaced:
+            return self.replaced[name].float()
+        pair = self.pairs.get(name)
+        if pair is None:
+            return w
+        delta = pair["B"] @ pair["A"]
+        if pair["embedding"] or self.cfg.get("fan_in_fan_out"):
+            delta = delta.T
+        return w + self._scale(name[:-len(".weight")]) * delta
+
+
+# ---- tensor plan: names, shapes and types, read from safetensors headers only ----
+
+class _Tensor(NamedTuple):
+    src: str  # HF name
+    name: str  # GGUF name
+    shape: tuple  # after the arch transform
+    file: str
+
+
+def _weight_files(model_dir: Path) -> List[Path]:
+    index = model_dir / "model.safetensors.index.json"
+    if index.exists():
+        shards = json.loads(index.read_text())["weight_map"].values()
+        return [model_dir / f for f in dict.fromkeys(shards)]
+    files = sorted(model_dir.glob("*.safetensors"))
+    if not files:
+        raise FileNotFoundError(f"No safetensors weights in {model_dir}")
+    return files
+
+
+def _plan(model_dir: Path, arch, n_blocks: int) -> List[_Tensor]:
+    names = gguf.get_tensor_name_map(arch, n_blocks)
+    plan = []
+    for f in _weight_files(model_dir):
+        with safe_open(str(f), framework="pt") as sf:
+            for key in sf.keys():
+                if key.endswith(_SKIP):
+                    continue
+                name = names.get_name(key, try_suffixes=(".weight", ".bias"))
+                if name is None:
+                    raise ValueError(f"No GGUF name for tensor {key} ({gguf.MODEL_ARCH_NAMES[arch]})")
+                shape = tuple(sf.get_slice(key).get_shape())
+                if arch == gguf.MODEL_ARCH.LFM2 and ".conv.conv." in key:
+                    shape = (shape[0], shape[-1])  # depthwise conv stored as (d, 1, L)
+                plan.append(_Tensor(key, name, shape, str(f)))
+    return plan
+
+
+def _transform(t: _Tensor, w: torch.Tensor, arch, permute_qk: bool, hp: dict) -> torch.Tensor:
+    if arch == gguf.MODEL_ARCH.LFM2 and ".conv.conv." in t.src:
+        w = w.squeeze(1)
+    if permute_qk and t.src.endswith(("q_proj.weight", "k_proj.weight")):
+        n_head = hp["num_attention_heads"]
+        if t.src.endswith("k_proj.weight"):
+            n_head = hp.get("num_key_value_heads") or n_head
+        w = w.reshape(n_head, 2, w.shape[0] // n_head // 2, *w.shape[1:]).swapaxes(1, 2).reshape(w.shape)
+    return w
+
+
+def tensor_type(name: str, shape: tuple, qtype) -> "gguf.GGMLQuantizationType":
+    """Norms, biases and conv kernels stay f32; rows that don't split into quant blocks fall back to f16."""
+    if len(shape) <= 1 or name.endswith("_norm.weight") or ".conv." in name:
+        return Q.F32
+    if qtype in (Q.F32, Q.F16, Q.BF16):
+        return qtype
+    block_size, _ = gguf.GGML_QUANT_SIZES[qtype]
+    return qtype if shape[-1] % block_size == 0 else Q.F16
+
+
+def _nbytes(shape: tuple, qtype) -> int:
+    block_size, type_size = gguf.GGML_QUANT_SIZES[qtype]
+    return int(np.prod(shape)) // block_size * type_size
+
+
+def _encode(w: np.ndarray, qtype) -> np.ndarray:
+    return np.ascontiguousarray(gguf.quants.quantize(w, qtype))
+
+
+# ---- metadata ----
+
+def _hparams(writer: gguf.GGUFWriter, arch, hp: dict, plan: List[_Tensor]):
+    shapes = {t.name: t.shape for t in plan}
+    n_blocks = hp["num_hidden_layers"]
+    writer.add_context_length(hp.get("max_position_embeddings", 2048))
+    writer.add_embedding_length(hp["hidden_size"])
+    writer.add_block_count(n_blocks)
+    ffn = next((shapes[n] for n in ("blk.0.ffn_up.weight", "blk.0.ffn_gate.weight") if n in shapes), None)
+    writer.add_feed_forward_length(ffn[0] if ffn else hp["intermediate_size"])  # real size, not the config hint
+    writer.add_head_count(hp["num_attention_heads"])
+    n_kv = hp.get("num_key_value_heads") or hp["num_attention_heads"]
+    if arch == gguf.MODEL_ARCH.LFM2:
+        attn = hp.get("layer_types") or ["full_attention" if i in hp.get("full_attn_idxs", []) else "conv"
+                                        for i in range(n_blocks)]
+        writer.add_head_count_kv([n_kv if kind == "full_attention" else 0 for kind in attn])
+        writer.add_shortconv_l_cache(hp["conv_L_cache"])
+    else:
+        writer.add_head_count_kv(n_kv)
+    if hp.get("head_dim"):
+        writer.add_key_length(hp["head_dim"])
+        writer.add_value_length(hp["head_dim"])
+    if hp.get("rope_theta"):
+        writer.add_rope_freq_base(hp["rope_theta"])
+    writer.add_layer_norm_rms_eps(hp.get("rms_norm_eps") or hp.get("norm_eps") or 1e-5)
+    writer.add_vocab_size(hp["vocab_size"])
+
+
+def _vocab(tok_dir: Path, vocab_size: int):
+    """Token list and types for a byte-level BPE tokenizer.json, as llama.cpp's 'gpt2' model."""
+    from transformers import AutoTokenizer
+
+    spec = json.loads((tok_dir / "tokenizer.json").read_text(encoding="utf-8"))
+    if spec.get("model", {}).get("type") != "BPE":
+        raise ValueError(f"Only BPE tokenizer.json vocabularies are supported, got {spec.get('model', {}).get('type')}")
+    tok = AutoTokenizer.from_pretrained(tok_dir)
+    reverse = {i: t for t, i in tok.get_vocab().items()}
+    if len(reverse) > vocab_size:
+        raise ValueError(f"Tokenizer has {len(reverse)} tokens but the embedding only {vocab_size} rows")
+    added = tok.added_tokens_decoder
+    tokens, types = [], []
+    for i in range(vocab_size):
+        if i not in reverse:
+            tokens.append(f"[PAD{i}]")
+            types.append(gguf.TokenType.UNUSED)
+        elif i in added:
+            tokens.append(reverse[i])
+            types.append(gguf.TokenType.CONTROL if added[i].special else gguf.TokenType.USER_DEFINED)
+        else:
+            tokens.append(reverse[i])
+            types.append(gguf.TokenType.NORMAL)
+    return tokens, types, gguf.SpecialVocab(tok_dir, load_merges=True, n_vocab=vocab_size)
+
+
+# ---- export ----
+
+def _checksum(a: np.ndarray) -> str:
+    return hashlib.sha256(np.ascontiguousarray(a).view(np.uint8)).hexdigest()
+
+
+def validate_gguf(path: str | Path, expected: Dict[str, str], arch_name: str) -> List[str]:
+    """Reads a GGUF back and compares architecture, tensor set and per-tensor sha256; returns the problems."""
+    reader = gguf.GGUFReader(str(path))
+    problems = []
+    field = reader.get_field(gguf.Keys.General.ARCHITECTURE)
+    if field is None or field.contents() != arch_name:
+        problems.append(f"architecture is {field.contents() if field else None}, expected {arch_name}")
+    found = {t.name: t for t in reader.tensors}
+    for name in sorted(set(expected) - set(found)):
+        problems.append(f"missing tensor {name}")
+    for name in sorted(set(found) - set(expected)):
+        problems.append(f"unexpected tensor {name}")
+    for name, sha in expected.items():
+        if name in found and _checksum(found[name].data) != sha:
+            problems.append(f"checksum mismatch for {name}")
+    return problems
+
+
+def export_gguf(model: str, out_dir: str | Path = "artifacts/gguf", qtypes: List[str] = DEFAULT_QTYPES.split(","),
+                base: Optional[str] = None, revision: Optional[str] = None, name: Optional[str] = None,
+                validate: bool = True) -> dict:
+    """
+    Writes one GGUF per entry of `qtypes` for a model dir, hub id or LoRA
+    adapter dir. Tensors are read one at a time from memory-mapped
+    safetensors, LoRA deltas merged in, then quantized for every output, so
+    peak memory is about one tensor rather than the whole model.
+    """
+    unknown = set(qtypes) - set(QTYPES)
+    if unknown:
+        raise ValueError(f"Unsupported GGUF types: {sorted(unknown)} (expected {', '.join(QTYPES)})")
+
+    lora, tok_dir = None, None
+    if is_adapter_dir(model):
+        lora = _Lora(model)
+        if (Path(model) / "tokenizer.json").exists():
+            tok_dir = Path(model)
+        model_dir = local_model_dir(base or adapter_base(model), revision)
+    else:
+        model_dir = local_model_dir(model, revision)
+    tok_dir = tok_dir or model_dir
+
+    hp = json.loads((model_dir / "config.json").read_text())
+    if hp.get("model_type") not in ARCHS:
+        raise ValueError(f"Unsupported model_type {hp.get('model_type')!r} (supported: {', '.join(ARCHS)})")
+    arch, pre, permute_qk = ARCHS[hp["model_type"]]
+    arch_name = gguf.MODEL_ARCH_NAMES[arch]
+    name = name or Path(model).resolve().name
+    plan = _plan(model_dir, arch, hp["num_hidden_layers"])
+    tokens, toktypes, special = _vocab(tok_dir, hp["vocab_size"])
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    outputs = {}
+    for q in qtypes:
+        qtype, ftype = QTYPES[q]
+        path = out_dir / f"{name}-{q}.gguf"
+        w = gguf.GGUFWriter(None, arch_name)
+        w.add_name(name)
+        w.add_file_type(ftype)
+        w.add_quantization_version(gguf.GGML_QUANT_VERSION)
+        _hparams(w, arch, hp, plan)
+        w.add_tokenizer_model("gpt2")
+        w.add_tokenizer_pre(pre)
+        w.add_token_list(tokens)
+        w.add_token_types(toktypes)
+        special.add_to_gguf(w, quiet=True)
+        types = [tensor_type(t.name, t.shape, qtype) for t in plan]
+        for t, tt in zip(plan, types):
+            w.add_tensor_info(t.name, t.shape, np.float32, _nbytes(t.shape, tt), raw_dtype=tt)
+        tmp = path.with_name(path.name + ".tmp")
+        w.write_header_to_file(tmp)
+        w.write_kv_data_to_file()
+        w.write_ti_data_to_file()
+        outputs[q] = {"writer": w, "path": path, "tmp": tmp, "types": types, "checksums": {}}
+
+    logger.info(f"gguf: {len(plan)} tensors from {model_dir}{' + LoRA ' + str(model) if lora else ''} "
+                f"-> {', '.join(qtypes)}")
+    with ExitStack() as stack, torch.no_grad():
+        files = {f: stack.enter_context(safe_open(f, framework="pt")) for f in dict.fromkeys(t.file for t in plan)}
+        for i, t in enumerate(plan):
+            w = files[t.file].get_tensor(t.src).float()
+            if lora is not None:
+                w = lora.merge(t.src, w)
+            data = _transform(t, w, arch, permute_qk, hp).numpy()
+            for o in outputs.values():
+                enc = _encode(data, o["types"][i])
+                o["writer"].write_tensor_data(enc)
+                o["checksums"][t.name] = _checksum(enc)
+
+    manifest = {"model": str(model), "base": str(model_dir), "architecture": arch_name, "outputs": {}}
+    for q, o in outputs.items():
+        o["writer"].close()
+        problems = validate_gguf(o["tmp"], o["checksums"], arch_name) if validate else []
+        if problems:
+            raise RuntimeError(f"{o['tmp']} failed validation: " + "; ".join(problems[:5]))
+        os.replace(o["tmp"], o["path"])
+        manifest["outputs"][q] = {"file": o["path"].name, "bytes": o["path"].stat().st_size,
+                                  "tensors": len(o["checksums"]), "validated": validate,
+                                  "sha256": hashlib.sha256("".join(o["checksums"].values()).encode()).hexdigest()}
+        logger.info(f"gguf: {o['path']} ({o['path'].stat().st_size / 2**20:.1f} MiB"
+                    f"{', checksums verified' if validate else ''})")
+    (out_dir / _MANIFEST).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
 @app.command()
-def run(hf_model_dir: str, out_dir: str = "artifacts/gguf", q: str = "q4_k_m"):
-    Path(out_dir).mkdir(parents=True, exist_ok=True)
-    # suppose llama.cpp cloné dans tools/llama.cpp
-    cmd = [
-        "tools/llama.cpp/convert-hf-to-gguf.py",
-        hf_model_dir, "--outfile", f"{out_dir}/model.gguf", "--outtype", q
-    ]
-    subprocess.check_call(["python", *cmd])
-    typer.echo(f"GGUF écrit dans {out_dir}")
+def run(model: Annotated[str, typer.Argument(help="Model dir, hub id, or LoRA adapter dir (merged on the fly).")],
+        out_dir: Annotated[str, typer.Option(help="Where the .gguf files and gguf_manifest.json go.")] = "artifacts/gguf",
+        q: Annotated[str, typer.Option(help="Comma-separated output types: " + ", ".join(QTYPES))] = DEFAULT_QTYPES,
+        base: Annotated[Optional[str], typer.Option(help="Base model of the adapter (default: from adapter_config.json).")] = None,
+        revision: Annotated[Optional[str], typer.Option(help="Hub revision of the base model.")] = None,
+        name: Annotated[Optional[str], typer.Option(help="Model name in file names and metadata (default: the model dir name).")] = None,
+        no_validate: Annotated[bool, typer.Option("--no-validate", help="Skip reading the files back to verify tensor checksums.")] = False):
+    """Exports a model (or base + LoRA adapter) to GGUF at several quantization levels in one pass."""
+    qtypes = [x.strip() for x in q.split(",") if x.strip()]
+    manifest = export_gguf(model, out_dir, qtypes, base=base, revision=revision, name=name, validate=not no_validate)
+    typer.echo(f"GGUF written to {out_dir}: " + ", ".join(o["file"] for o in manifest["outputs"].values()))
+
 
 if __name__ == "__main__":
-    app()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format="[%(name)s] %(message)s")
+    app()
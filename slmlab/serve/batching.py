@@ -0,0 +1,148 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+
+class TokenStream:
+    """
+    Bridge between the generation thread and one async consumer. The worker
+    calls `put(token_id)` / `close()`; the consumer iterates with `async for`.
+    `cancel()` flags the request so the batch stops spending compute on it.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.cancelled = False
+
+    def put(self, token_id: int):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, token_id)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> int:
+        token_id = await self._queue.get()
+        if token_id is None:
+            raise StopAsyncIteration
+        return token_id
+
+
+@dataclass
+class _Pending:
+    prompt: str
+    max_new_tokens: int
+    future: asyncio.Future = field(repr=False)
+    stream: Optional[TokenStream] = field(default=None, repr=False)
+    enqueued: float = field(default_factory=time.perf_counter)
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests into micro-batches.
+
+    The first queued request opens a window of `max_wait_ms`; every request
+    arriving before the window closes (up to `max_batch_size`) joins the same
+    batch. `run_batch(prompts, max_new_tokens, streams, enqueued)` is executed
+    in a single worker thread, so forward passes never overlap and the event
+    loop stays free; `streams` holds a TokenStream for streaming requests and
+    None for the others, `enqueued` the time.perf_counter() of each arrival. `submit` / `submit_stream` raise asyncio.QueueFull when
+    `max_queue` requests are waiting.
+    """
+
+    def __init__(self, run_batch: Callable[[List[str], List[int], List[Optional[TokenStream]], List[float]], List[str]],
+                 max_batch_size: int = 8, max_wait_ms: float = 10.0, max_queue: int = 256):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slmlab-batch")
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, prompt: str, max_new_tokens: int) -> str:
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_Pending(prompt, max_new_tokens, fut))
+        return await fut
+
+    def submit_stream(self, prompt: str, max_new_tokens: int):
+        """
+        Queues a streaming request and returns (stream, future); the future
+        resolves to the full text once the stream is closed.
+        """
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        stream = TokenStream(loop)
+        self._queue.put_nowait(_Pending(prompt, max_new_tokens, fut, stream))
+        return stream, fut
+
+    async def _collect(self) -> List[_Pending]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Callers that went away while queued don't cost a forward pass
+        live = []
+        for p in batch:
+            if p.future.done() or (p.stream is not None and p.stream.cancelled):
+                if p.stream is not None:
+                    p.stream.close()
+                continue
+            live.append(p)
+        return live
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            prompts = [p.prompt for p in batch]
+            budgets = [p.max_new_tokens for p in batch]
+            streams = [p.stream for p in batch]
+            enqueued = [p.enqueued for p in batch]
+            try:
+                outs = await loop.run_in_executor(self._executor, self.run_batch, prompts, budgets, streams,
+                                                  enqueued)
+            except Exception as e:
+                for p in batch:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+                outs = None
+            for i, p in enumerate(batch):
+                if p.stream is not None:
+                    p.stream.close()
+                if outs is not None and not p.future.done():
+                    p.future.set_result(outs[i])
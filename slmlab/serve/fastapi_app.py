@@ -1,17 +1,210 @@
-from fastapi import FastAPI
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Literal
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+from slmlab.inference.engine import generate_batched
+from slmlab.inference.registry import get_registry, load_model
+from slmlab.inference.speculative import make_speculator
+from slmlab.prep.templating import template_prefix
+from slmlab.serve.batching import MicroBatcher
+from slmlab.serve.metrics import (CONTENT_TYPE, SIZE_BUCKETS, Counter, Gauge, Histogram, MetricsRegistry,
+                                  process_private_bytes, process_rss_bytes)
+from slmlab.serve.streaming import IncrementalDecoder, DatafieldChunker, sse
+from slmlab.utils.config import load_config
 
-app = FastAPI()
-_tok = AutoTokenizer.from_pretrained("runs/adapter")
-_mod = AutoModelForCausalLM.from_pretrained("runs/adapter")
-_gen = pipeline("text-generation", model=_mod, tokenizer=_tok, device=-1)
+MODEL_PATH = os.environ.get("SLMLAB_MODEL", "runs/adapter")
+MAX_BATCH_SIZE = int(os.environ.get("SLMLAB_MAX_BATCH_SIZE", 8))
+BATCH_WAIT_MS = float(os.environ.get("SLMLAB_BATCH_WAIT_MS", 10))
+MAX_QUEUE = int(os.environ.get("SLMLAB_MAX_QUEUE", 256))
+USE_CASE = os.environ.get("SLMLAB_USE_CASE")
+
+
+def _inference_setting(name: str, env: str, default=None):
+    # $SLMLAB_<NAME>, else the use case's inference.<name>
+    if os.environ.get(env):
+        return os.environ[env]
+    inference = getattr(load_config(USE_CASE), "inference", None) if USE_CASE else None
+    return getattr(inference, name, default)
+
+
+QUANT = _inference_setting("quant", "SLMLAB_QUANT")  # weight-only int8 | int4
+# Speculative decoding (prompt_lookup | draft) for requests that get a batch to themselves
+SPECULATIVE = _inference_setting("speculative", "SLMLAB_SPECULATIVE")
+# xml: well-formed completions that end at the closing root tag
+CONSTRAIN = _inference_setting("constrain", "SLMLAB_CONSTRAIN")
+
+
+def _prompt_prefix():
+    # Re-read on every batch so an edited template invalidates the KV cache
+    if not USE_CASE or str(_inference_setting("prefix_cache", "SLMLAB_PREFIX_CACHE", False)).lower() in ("false", "0", "no"):
+        return None
+    return template_prefix(load_config(USE_CASE)) or None
+
+
+@lru_cache(maxsize=1)
+def speculator():
+    return make_speculator(SPECULATIVE, num_draft=int(_inference_setting("num_draft_tokens", "SLMLAB_NUM_DRAFT_TOKENS", 10)),
+                           draft_model=_inference_setting("draft_model", "SLMLAB_DRAFT_MODEL"))
+
+
+def _run_batch(prompts, max_new_tokens, streams, enqueued):
+    mod, tok = load_model(MODEL_PATH, quant=QUANT)
+    live = {i: s for i, s in enumerate(streams) if s is not None}
+    first_token = [None] * len(prompts)
+
+    def on_token(i, t):
+        if first_token[i] is None:
+            first_token[i] = time.perf_counter()
+        if i in live:
+            live[i].put(t)
+
+    kwargs = {}
+    if live:
+        kwargs["cancelled"] = lambda i: i in live and live[i].cancelled
+    if len(prompts) == 1:
+        # Under load, batching pays more than drafting; a lone request gets the lower latency
+        kwargs["speculative"] = speculator()
+    start = time.perf_counter()
+    outs, stats = generate_batched(mod, tok, prompts, max_new_tokens=max_new_tokens, batch_size=len(prompts),
+                                   prefix=_prompt_prefix(), on_token=on_token, constrain=CONSTRAIN, **kwargs)
+    end = time.perf_counter()
+
+    BATCH_SIZE.observe(len(prompts))
+    PROMPT_TOKENS.inc(stats.prompt_tokens)
+    GENERATED_TOKENS.inc(stats.generated_tokens)
+    GENERATION_SECONDS.inc(stats.seconds)
+    TOKENS_PER_SEC.set(stats.tokens_per_sec)
+    if stats.spec_steps:
+        SPEC_DRAFTED.inc(stats.spec_drafted)
+        SPEC_ACCEPTED.inc(stats.spec_accepted)
+        SPEC_PASSES.inc(stats.spec_steps)
+    for i, t in enumerate(enqueued):
+        endpoint = "/generate/stream" if i in live else "/generate"
+        QUEUE_WAIT.observe(start - t)
+        TTFT.observe((first_token[i] or end) - t, endpoint=endpoint)
+    return outs
+
+
+_batcher = MicroBatcher(_run_batch, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=BATCH_WAIT_MS, max_queue=MAX_QUEUE)
+
+# ---- Prometheus metrics (updated once per request/batch; gauges computed at scrape time) ----
+def _worker_label():
+    # Each pre-forked worker keeps its own metrics; its index is only set after the fork
+    worker = os.environ.get("SLMLAB_WORKER")
+    return {"worker": worker} if worker else {}
+
+
+METRICS = MetricsRegistry(const_labels=_worker_label)
+REQUESTS = METRICS.register(Counter("slmlab_requests_total", "Requests by endpoint and outcome.",
+                                    ["endpoint", "status"]))
+LATENCY = METRICS.register(Histogram("slmlab_request_latency_seconds", "End-to-end request latency.",
+                                     ["endpoint"]))
+TTFT = METRICS.register(Histogram("slmlab_time_to_first_token_seconds",
+                                  "Time from arrival to the first generated token.", ["endpoint"]))
+QUEUE_WAIT = METRICS.register(Histogram("slmlab_queue_wait_seconds", "Time spent queued before a batch starts."))
+BATCH_SIZE = METRICS.register(Histogram("slmlab_batch_size", "Requests per generation batch.",
+                                        buckets=SIZE_BUCKETS))
+PROMPT_TOKENS = METRICS.register(Counter("slmlab_prompt_tokens_total", "Prompt tokens processed."))
+GENERATED_TOKENS = METRICS.register(Counter("slmlab_generated_tokens_total", "Tokens generated."))
+GENERATION_SECONDS = METRICS.register(Counter("slmlab_generation_seconds_total", "Wall time spent generating."))
+TOKENS_PER_SEC = METRICS.register(Gauge("slmlab_tokens_per_second", "Generation throughput of the last batch."))
+SPEC_DRAFTED = METRICS.register(Counter("slmlab_speculative_drafted_tokens_total", "Tokens drafted for verification."))
+SPEC_ACCEPTED = METRICS.register(Counter("slmlab_speculative_accepted_tokens_total", "Drafted tokens the model confirmed."))
+SPEC_PASSES = METRICS.register(Counter("slmlab_speculative_forward_passes_total",
+                                       "Forward passes of speculatively decoded requests."))
+METRICS.register(Gauge("slmlab_queue_depth", "Requests waiting for a batch.", fn=lambda: _batcher.depth))
+METRICS.register(Gauge("slmlab_model_load_seconds", "Wall time of the last load of each resident model.",
+                       ["model"], fn=lambda: {(k.path,): v for k, v in get_registry().load_seconds.items()}))
+METRICS.register(Gauge("slmlab_model_resident_bytes", "Weight and buffer bytes of resident models (as stored, e.g. int8).",
+                       fn=lambda: get_registry().resident_bytes))
+METRICS.register(Gauge("slmlab_process_resident_memory_bytes", "Resident set size of the server process.",
+                       fn=process_rss_bytes))
+METRICS.register(Gauge("slmlab_process_private_memory_bytes",
+                       "Memory of this process not shared with others (with the pre-fork launcher: per-worker cost).",
+                       fn=process_private_bytes))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    load_model(MODEL_PATH, quant=QUANT)  # warm the shared registry at startup
+    speculator()
+    await _batcher.start()
+    yield
+    await _batcher.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 class Query(BaseModel):
     prompt: str
     max_new_tokens: int = 128
 
+class StreamQuery(Query):
+    unit: Literal["token", "datafield"] = "token"
+
+@app.get("/metrics")
+def metrics():
+    return Response(METRICS.render(), media_type=CONTENT_TYPE)
+
 @app.post("/generate")
-def generate(q: Query):
-    out = _gen(q.prompt, max_new_tokens=q.max_new_tokens)[0]["generated_text"]
-    return {"text": out}
\ No newline at end of file
+async def generate(q: Query):
+    start, status = time.perf_counter(), "error"
+    try:
+        out = await _batcher.submit(q.prompt, q.max_new_tokens)
+        status = "ok"
+    except asyncio.QueueFull:
+        status = "rejected"
+        raise HTTPException(status_code=503, detail="Generation queue is full, retry later.")
+    finally:
+        REQUESTS.inc(endpoint="/generate", status=status)
+        LATENCY.observe(time.perf_counter() - start, endpoint="/generate")
+    return {"text": out}
+
+@app.post("/generate/stream")
+async def generate_stream(q: StreamQuery):
+    """
+    Server-sent events: one `data:` event per decoded text delta (or per
+    complete <datafield> element, and the text between them, with
+    unit=datafield), then a `done` event
+    carrying the whole completion. When the client disconnects the response task is
+    cancelled, which flags the request so its batch row stops decoding.
+    """
+    start = time.perf_counter()
+    try:
+        stream, fut = _batcher.submit_stream(q.prompt, q.max_new_tokens)
+    except asyncio.QueueFull:
+        REQUESTS.inc(endpoint="/generate/stream", status="rejected")
+        raise HTTPException(status_code=503, detail="Generation queue is full, retry later.")
+    _, tok = load_model(MODEL_PATH, quant=QUANT)
+
+    async def events():
+        decoder = IncrementalDecoder(tok)
+        chunker = DatafieldChunker() if q.unit == "datafield" else None
+        status = "cancelled"
+        try:
+            async for token_id in stream:
+                delta = decoder.push(token_id)
+                for piece in (chunker.push(delta) if chunker else [delta]):
+                    if piece:
+                        yield sse({"text": piece})
+            tail = decoder.flush()
+            for piece in (chunker.push(tail) + chunker.flush() if chunker else [tail]):
+                if piece:
+                    yield sse({"text": piece})
+            yield sse({"text": await fut}, event="done")
+            status = "ok"
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            stream.cancel()
+            fut.cancel()
+            REQUESTS.inc(endpoint="/generate/stream", status=status)
+            LATENCY.observe(time.perf_counter() - start, endpoint="/generate/stream")
+
+    return StreamingResponse(events(), media_type="text/event-stream")
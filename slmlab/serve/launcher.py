@@ -0,0 +1,183 @@
+import gc
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import time
+from pathlib import Path
+from typing import Annotated, Dict, List, Optional
+
+import typer
+
+logger = logging.getLogger(__name__)
+
+app = typer.Typer()
+
+_SAFETENSORS_DTYPES = {"F32": "float32", "F16": "float16", "BF16": "bfloat16"}
+
+
+def cpu_slices(n_workers: int, cpus: Optional[List[int]] = None) -> List[List[int]]:
+    """Splits the usable CPUs into one contiguous slice per worker (shared round-robin when there are fewer CPUs)."""
+    cpus = sorted(cpus if cpus is not None else (os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity")
+                                                 else range(os.cpu_count() or 1)))
+    if n_workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(n_workers)]
+    per = len(cpus) // n_workers
+    return [cpus[i * per:(i + 1) * per] for i in range(n_workers)]
+
+
+def _weights_dir(path: str) -> Path:
+    from slmlab.postproc.merge import is_adapter_dir, local_model_dir, merge_adapter
+    return merge_adapter(path) if is_adapter_dir(path) else local_model_dir(path)
+
+
+def map_weights(model, weights_dir: str | Path) -> int:
+    """
+    Rebinds the model's tensors to private (copy-on-write) mmaps of its
+    safetensors files, so weight pages live in the page cache, shared by every
+    process mapping the file, instead of anonymous memory. Tensors whose
+    dtype differs from the file (or that are misaligned) are left as loaded.
+    Returns the bytes now file-backed.
+    """
+    import torch
+
+    state = model.state_dict()
+    mapped: Dict[str, "torch.Tensor"] = {}
+    for f in sorted(Path(weights_dir).glob("*.safetensors")):
+        with open(f, "rb") as fh:
+            header_len = struct.unpack("<Q", fh.read(8))[0]
+            header = json.loads(fh.read(header_len))
+        storage = torch.UntypedStorage.from_file(str(f), shared=False, nbytes=f.stat().st_size)
+        for name, info in header.items():
+            target = state.get(name)
+            if target is None or info["dtype"] not in _SAFETENSORS_DTYPES:
+                continue
+            dtype = getattr(torch, _SAFETENSORS_DTYPES[info["dtype"]])
+            if target.dtype != dtype:
+                continue
+            offset = 8 + header_len + info["data_offsets"][0]
+            itemsize = torch.empty((), dtype=dtype).element_size()
+            if offset % itemsize or list(target.shape) != info["shape"]:
+                continue
+            mapped[name] = torch.empty(0, dtype=dtype).set_(storage, offset // itemsize, info["shape"])
+    if mapped:
+        model.load_state_dict(mapped, strict=False, assign=True)
+        model.tie_weights()
+    return sum(t.numel() * t.element_size() for t in mapped.values())
+
+
+def _serve(index: int, sock: socket.socket, cpus: List[int], log_level: str):
+    """Worker body, run in the forked child."""
+    import torch
+    import uvicorn
+    from slmlab.serve.fastapi_app import app as asgi_app
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(len(cpus))
+    os.environ["SLMLAB_WORKER"] = str(index)
+    gc.enable()
+    logger.info(f"worker {index} (pid {os.getpid()}): CPUs {cpus}, {len(cpus)} torch threads")
+    uvicorn.Server(uvicorn.Config(asgi_app, log_level=log_level)).run(sockets=[sock])
+
+
+def _spawn(index: int, sock: socket.socket, cpus: List[int], log_level: str) -> int:
+    pid = os.fork()
+    if pid == 0:
+        # Own process group: a terminal ^C reaches only the parent, which
+        # then stops every worker exactly once
+        os.setpgid(0, 0)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            _serve(index, sock, cpus, log_level)
+        except BaseException as e:
+            logger.warning(f"worker {index} failed: {type(e).__name__}: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+@app.command()
+def run(workers: Annotated[int, typer.Option(help="Forked worker processes sharing one socket.")] = 2,
+        host: Annotated[str, typer.Option(help="Bind address.")] = "127.0.0.1",
+        port: Annotated[int, typer.Option(help="Bind port.")] = 8000,
+        model: Annotated[Optional[str], typer.Option(help="Model or adapter to serve (default: $SLMLAB_MODEL or runs/adapter).")] = None,
+        mmap_weights: Annotated[bool, typer.Option(help="Back the weights with mmaps of the (merged) safetensors instead of anonymous memory.")] = False,
+        log_level: Annotated[str, typer.Option(help="uvicorn log level.")] = "info"):
+    """
+    Pre-fork server: loads (and merges) the model once, then forks workers
+    that share its weight pages copy-on-write and serve the FastAPI app on a
+    shared listening socket, each pinned to its own slice of CPUs.
+    """
+    if model:
+        os.environ["SLMLAB_MODEL"] = model
+    # Forked children can't reuse thread pools started here (libgomp deadlocks),
+    # so the parent stays single-threaded and each worker sizes its own pool.
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    import torch
+    torch.set_num_threads(1)
+
+    gc.disable()  # no collections in the parent: they'd touch (and un-share) every object's page
+    from slmlab.inference.registry import load_model
+    from slmlab.serve import fastapi_app
+
+    start = time.perf_counter()
+    mod, _ = load_model(fastapi_app.MODEL_PATH, quant=fastapi_app.QUANT)
+    fastapi_app.speculator()  # a draft model, if any, is shared too
+    logger.info(f"loaded {fastapi_app.MODEL_PATH} once in {time.perf_counter() - start:.1f}s")
+    if mmap_weights:
+        if fastapi_app.QUANT:
+            logger.warning("--mmap-weights ignored: quantized weights have no file to map")
+        else:
+            nbytes = map_weights(mod, _weights_dir(fastapi_app.MODEL_PATH))
+            logger.info(f"{nbytes / 2**20:.1f} MiB of weights mapped from safetensors")
+    gc.collect()
+    gc.freeze()  # what's left is moved out of the collector's reach before forking
+
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    slices = cpu_slices(workers)
+    children = {_spawn(i, sock, cpus, log_level): i for i, cpus in enumerate(slices)}
+    logger.info(f"serving on http://{host}:{port} with {workers} workers (parent pid {os.getpid()})")
+
+    stopping = False
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None:
+            continue
+        if not stopping:
+            logger.warning(f"worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; restarting")
+            time.sleep(1.0)
+            children[_spawn(index, sock, slices[index], log_level)] = index
+    sock.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(name)s] %(message)s")
+    app()
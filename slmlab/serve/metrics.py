@@ -0,0 +1,171 @@
+import math
+import os
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover
+    psutil = None
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+def _fmt(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "", const: Optional[Dict[str, str]] = None) -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in [*(const or {}).items(), *zip(names, values)]]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self, const: Optional[Dict[str, str]] = None) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k, const=const)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """
+    Set explicitly, or computed at scrape time by `fn` (returning a value, or
+    {label values tuple: value} for labelled gauges) so it costs nothing until
+    /metrics is read.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), fn: Optional[Callable] = None):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self.fn = fn
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self, const: Optional[Dict[str, str]] = None) -> List[str]:
+        if self.fn is not None:
+            v = self.fn()
+            items = sorted(v.items()) if isinstance(v, dict) else ([((), v)] if v is not None else [])
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k, const=const)} {_fmt(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}  # key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            v[i] += 1
+            v[-1] += value
+
+    def render(self, const: Optional[Dict[str, str]] = None) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = self._header()
+        for key, v in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), v[:-1]):
+                cumulative += n
+                le = 'le="%s"' % _fmt(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le, const)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key, const=const)} {_fmt(v[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key, const=const)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Renders its metrics in the Prometheus text format. `const_labels`, called
+    at each scrape, adds the same labels to every sample (e.g. the worker
+    index, only known after a pre-fork).
+    """
+
+    def __init__(self, const_labels: Optional[Callable[[], Dict[str, str]]] = None):
+        self.metrics: List[_Metric] = []
+        self.const_labels = const_labels
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        const = self.const_labels() if self.const_labels is not None else None
+        return "\n".join(line for m in self.metrics for line in m.render(const)) + "\n"
+
+
+def process_rss_bytes() -> Optional[int]:
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+def process_private_bytes() -> Optional[int]:
+    """Unique set size: memory not shared with other processes (e.g. pre-forked workers' common weights)."""
+    if psutil is not None:
+        try:
+            return psutil.Process().memory_full_info().uss
+        except (psutil.AccessDenied, AttributeError):
+            pass
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            return sum(int(line.split()[1]) * 1024 for line in f if line.startswith(("Private_Clean", "Private_Dirty")))
+    except OSError:
+        return None
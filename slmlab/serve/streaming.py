@@ -0,0 +1,84 @@
+import json
+import re
+from typing import List
+
+_OPEN = re.compile(r"<datafield\b")
+_CLOSE = "</datafield>"
+
+
+class IncrementalDecoder:
+    """
+    Turns a growing list of token ids into text deltas. Each token decodes
+    only a short window: the ids not emitted yet plus the chunk before them,
+    whose text is subtracted, so tokenizers that drop a leading space or merge
+    bytes across tokens still give the right delta. Text ending in an
+    incomplete multi-byte character is held back until the next token.
+    """
+
+    def __init__(self, tok):
+        self.tok = tok
+        self.ids: List[int] = []
+        self.prefix_offset = 0  # start of the window decoded for context
+        self.read_offset = 0  # ids before this have been emitted
+
+    def _decode(self, start: int, end: int = None) -> str:
+        return self.tok.decode(self.ids[start:end], skip_special_tokens=True)
+
+    def push(self, token_id: int) -> str:
+        self.ids.append(token_id)
+        prefix = self._decode(self.prefix_offset, self.read_offset)
+        text = self._decode(self.prefix_offset)
+        if len(text) <= len(prefix) or text.endswith("�"):
+            return ""
+        self.prefix_offset, self.read_offset = self.read_offset, len(self.ids)
+        return text[len(prefix):]
+
+    def flush(self) -> str:
+        prefix = self._decode(self.prefix_offset, self.read_offset)
+        text = self._decode(self.prefix_offset)
+        self.prefix_offset = self.read_offset = len(self.ids)
+        return text[len(prefix):]
+
+
+class DatafieldChunker:
+    """
+    Buffers text and releases each <datafield> element once it is complete.
+    Text outside them (leader, controlfields, closing tags) is released as
+    soon as it cannot be the start of a datafield; `flush` returns the rest.
+    """
+
+    def __init__(self):
+        self.buf = ""
+
+    def push(self, delta: str) -> List[str]:
+        self.buf += delta
+        out = []
+        while self.buf:
+            m = _OPEN.search(self.buf)
+            if m is None:
+                # keep a trailing "<", "<data"... that may still become "<datafield"
+                lt = self.buf.rfind("<")
+                cut = lt if lt >= 0 and "<datafield".startswith(self.buf[lt:]) else len(self.buf)
+                if cut:
+                    out.append(self.buf[:cut])
+                    self.buf = self.buf[cut:]
+                break
+            if m.start():
+                out.append(self.buf[:m.start()])
+                self.buf = self.buf[m.start():]
+            end = self.buf.find(_CLOSE)
+            if end < 0:
+                break
+            end += len(_CLOSE)
+            out.append(self.buf[:end])
+            self.buf = self.buf[end:]
+        return out
+
+    def flush(self) -> List[str]:
+        rest, self.buf = self.buf, ""
+        return [rest] if rest else []
+
+
+def sse(data: dict, event: str = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -0,0 +1,130 @@
+import random
+from typing import Iterator, List
+
+import torch
+from torch.utils.data import DataLoader, Sampler
+from transformers import Trainer
+
+from slmlab.train.packing import example_lengths
+
+
+class TokenBudgetBatchSampler(Sampler[List[int]]):
+    """
+    Yields batches whose padded size (len(batch) * longest example) stays
+    within `max_tokens`.
+
+    Each epoch the indices are shuffled and cut into windows of `window`
+    examples; a window is sorted by length before being split into batches,
+    so batches hold similar lengths while their composition and order still
+    change from one epoch to the next. Each pass over the sampler is the next
+    epoch (the DataLoader does not forward `set_epoch` to a batch sampler);
+    `__len__` is the batch count of the pass `__iter__` yields next.
+    """
+
+    def __init__(self, lengths: List[int], max_tokens: int, window: int = 1000, shuffle: bool = True, seed: int = 42):
+        too_long = max(lengths, default=0)
+        if too_long > max_tokens:
+            raise ValueError(f"max_tokens={max_tokens} is smaller than the longest example ({too_long} tokens).")
+        self.lengths = lengths
+        self.max_tokens = max_tokens
+        self.window = window
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self._cached = None  # (epoch, batches)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _epoch_batches(self) -> List[List[int]]:
+        if self._cached is None or self._cached[0] != self.epoch:
+            self._cached = (self.epoch, self._batches())
+        return self._cached[1]
+
+    def _batches(self) -> List[List[int]]:
+        rng = random.Random(self.seed + self.epoch)
+        order = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(order)
+
+        batches = []
+        for s in range(0, len(order), self.window):
+            chunk = sorted(order[s:s + self.window], key=lambda i: self.lengths[i])
+            batch, longest = [], 0
+            for i in chunk:
+                new_longest = max(longest, self.lengths[i])
+                if batch and new_longest * (len(batch) + 1) > self.max_tokens:
+                    batches.append(batch)
+                    batch, new_longest = [], self.lengths[i]
+                batch.append(i)
+                longest = new_longest
+            if batch:
+                batches.append(batch)
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self._epoch_batches()
+        self.epoch += 1
+        yield from batches
+
+    def __len__(self) -> int:
+        return len(self._epoch_batches())
+
+
+class TokenBudgetTrainer(Trainer):
+    """
+    Trainer whose training batches are filled up to a token budget instead of
+    a fixed number of examples. Logs also report effective tokens/step and the
+    padding share since the previous log.
+    """
+
+    def __init__(self, *args, max_tokens: int, window: int = 1000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_tokens = max_tokens
+        self.window = window
+        self._tokens = 0
+        self._padded = 0
+        self._last_log = (0, 0, 0)  # (global_step, tokens, padded)
+
+    def get_train_dataloader(self):
+        ds = self._remove_unused_columns(self.train_dataset, description="training")
+        sampler = TokenBudgetBatchSampler(example_lengths(ds), self.max_tokens, window=self.window,
+                                          seed=self.args.seed)
+        loader = DataLoader(
+            ds,
+            batch_sampler=sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(loader)
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        # Counted here rather than in the collator, which may run in workers
+        mask = inputs.get("attention_mask")
+        total = inputs["input_ids"].numel()
+        if mask is not None and mask.dim() == 2:
+            real = int(mask.sum())
+        elif "position_ids" in inputs:
+            # Packed rows (4D or no mask): padding is the run of position 0 after the last example
+            started = inputs["position_ids"] > 0
+            last = started.shape[1] - started.flip(1).int().argmax(dim=1)
+            real = int(torch.where(started.any(dim=1), last, 0).sum())
+        else:
+            real = total
+        self._tokens += real
+        self._padded += total - real
+        return super().training_step(model, inputs, *args, **kwargs)
+
+    def log(self, logs, *args, **kwargs):
+        if "loss" in logs:
+            step, tokens, padded = self.state.global_step, self._tokens, self._padded
+            last_step, last_tokens, last_padded = self._last_log
+            if step > last_step:
+                logs["tokens_per_step"] = round((tokens - last_tokens) / (step - last_step), 1)
+                seen = (tokens - last_tokens) + (padded - last_padded)
+                logs["padding_ratio"] = round((padded - last_padded) / seen, 4) if seen else 0.0
+            self._last_log = (step, tokens, padded)
+        super().log(logs, *args, **kwargs)
@@ -0,0 +1,30 @@
+import time
+
+from transformers import TrainerCallback
+
+from slmlab.utils.profiling import get_profiler
+
+
+class StageTimingCallback(TrainerCallback):
+    """
+    Adds the time the Trainer spends in periodic evaluation and checkpoint
+    saving (both run after a step ends, eval first) to the run profile as
+    `train.eval` and `train.checkpoint_save`.
+    """
+
+    def __init__(self):
+        self._since = None
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self._since = time.perf_counter()
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        if self._since is not None:
+            now = time.perf_counter()
+            get_profiler().add("train.eval", now - self._since)
+            self._since = now
+
+    def on_save(self, args, state, control, **kwargs):
+        if self._since is not None:
+            get_profiler().add("train.checkpoint_save", time.perf_counter() - self._since)
+            self._since = None
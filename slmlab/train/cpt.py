@@ -0,0 +1,368 @@
+import json
+import logging
+import os
+import shutil
+import time
+from itertools import chain, islice
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+from transformers import Trainer, TrainerCallback, TrainingArguments, default_data_collator
+from transformers.trainer_utils import get_last_checkpoint
+
+from slmlab.prep.token_cache import tokenizer_fingerprint
+from slmlab.train.callbacks import StageTimingCallback
+from slmlab.train.sft_lora import load_lora_model, training_args
+from slmlab.utils.fingerprint import text_fingerprint
+from slmlab.utils.profiling import stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "artifacts/cpt_tokens"
+_META = "slmlab_cpt.json"
+_INDEX = "index.json"
+_POSITION = "cpt_position.json"
+_BATCH_LINES = 1024
+# Bump when the shard layout or what is tokenized changes
+CORPUS_VERSION = 1
+
+
+def _get(obj, key, default=None):
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    return getattr(obj, key, default)
+
+def _get_in(obj, keys, default=None):
+    cur = obj
+    for k in keys:
+        cur = _get(cur, k, None)
+        if cur is None:
+            return default
+    return cur
+
+
+def cache_dir(root: str | Path | None = None) -> Path:
+    return Path(root or os.environ.get("SLMLAB_CPT_CACHE", DEFAULT_CACHE_DIR))
+
+
+def corpus_files(patterns: List[str], base: str | Path) -> List[Path]:
+    files = sorted({p for pat in patterns for p in Path(base).glob(pat) if p.is_file()})
+    if not files:
+        raise FileNotFoundError(f"No corpus files matching {patterns} under {base}")
+    return files
+
+
+def corpus_key(files: List[Path], tok, text_field: str, shard_bytes: int) -> str:
+    """
+    Corpus files by (path, size, mtime) rather than content: hashing tens of
+    GB would cost a full read on every run, about as much as the tokenization.
+    """
+    stats = [(str(p.resolve()), p.stat().st_size, p.stat().st_mtime_ns) for p in files]
+    return text_fingerprint(stats, tokenizer_fingerprint(tok), text_field, shard_bytes, CORPUS_VERSION)[:24]
+
+
+def token_dtype(vocab_size: int):
+    return np.uint16 if vocab_size <= 1 << 16 else np.uint32
+
+
+def plan_shards(files: List[Path], shard_bytes: int) -> List[dict]:
+    """One shard per `shard_bytes` byte range of each file; workers align the ranges to line starts."""
+    shards = []
+    for path in files:
+        size = path.stat().st_size
+        for start in range(0, max(size, 1), shard_bytes):
+            shards.append({"source": str(path), "start": start, "end": min(size, start + shard_bytes)})
+    for i, s in enumerate(shards):
+        s["file"] = f"tokens-{i:05d}.bin"
+    return shards
+
+
+def _lines(path: str, start: int, end: int):
+    """Lines of `path` that begin in [start, end)."""
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()  # the line straddling `start` belongs to the previous range
+        pos = f.tell()
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line
+
+
+_worker_tok = None
+_worker_dtype = None
+
+
+def _init_worker(tok_name: str, trust_remote_code: bool, dtype: str):
+    global _worker_tok, _worker_dtype
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"  # parallelism comes from the pool
+    from transformers import AutoTokenizer
+    _worker_tok = AutoTokenizer.from_pretrained(tok_name, use_fast=True, trust_remote_code=trust_remote_code)
+    _worker_dtype = np.dtype(dtype)
+
+
+def _tokenize_shard(args: Tuple[int, dict, str, Optional[str]]) -> Tuple[int, int, int]:
+    """Tokenizes one byte range into a flat token file (documents joined by EOS); returns (shard, tokens, docs)."""
+    index, shard, out_dir, text_field = args
+    tok, eos = _worker_tok, _worker_tok.eos_token_id
+    out = Path(out_dir) / shard["file"]
+    tmp = out.with_name(out.name + ".tmp")
+    n_tokens = n_docs = 0
+
+    def flush(texts):
+        nonlocal n_tokens, n_docs
+        ids = tok(texts, add_special_tokens=True)["input_ids"]
+        flat = np.fromiter(chain.from_iterable(doc + [eos] for doc in ids), dtype=_worker_dtype,
+                           count=sum(len(doc) + 1 for doc in ids))
+        fh.write(flat.tobytes())
+        n_tokens += len(flat)
+        n_docs += len(texts)
+
+    with open(tmp, "wb", buffering=1 << 20) as fh:
+        texts = []
+        for line in _lines(shard["source"], shard["start"], shard["end"]):
+            line = line.decode("utf-8", errors="replace").strip()
+            if text_field:
+                line = (json.loads(line).get(text_field) or "").strip() if line else ""
+            if line:
+                texts.append(line)
+            if len(texts) >= _BATCH_LINES:
+                flush(texts)
+                texts = []
+        if texts:
+            flush(texts)
+    tmp.replace(out)
+    return index, n_tokens, n_docs
+
+
+def _write_json(path: Path, obj):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(obj, indent=2, default=str))
+    tmp.replace(path)
+
+
+def build_corpus(files: List[Path], tok, tok_name: str, key: str, text_field: Optional[str] = None,
+                 shard_bytes: int = 256 << 20, num_proc: int = 1, trust_remote_code: bool = True,
+                 root: str | Path | None = None, meta: Optional[dict] = None) -> Path:
+    """
+    Tokenizes the corpus once, in parallel, into flat token files (uint16
+    when the vocabulary fits, else uint32), one per byte range of the input,
+    plus an `index.json` of per-shard token counts. Plain-text files hold one
+    document per line; with `text_field`, lines are JSON objects.
+
+    Completed shards are recorded in the index as they land, so an
+    interrupted build only tokenizes the missing ones. Returns the directory.
+    """
+    path = cache_dir(root) / key
+    if (path / _META).exists():
+        logger.info(f"tokenized corpus hit: {path}")
+        os.utime(path / _META)
+        return path
+
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.mkdir(parents=True, exist_ok=True)
+    dtype = np.dtype(token_dtype(len(tok))).name
+    if (tmp / _INDEX).exists():
+        index = json.loads((tmp / _INDEX).read_text())
+    else:
+        index = {"dtype": dtype, "shards": plan_shards(files, shard_bytes)}
+    todo = [i for i, s in enumerate(index["shards"]) if "tokens" not in s]
+    logger.info(f"tokenizing corpus into {tmp}: {len(todo)}/{len(index['shards'])} shards to do, "
+                f"{num_proc} workers, {dtype}")
+
+    with stage("cpt.tokenize", items=len(todo)) as st, \
+         Pool(max(1, num_proc), initializer=_init_worker, initargs=(tok_name, trust_remote_code, dtype)) as pool:
+        tasks = [(i, index["shards"][i], str(tmp), text_field) for i in todo]
+        for i, n_tokens, n_docs in pool.imap_unordered(_tokenize_shard, tasks):
+            index["shards"][i].update(tokens=n_tokens, docs=n_docs)
+            _write_json(tmp / _INDEX, index)
+        st.extra = {"tokens": sum(s["tokens"] for s in index["shards"])}
+
+    total = sum(s["tokens"] for s in index["shards"])
+    logger.info(f"corpus: {total} tokens in {len(index['shards'])} shards")
+    _write_json(tmp / _META, {"created": time.time(), "tokens": total, "docs": sum(s["docs"] for s in index["shards"]),
+                              "dtype": dtype, "files": [str(p) for p in files], **(meta or {})})
+    shutil.rmtree(path, ignore_errors=True)
+    tmp.rename(path)
+    return path
+
+
+class TokenWindows(Dataset):
+    """
+    Fixed-length training windows over the memory-mapped token shards:
+    window i is a contiguous `seq_len` slice of one shard (each shard's
+    remainder is dropped), read on access without loading the corpus.
+    """
+
+    def __init__(self, path: str | Path, seq_len: int):
+        self.path = Path(path)
+        self.seq_len = seq_len
+        index = json.loads((self.path / _INDEX).read_text())
+        self.dtype = np.dtype(index["dtype"])
+        self.files = [s["file"] for s in index["shards"]]
+        self.counts = np.array([s["tokens"] // seq_len for s in index["shards"]], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+        self._maps: Dict[int, np.memmap] = {}
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def _map(self, shard: int) -> np.memmap:
+        mm = self._maps.get(shard)
+        if mm is None:
+            mm = self._maps[shard] = np.memmap(self.path / self.files[shard], dtype=self.dtype, mode="r")
+        return mm
+
+    def __getitem__(self, i: int) -> Dict[str, torch.Tensor]:
+        shard = int(np.searchsorted(self.offsets, i, side="right")) - 1
+        a = (i - int(self.offsets[shard])) * self.seq_len
+        ids = torch.from_numpy(self._map(shard)[a:a + self.seq_len].astype(np.int64))
+        return {"input_ids": ids, "labels": ids}
+
+
+class ShardWindowSampler(Sampler):
+    """
+    Each epoch visits the shards in a seeded random order and, within a
+    shard, its windows in a seeded random order, so reads stay inside one
+    file at a time. The order is a pure function of (seed, epoch), which
+    makes any point of it addressable as (epoch, shard, offset).
+
+    The sampler is one stream running on from `start` across epochs; each
+    pass of the DataLoader takes the next whole number of `batch` windows
+    (the windows of one optimizer step), so every step consumes exactly
+    `batch` windows and a step count maps back to a position.
+    """
+
+    def __init__(self, ds: TokenWindows, seed: int = 42, batch: int = 1,
+                 start: Optional[Tuple[int, int, int]] = None):
+        if len(ds) < batch:
+            raise ValueError(f"{len(ds)} windows cannot fill one step of {batch}")
+        self.ds = ds
+        self.seed = seed
+        self.batch = batch
+        self.start = start or (0, int(self.shard_order(0)[0]), 0)
+
+    def __len__(self) -> int:
+        return len(self.ds) - len(self.ds) % self.batch
+
+    def shard_order(self, epoch: int) -> List[int]:
+        return np.random.default_rng([self.seed, epoch]).permutation(len(self.ds.counts)).tolist()
+
+    def windows(self, epoch: int, shard: int) -> np.ndarray:
+        local = np.random.default_rng([self.seed, epoch, shard]).permutation(int(self.ds.counts[shard]))
+        return local + self.ds.offsets[shard]
+
+    def advance(self, position: Tuple[int, int, int], windows: int) -> Tuple[int, int, int]:
+        """The (epoch, shard, offset) `windows` windows after `position`."""
+        epoch, shard, offset = position
+        order = self.shard_order(epoch)
+        k = int(self.ds.counts[order[:order.index(shard)]].sum()) + offset + windows
+        epoch, k = epoch + k // len(self.ds), k % len(self.ds)
+        for s in self.shard_order(epoch):
+            if k < self.ds.counts[s]:
+                return epoch, s, k
+            k -= int(self.ds.counts[s])
+
+    def _stream(self, position: Tuple[int, int, int]):
+        epoch, first, offset = position
+        while True:
+            order = self.shard_order(epoch)
+            for s in order[order.index(first):]:
+                yield from self.windows(epoch, s)[offset:].tolist()
+                offset = 0
+            epoch += 1
+            first = self.shard_order(epoch)[0]
+
+    def __iter__(self):
+        start = self.start
+        yield from islice(self._stream(start), len(self))
+        self.start = self.advance(start, len(self))
+
+
+class CPTPositionCallback(TrainerCallback):
+    """Writes the sampler's (epoch, shard, offset) into every checkpoint, for resuming there."""
+
+    def __init__(self, sampler: ShardWindowSampler, start_step: int = 0):
+        self.sampler = sampler
+        self.origin = sampler.start
+        self.start_step = start_step
+
+    def on_save(self, args, state, control, **kwargs):
+        consumed = (state.global_step - self.start_step) * self.sampler.batch
+        epoch, shard, offset = self.sampler.advance(self.origin, consumed)
+        ckpt = Path(args.output_dir) / f"checkpoint-{state.global_step}"
+        if ckpt.is_dir():
+            _write_json(ckpt / _POSITION, {"epoch": epoch, "shard": shard, "offset": offset,
+                                           "global_step": state.global_step, "seq_len": self.sampler.ds.seq_len,
+                                           "corpus": self.sampler.ds.path.name})
+
+
+class CPTTrainer(Trainer):
+    def __init__(self, *args, sampler: ShardWindowSampler, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.window_sampler = sampler
+
+    def _get_train_sampler(self, *args, **kwargs):
+        return self.window_sampler
+
+
+def train(cfg, corpus_path: str | Path, output_dir: str, resume: bool = True):
+    """
+    LoRA continued pretraining on fixed-length windows of the tokenized
+    corpus. With `resume`, the latest checkpoint in `output_dir` is restored
+    and the data picks up at the shard/offset recorded in it; checkpoints of
+    another corpus, sequence length or method are refused. Without it, the
+    checkpoints in `output_dir` are removed and training starts over.
+    """
+    tok, model = load_lora_model(cfg)
+    seq_len = int(_get_in(cfg, ["method", "cpt", "seq_len"], 2048))
+    targs = training_args(cfg, output_dir)
+    ds = TokenWindows(corpus_path, seq_len)
+    if len(ds) == 0:
+        raise ValueError(f"Corpus {corpus_path} has no window of {seq_len} tokens")
+
+    start, start_step, last = None, 0, None
+    checkpoints = sorted(Path(output_dir).glob("checkpoint-*")) if Path(output_dir).is_dir() else []
+    if checkpoints and not resume:
+        logger.info(f"cpt: starting over, removing {len(checkpoints)} checkpoints in {output_dir}")
+        for c in checkpoints:
+            shutil.rmtree(c)
+    elif checkpoints:
+        last = get_last_checkpoint(output_dir)
+        if not (Path(last) / _POSITION).exists():
+            raise ValueError(f"{last} is not a cpt checkpoint (no {_POSITION}); pass --no-resume to start over")
+        pos = json.loads((Path(last) / _POSITION).read_text())
+        if pos.get("corpus") != Path(corpus_path).name or pos.get("seq_len") != seq_len:
+            raise ValueError(f"{last} was trained on corpus {pos.get('corpus')} with seq_len={pos.get('seq_len')}, "
+                             f"not {Path(corpus_path).name} with seq_len={seq_len}; pass --no-resume to start over")
+        start, start_step = (pos["epoch"], pos["shard"], pos["offset"]), pos["global_step"]
+        # the sampler resumes the data itself; the Trainer must not skip batches again
+        targs["ignore_data_skip"] = True
+        logger.info(f"cpt: resuming {last} at epoch {pos['epoch']}, shard {pos['shard']}, window {pos['offset']}")
+
+    args = TrainingArguments(**targs)
+    batch = args.train_batch_size * args.gradient_accumulation_steps * args.world_size
+    sampler = ShardWindowSampler(ds, seed=targs["seed"], batch=batch, start=start)
+    trainer = CPTTrainer(
+        model=model,
+        args=args,
+        train_dataset=ds,
+        tokenizer=tok,
+        data_collator=default_data_collator,
+        callbacks=[StageTimingCallback(), CPTPositionCallback(sampler, start_step)],
+        sampler=sampler,
+    )
+    logger.info(f"cpt: {len(ds)} windows of {seq_len} tokens over {len(ds.files)} shards")
+    with stage("train.fit") as st:
+        result = trainer.train(resume_from_checkpoint=last)
+        st.items = trainer.state.global_step
+        st.extra = {"train_loss": result.training_loss}
+    with stage("train.save"):
+        trainer.save_model(f"{output_dir.rstrip('/')}/adapter/")
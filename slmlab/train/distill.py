@@ -0,0 +1,315 @@
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from transformers import AutoModelForCausalLM, AutoTokenizer, DataCollatorForSeq2Seq, Trainer, TrainingArguments
+
+from slmlab.prep.tokenization import IGNORE_INDEX
+from slmlab.train.callbacks import StageTimingCallback
+from slmlab.train.sft_lora import get_device, load_lora_model, training_args
+from slmlab.utils.fingerprint import text_fingerprint
+from slmlab.utils.profiling import stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "artifacts/teacher_logits"
+_META = "slmlab_teacher.json"
+_PROGRESS = "progress.json"
+SHARD_EXAMPLES = 4096
+# Bump when the cache layout or what is stored changes
+CACHE_VERSION = 1
+
+
+def _get(obj, key, default=None):
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    return getattr(obj, key, default)
+
+def _get_in(obj, keys, default=None):
+    cur = obj
+    for k in keys:
+        cur = _get(cur, k, None)
+        if cur is None:
+            return default
+    return cur
+
+
+def cache_dir(root: str | Path | None = None) -> Path:
+    return Path(root or os.environ.get("SLMLAB_TEACHER_CACHE", DEFAULT_CACHE_DIR))
+
+
+def cache_key(dataset_key: str, teacher_key: str, top_k: int, temperature: float) -> str:
+    """Tokenized dataset (see token_cache.dataset_fingerprint) x teacher weights x what is kept of its logits."""
+    return text_fingerprint(dataset_key, teacher_key, top_k, float(temperature), CACHE_VERSION)[:24]
+
+
+def supervised_span(labels: List[int]) -> Tuple[int, int]:
+    """
+    (first position, count) of the logits that predict a learned token:
+    position t predicts labels[t + 1]. Spans are contiguous for our examples
+    (prompt masked, completion learned), so gaps inside them are kept too.
+    """
+    learned = np.flatnonzero(np.asarray(labels[1:]) != IGNORE_INDEX)
+    if len(learned) == 0:
+        return 0, 0
+    return int(learned[0]), int(learned[-1] - learned[0] + 1)
+
+
+def _write_json(path: Path, obj):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(obj, indent=2, default=str))
+    tmp.replace(path)
+
+
+@torch.inference_mode()
+def build_teacher_cache(train_ds, teacher_name: str, key: str, student_tok, top_k: int = 32,
+                        temperature: float = 1.0, batch_size: int = 4, dtype: Optional[str] = None,
+                        trust_remote_code: bool = True, root: str | Path | None = None,
+                        meta: Optional[dict] = None) -> Path:
+    """
+    Runs the teacher once over the tokenized training examples and stores,
+    for every position that predicts a learned token, its top-k token ids
+    (uint16 when the vocabulary fits) and log-probabilities (float16) at
+    `temperature`. Rows go to .npy shards of SHARD_EXAMPLES examples, sized
+    up front from the labels and filled through memory maps; `offsets.npy`
+    and `starts.npy` locate each example's rows.
+
+    Finished shards are recorded as they complete, so an interrupted build
+    resumes at the first missing shard. Returns the cache directory.
+    """
+    path = cache_dir(root) / key
+    if (path / _META).exists():
+        logger.info(f"teacher cache hit: {path}")
+        os.utime(path / _META)
+        return path
+
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.mkdir(parents=True, exist_ok=True)
+    with stage("distill.spans", items=len(train_ds)):
+        spans = [supervised_span(labels) for labels in train_ds["labels"]]
+    starts = np.array([s for s, _ in spans], dtype=np.int32)
+    offsets = np.zeros(len(spans) + 1, dtype=np.int64)
+    np.cumsum([n for _, n in spans], out=offsets[1:])
+    np.save(tmp / "starts.npy", starts)
+    np.save(tmp / "offsets.npy", offsets)
+
+    vocab = len(student_tok)
+    id_dtype = np.uint16 if vocab <= 1 << 16 else np.int32
+    n_shards = max(1, -(-len(spans) // SHARD_EXAMPLES))
+    progress = json.loads((tmp / _PROGRESS).read_text()) if (tmp / _PROGRESS).exists() else {"done": []}
+    todo = [s for s in range(n_shards) if s not in progress["done"]]
+    if progress["done"]:
+        logger.info(f"teacher cache: resuming {tmp} at shard {todo[0] if todo else n_shards}/{n_shards}")
+
+    teacher = None
+    if todo:
+        teacher_tok = AutoTokenizer.from_pretrained(teacher_name, use_fast=True, trust_remote_code=trust_remote_code)
+        if teacher_tok.get_vocab() != student_tok.get_vocab():
+            raise ValueError(f"Teacher {teacher_name} does not share the student's vocabulary; "
+                             "top-k logit distillation needs the same tokenizer.")
+        device = get_device()
+        kwargs = {"trust_remote_code": trust_remote_code}
+        if dtype:
+            kwargs["torch_dtype"] = getattr(torch, dtype)
+        with stage("distill.teacher_load"):
+            teacher = AutoModelForCausalLM.from_pretrained(teacher_name, **kwargs).to(device).eval()
+        logger.info(f"teacher {teacher_name} on {device}: {n_shards - len(todo)}/{n_shards} shards cached")
+
+    for shard in todo:
+        lo, hi = shard * SHARD_EXAMPLES, min(len(spans), (shard + 1) * SHARD_EXAMPLES)
+        rows = int(offsets[hi] - offsets[lo])
+        ids_out = np.lib.format.open_memmap(tmp / f"ids-{shard:05d}.npy", mode="w+", dtype=id_dtype,
+                                            shape=(rows, top_k))
+        logp_out = np.lib.format.open_memmap(tmp / f"logp-{shard:05d}.npy", mode="w+", dtype=np.float16,
+                                             shape=(rows, top_k))
+        # Length-sorted batches keep padding (and wasted teacher compute) low
+        order = sorted((i for i in range(lo, hi) if spans[i][1]), key=lambda i: len(train_ds[i]["input_ids"]))
+        with stage("distill.teacher_pass") as st:
+            for b in range(0, len(order), batch_size):
+                idx = order[b:b + batch_size]
+                seqs = [train_ds[i]["input_ids"] for i in idx]
+                width = max(len(x) for x in seqs)
+                input_ids = torch.full((len(seqs), width), student_tok.pad_token_id or 0, dtype=torch.long)
+                mask = torch.zeros((len(seqs), width), dtype=torch.long)
+                for r, x in enumerate(seqs):  # right padding: positions match the unpadded example
+                    input_ids[r, :len(x)] = torch.tensor(x)
+                    mask[r, :len(x)] = 1
+                logits = teacher(input_ids=input_ids.to(teacher.device), attention_mask=mask.to(teacher.device)).logits
+                for r, i in enumerate(idx):
+                    start, n = spans[i]
+                    logp = F.log_softmax(logits[r, start:start + n, :vocab].float() / temperature, dim=-1)
+                    top = torch.topk(logp, top_k, dim=-1)
+                    a, z = offsets[i] - offsets[lo], offsets[i + 1] - offsets[lo]
+                    ids_out[a:z] = top.indices.cpu().numpy().astype(id_dtype)
+                    logp_out[a:z] = top.values.cpu().numpy().astype(np.float16)
+            st.items = rows
+        ids_out.flush()
+        logp_out.flush()
+        del ids_out, logp_out
+        progress["done"].append(shard)
+        _write_json(tmp / _PROGRESS, progress)
+        logger.info(f"teacher cache: shard {shard + 1}/{n_shards} ({rows} positions)")
+
+    _write_json(tmp / _META, {"created": time.time(), "teacher": teacher_name, "top_k": top_k,
+                              "temperature": temperature, "examples": len(spans), "positions": int(offsets[-1]),
+                              "shards": n_shards, "shard_examples": SHARD_EXAMPLES,
+                              "id_dtype": np.dtype(id_dtype).name, **(meta or {})})
+    (tmp / _PROGRESS).unlink()
+    shutil.rmtree(path, ignore_errors=True)
+    tmp.rename(path)
+    return path
+
+
+class TeacherCache:
+    """Read side of a teacher cache: shards opened memory-mapped, rows sliced without copying."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / _META).read_text())
+        self.top_k, self.temperature = self.meta["top_k"], self.meta["temperature"]
+        self.shard_examples = self.meta["shard_examples"]
+        self.starts = np.load(self.path / "starts.npy")
+        self.offsets = np.load(self.path / "offsets.npy")
+        self._ids = [np.load(self.path / f"ids-{s:05d}.npy", mmap_mode="r") for s in range(self.meta["shards"])]
+        self._logp = [np.load(self.path / f"logp-{s:05d}.npy", mmap_mode="r") for s in range(self.meta["shards"])]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def get(self, i: int) -> Tuple[int, np.ndarray, np.ndarray]:
+        """(first position, top-k ids, top-k log-probs) of example `i`."""
+        shard = i // self.shard_examples
+        base = self.offsets[shard * self.shard_examples]
+        a, z = self.offsets[i] - base, self.offsets[i + 1] - base
+        return int(self.starts[i]), self._ids[shard][a:z], self._logp[shard][a:z]
+
+
+class DistillCollator:
+    """
+    Pads like the SFT collator and lays each example's cached teacher rows
+    out on the batch's positions: `teacher_ids` / `teacher_logp` (B, T, k)
+    and `teacher_mask` (B, T) marking the positions that have them.
+    """
+
+    def __init__(self, tok, cache: TeacherCache):
+        self.base = DataCollatorForSeq2Seq(tok, label_pad_token_id=IGNORE_INDEX)
+        self.left = tok.padding_side == "left"
+        self.cache = cache
+
+    def __call__(self, features):
+        idx = [f.pop("teacher_idx") for f in features]
+        lengths = [len(f["input_ids"]) for f in features]
+        batch = self.base(features)
+        bsz, width = batch["input_ids"].shape
+        k = self.cache.top_k
+        t_ids = torch.zeros((bsz, width, k), dtype=torch.long)
+        t_logp = torch.zeros((bsz, width, k), dtype=torch.float32)
+        t_mask = torch.zeros((bsz, width), dtype=torch.bool)
+        for r, (i, n) in enumerate(zip(idx, lengths)):
+            start, ids, logp = self.cache.get(i)
+            a = (width - n if self.left else 0) + start
+            t_ids[r, a:a + len(ids)] = torch.from_numpy(ids.astype(np.int64))
+            t_logp[r, a:a + len(ids)] = torch.from_numpy(logp.astype(np.float32))
+            t_mask[r, a:a + len(ids)] = True
+        batch.update(teacher_ids=t_ids, teacher_logp=t_logp, teacher_mask=t_mask)
+        return batch
+
+
+def topk_kl(student_logits: torch.Tensor, teacher_ids: torch.Tensor, teacher_logp: torch.Tensor,
+            temperature: float = 1.0) -> torch.Tensor:
+    """
+    Mean KL(teacher || student) per position over the teacher's top-k tokens
+    plus one bucket for the rest of the vocabulary, so both sides are proper
+    distributions without the teacher's full logits.
+    """
+    logq = F.log_softmax(student_logits.float() / temperature, dim=-1)
+    logq_k = logq.gather(-1, teacher_ids)
+    logp_k = teacher_logp.float()
+    p_k = logp_k.exp()
+    p_rest = (1 - p_k.sum(-1)).clamp_min(1e-8)
+    q_rest = (1 - logq_k.exp().sum(-1)).clamp_min(1e-8)
+    kl = (p_k * (logp_k - logq_k)).sum(-1) + p_rest * (p_rest.log() - q_rest.log())
+    return kl.mean()
+
+
+class DistillTrainer(Trainer):
+    """
+    loss = alpha * T^2 * KL(teacher || student) + (1 - alpha) * cross-entropy
+    on the labels; the teacher side comes from the cache, never a model.
+    """
+
+    def __init__(self, *args, alpha: float = 0.5, temperature: float = 1.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        # compute_loss returns per-micro-batch means, so the Trainer must
+        # scale them by gradient accumulation itself
+        self.model_accepts_loss_kwargs = False
+        self.alpha = alpha
+        self.temperature = temperature
+        self._sums = {"kd_loss": 0.0, "ce_loss": 0.0, "n": 0}
+
+    def _set_signature_columns_if_needed(self):
+        super()._set_signature_columns_if_needed()
+        if "teacher_idx" not in self._signature_columns:
+            self._signature_columns = list(self._signature_columns) + ["teacher_idx"]
+
+    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+        t_ids, t_logp, t_mask = inputs.pop("teacher_ids"), inputs.pop("teacher_logp"), inputs.pop("teacher_mask")
+        outputs = model(**inputs)
+        ce = outputs.loss
+        if t_mask.any():
+            kd = topk_kl(outputs.logits[t_mask], t_ids[t_mask], t_logp[t_mask], self.temperature)
+            kd = kd * self.temperature ** 2
+        else:
+            kd = ce.new_zeros(())
+        loss = self.alpha * kd + (1 - self.alpha) * ce
+        self._sums["kd_loss"] += float(kd.detach())
+        self._sums["ce_loss"] += float(ce.detach())
+        self._sums["n"] += 1
+        return (loss, outputs) if return_outputs else loss
+
+    def log(self, logs, *args, **kwargs):
+        if "loss" in logs and self._sums["n"]:
+            for name in ("kd_loss", "ce_loss"):
+                logs[name] = round(self._sums[name] / self._sums["n"], 4)
+            self._sums = {"kd_loss": 0.0, "ce_loss": 0.0, "n": 0}
+        super().log(logs, *args, **kwargs)
+
+
+def train(cfg, ds_tokenized, output_dir: str, cache: TeacherCache):
+    """LoRA student trained on the labels and the cached teacher distribution."""
+    tok, model = load_lora_model(cfg)
+    distill_cfg = _get_in(cfg, ["method", "distill"], {})
+    train_cfg = _get(cfg, "train", {})
+    if _get(train_cfg, "packing", False) or _get(train_cfg, "max_tokens_per_batch", None):
+        logger.warning("distill: packing and token-budget batching are not used (teacher rows follow examples)")
+
+    train_ds = ds_tokenized["train"]
+    if len(train_ds) != len(cache):
+        raise ValueError(f"Teacher cache {cache.path} has {len(cache)} examples, the training set {len(train_ds)}.")
+    train_ds = train_ds.add_column("teacher_idx", list(range(len(train_ds))))
+
+    trainer = DistillTrainer(
+        model=model,
+        args=TrainingArguments(**training_args(cfg, output_dir)),
+        train_dataset=train_ds,
+        tokenizer=tok,
+        data_collator=DistillCollator(tok, cache),
+        callbacks=[StageTimingCallback()],
+        alpha=float(_get(distill_cfg, "alpha", 0.5)),
+        temperature=cache.temperature,
+    )
+    logger.info(f"distill: top-{cache.top_k} teacher logits from {cache.path}, "
+                f"alpha={trainer.alpha}, T={trainer.temperature}")
+    with stage("train.fit") as st:
+        result = trainer.train()
+        st.items = trainer.state.global_step
+        st.extra = {"train_loss": result.training_loss}
+    with stage("train.save"):
+        trainer.save_model(f"{output_dir.rstrip('/')}/adapter/")
@@ -0,0 +1,127 @@
+import random
+from typing import List
+
+import numpy as np
+import torch
+from datasets import Dataset
+
+IGNORE_INDEX = -100
+
+
+def best_fit_decreasing(lengths: List[int], capacity: int) -> List[List[int]]:
+    """
+    Bins example indices, longest first, into the open bin with the least
+    room that still fits, so that each bin's total length fits `capacity`.
+    Open bins are indexed by remaining room, keeping this near-linear.
+    """
+    bins: List[List[int]] = []
+    by_room: List[List[int]] = [[] for _ in range(capacity + 1)]
+    has_room = np.zeros(capacity + 1, dtype=bool)
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+        n = min(lengths[i], capacity)
+        fits = np.flatnonzero(has_room[n:])
+        if len(fits):
+            room = n + int(fits[0])
+            b = by_room[room].pop()
+            has_room[room] = bool(by_room[room])
+        else:
+            room, b = capacity, len(bins)
+            bins.append([])
+        bins[b].append(i)
+        by_room[room - n].append(b)
+        has_room[room - n] = True
+    return bins
+
+
+def padding_ratio(lengths: List[int], batch_size: int, seed: int = 42) -> float:
+    """
+    Share of padding when `lengths` are batched in shuffled order and each
+    batch is padded to its longest member (what the unpacked Trainer does).
+    """
+    order = list(range(len(lengths)))
+    random.Random(seed).shuffle(order)
+    real = padded = 0
+    for s in range(0, len(order), batch_size):
+        batch = [lengths[i] for i in order[s:s + batch_size]]
+        real += sum(batch)
+        padded += max(batch) * len(batch)
+    return 1 - real / padded if padded else 0.0
+
+
+def example_lengths(ds: Dataset) -> List[int]:
+    """Token count of every example, computed batch-wise on the Arrow table."""
+    with_len = ds.map(lambda b: {"_len": [len(x) for x in b["input_ids"]]}, batched=True,
+                      remove_columns=ds.column_names)
+    return with_len["_len"]
+
+
+def pack_dataset(ds: Dataset, max_length: int) -> Dataset:
+    """
+    Concatenates tokenized examples into rows of at most `max_length` tokens.
+    Each row keeps `position_ids` restarting at 0 for every example (they mark
+    the boundaries for the collator), and the first label of every example is
+    masked so no token is learned from the previous example's context.
+    """
+    lengths = [min(n, max_length) for n in example_lengths(ds)]
+    bins = best_fit_decreasing(lengths, max_length)
+
+    def rows():
+        for b in bins:
+            ids, labels, pos = [], [], []
+            for i in b:
+                ex = ds[i]
+                n = lengths[i]
+                ids += ex["input_ids"][:n]
+                ex_labels = list(ex.get("labels", ex["input_ids"])[:n])
+                ex_labels[0] = IGNORE_INDEX
+                labels += ex_labels
+                pos += list(range(n))
+            yield {"input_ids": ids, "labels": labels, "position_ids": pos}
+
+    return Dataset.from_generator(rows)
+
+
+class PackedCollator:
+    """
+    Pads packed rows to the longest row of the batch and builds attention
+    that never crosses example boundaries: flash-attention kernels read the
+    boundaries from `position_ids`, other implementations get a 4D
+    block-diagonal causal mask.
+    """
+
+    def __init__(self, pad_token_id: int, attn_implementation: str = None, dtype=torch.float32):
+        self.pad_token_id = pad_token_id
+        self.use_4d_mask = not (attn_implementation or "").startswith("flash_attention")
+        self.dtype = dtype
+
+    def __call__(self, features):
+        width = max(len(f["input_ids"]) for f in features)
+        ids = torch.full((len(features), width), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((len(features), width), IGNORE_INDEX, dtype=torch.long)
+        pos = torch.zeros((len(features), width), dtype=torch.long)
+        for r, f in enumerate(features):
+            n = len(f["input_ids"])
+            ids[r, :n] = torch.tensor(f["input_ids"])
+            labels[r, :n] = torch.tensor(f["labels"])
+            pos[r, :n] = torch.tensor(f["position_ids"])
+        batch = {"input_ids": ids, "labels": labels, "position_ids": pos}
+
+        if self.use_4d_mask:
+            batch["attention_mask"] = self._block_causal_mask(features, width)
+        return batch
+
+    def _block_causal_mask(self, features, width):
+        allowed = torch.zeros((len(features), width, width), dtype=torch.bool)
+        for r, f in enumerate(features):
+            p = f["position_ids"]
+            start = 0
+            for t in range(1, len(p) + 1):
+                if t == len(p) or p[t] == 0:
+                    allowed[r, start:t, start:t] = True
+                    start = t
+        allowed &= torch.ones((width, width), dtype=torch.bool).tril()
+        # Padding rows attend to themselves only, to keep softmax finite
+        allowed |= torch.eye(width, dtype=torch.bool)
+        mask = torch.zeros(allowed.shape, dtype=self.dtype)
+        mask.masked_fill_(~allowed, torch.finfo(self.dtype).min)
+        return mask[:, None, :, :]
@@ -1,7 +1,14 @@
+import logging
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer
+from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer, DataCollatorForSeq2Seq
 from peft import LoraConfig, get_peft_model, TaskType, get_peft_model_state_dict
 import torch.nn as nn
+from slmlab.train.packing import example_lengths, pack_dataset, padding_ratio, PackedCollator
+from slmlab.train.batching import TokenBudgetTrainer
+from slmlab.train.callbacks import StageTimingCallback
+from slmlab.utils.profiling import stage
+
+logger = logging.getLogger(__name__)
 
 def get_device():
     if torch.cuda.is_available():
@@ -42,7 +49,8 @@ def _guess_target_modules(model):
             names.append(leaf)
     return sorted(set(names))
 
-def train(cfg, ds_tokenized, output_dir: str):
+def load_lora_model(cfg):
+    """Tokenizer and LoRA-wrapped model from cfg.model / cfg.method.peft."""
     model_name = _get_in(cfg, ["model", "name"])
     trust_remote_code = _get_in(cfg, ["model", "trust_remote_code"], True)
     attn_impl = _get_in(cfg, ["model", "attn_implementation"], None)
@@ -59,11 +67,12 @@ def train(cfg, ds_tokenized, output_dir: str):
         model_kwargs["attn_implementation"] = attn_impl
 
     device = get_device()
-    print(f"[slmlab] Using device: {device}, attn_impl={attn_impl or 'default'}")
+    logger.info(f"Using device: {device}, attn_impl={attn_impl or 'default'}")
 
-    model = AutoModelForCausalLM.from_pretrained(
-        model_name, **model_kwargs
-    ).to(device)
+    with stage("train.model_load"):
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name, **model_kwargs
+        ).to(device)
     
     # recommended when using gradient checkpointing
     model.config.use_cache = False
@@ -84,8 +93,8 @@ def train(cfg, ds_tokenized, output_dir: str):
     )
     model = get_peft_model(model, lora)
     
-    print("[peft] trainable keys (first 20):", list(get_peft_model_state_dict(model).keys())[:20])
-    print("[peft] #trainable params:", _num_trainable(model))
+    logger.info(f"trainable keys (first 20): {list(get_peft_model_state_dict(model).keys())[:20]}")
+    logger.info(f"#trainable params: {_num_trainable(model)}")
 
     if _num_trainable(model) == 0:
         # Fallback: target all linear-like layers by leaf name
@@ -100,7 +109,11 @@ def train(cfg, ds_tokenized, output_dir: str):
         # fallback if user provided names matched nothing
         lora.target_modules = "all-linear"
         model = get_peft_model(model, lora)  # rewrap
+    return tok, model
+
 
+def training_args(cfg, output_dir: str) -> dict:
+    """TrainingArguments kwargs from cfg.train."""
     # TrainingArguments — read safely and coerce types where needed
     train_cfg = _get(cfg, "train", {})
     lr = _get(train_cfg, "lr", 2e-4)
@@ -132,18 +145,62 @@ def train(cfg, ds_tokenized, output_dir: str):
         targs["max_steps"] = max_steps
     else:
         targs["num_train_epochs"] = _get(train_cfg, "num_train_epochs", 1)
+    return targs
 
+
+def train(cfg, ds_tokenized, output_dir: str):
+    attn_impl = _get_in(cfg, ["model", "attn_implementation"], None)
+    tok, model = load_lora_model(cfg)
+    train_cfg = _get(cfg, "train", {})
+    targs = training_args(cfg, output_dir)
     args = TrainingArguments(**targs)
 
     # DatasetDict is dict-like; .get is fine, but use [] fallback if not present
     eval_ds = ds_tokenized.get("eval") if hasattr(ds_tokenized, "get") else ds_tokenized["eval"] if "eval" in ds_tokenized else None
-
-    trainer = Trainer(
+    train_ds = ds_tokenized["train"]
+
+    # Pads input_ids with the pad token and labels with -100, per batch
+    collator = DataCollatorForSeq2Seq(tok, label_pad_token_id=-100)
+
+    if _get(train_cfg, "packing", False):
+        conv = [t for t in (getattr(model.config, "layer_types", None) or []) if "conv" in t]
+        if conv and not _get(train_cfg, "packing_allow_conv", False):
+            raise ValueError(f"train.packing: {len(conv)} convolution layers would mix neighbouring packed examples "
+                             "(only attention layers respect example boundaries); disable packing or set "
+                             "train.packing_allow_conv: true to accept the cross-example leakage.")
+        max_len = _get(train_cfg, "max_length", 1024)
+        bs = targs["per_device_train_batch_size"]
+        with stage("train.packing", items=len(train_ds)):
+            lengths = example_lengths(train_ds)
+            before = padding_ratio(lengths, bs, seed=targs["seed"])
+            train_ds = pack_dataset(train_ds, max_len)
+            if eval_ds is not None:
+                eval_ds = pack_dataset(eval_ds, max_len)
+        after = padding_ratio(example_lengths(train_ds), bs, seed=targs["seed"])
+        logger.info(f"packing: {len(lengths)} examples -> {len(train_ds)} sequences of <= {max_len} tokens, "
+                    f"padding {before:.1%} -> {after:.1%}")
+        collator = PackedCollator(tok.pad_token_id, attn_impl, dtype=model.dtype)
+
+    trainer_kwargs = dict(
         model=model,
         args=args,
-        train_dataset=ds_tokenized["train"],
+        train_dataset=train_ds,
         eval_dataset=eval_ds,
         tokenizer=tok,
+        data_collator=collator,
+        callbacks=[StageTimingCallback()],
     )
-    trainer.train()
-    trainer.save_model(f"{output_dir.rstrip('/')}/adapter/")
+    max_tokens = _get(train_cfg, "max_tokens_per_batch", None)
+    if max_tokens:
+        # Batches hold a token budget; per_device_train_batch_size only applies to eval
+        logger.info(f"token-budget batching: <= {max_tokens} padded tokens per batch")
+        trainer = TokenBudgetTrainer(**trainer_kwargs, max_tokens=max_tokens,
+                                     window=_get(train_cfg, "length_grouping_window", 1000))
+    else:
+        trainer = Trainer(**trainer_kwargs)
+    with stage("train.fit") as st:  # items = optimizer steps
+        result = trainer.train()
+        st.items = trainer.state.global_step
+        st.extra = {"train_loss": result.training_loss}
+    with stage("train.save"):
+        trainer.save_model(f"{output_dir.rstrip('/')}/adapter/")
@@ -3,6 +3,7 @@ import torch
 from datasets import load_dataset
 from trl import SFTTrainer, SFTConfig
 from unsloth.chat_templates import train_on_responses_only
+from slmlab.utils.profiling import stage
 
 def _get(obj, key, default=None):
     """Safe get for dict or SimpleNamespace."""
@@ -23,13 +24,14 @@ def train(cfg, output_dir: str):
     model_name = _get_in(cfg, ["model", "name"])
     unsloth_settings = _get_in(cfg, ["method", "unsloth_settings"], {})
 
-    model, tokenizer = FastModel.from_pretrained(
-        model_name=model_name,
-        max_seq_length=_get(unsloth_settings, "max_seq_length", 2048),
-        dtype=None, # Let unsloth decide
-        load_in_4bit=_get(unsloth_settings, "load_in_4bit", False),
-    )
-    model = model.to("cuda")
+    with stage("train.model_load"):
+        model, tokenizer = FastModel.from_pretrained(
+            model_name=model_name,
+            max_seq_length=_get(unsloth_settings, "max_seq_length", 2048),
+            dtype=None, # Let unsloth decide
+            load_in_4bit=_get(unsloth_settings, "load_in_4bit", False),
+        )
+        model = model.to("cuda")
 
     # ---- 2. Apply PEFT ----
     peft_config = _get_in(cfg, ["method", "peft"], {})
@@ -48,7 +50,8 @@ def train(cfg, output_dir: str):
     if not dataset_repo:
         raise ValueError("data.repo not defined in config")
 
-    dataset = load_dataset(dataset_repo, split="train")
+    with stage("data.load"):
+        dataset = load_dataset(dataset_repo, split="train")
 
     system_prompt = _get_in(cfg, ["templating", "prompts", "system_prompt"], "")
 
@@ -104,5 +107,8 @@ def train(cfg, output_dir: str):
         response_part="<|im_start|>assistant\n",
     )
 
-    trainer.train()
-    trainer.save_model(f"{str(output_dir).rstrip('/')}/adapter/")
+    with stage("train.fit") as st:  # items = optimizer steps
+        trainer.train()
+        st.items = trainer.state.global_step
+    with stage("train.save"):
+        trainer.save_model(f"{str(output_dir).rstrip('/')}/adapter/")
@@ -20,13 +20,15 @@ def load_config(use_case: str):
 
     cfg = load_yaml(cfg_path)
 
-    # Resolve nested configs relative to the main config file's directory
+    # Resolve nested configs relative to the main config file's directory,
+    # or to the use-case directory (e.g. "configs/models/model.yaml")
     cfg_dir = cfg_path.parent
     for k in ["model", "method"]:
         p = cfg.get(k)
         if isinstance(p, str):
-            nested_path = cfg_dir / p
-            if nested_path.exists():
-                cfg[k] = load_yaml(nested_path)
+            for nested_path in (cfg_dir / p, cfg_dir.parent / p):
+                if nested_path.exists():
+                    cfg[k] = load_yaml(nested_path)
+                    break
 
     return _to_ns(cfg)
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+_CHUNK = 1 << 20
+DEFAULT_MEMO_PATH = "artifacts/digests.json"
+
+_memo: Optional[dict] = None
+_memo_lock = threading.Lock()
+
+
+def _memo_path() -> Path:
+    return Path(os.environ.get("SLMLAB_DIGEST_MEMO", DEFAULT_MEMO_PATH))
+
+
+def _read_memo() -> dict:
+    try:
+        return json.loads(_memo_path().read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def memo_get(key: str):
+    """A value stored by `memo_put`, in this or an earlier process ($SLMLAB_DIGEST_MEMO or artifacts/digests.json)."""
+    global _memo
+    with _memo_lock:
+        if _memo is None:
+            _memo = _read_memo()
+        return _memo.get(key)
+
+
+def memo_put(key: str, value):
+    """Persists `value` under `key`; a read-only location only keeps it for this process."""
+    global _memo
+    with _memo_lock:
+        _memo = {**_read_memo(), **(_memo or {}), key: value}
+        path = _memo_path()
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(_memo))
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+
+def file_digest(path: str | Path) -> str:
+    """
+    Content hash of a file. Files in the Hugging Face cache are symlinks to
+    blobs named after their own hash, so those are not re-read; other files
+    are hashed once per (path, size, mtime) and memoized.
+    """
+    p = Path(path)
+    if p.is_symlink() and p.resolve().parent.name == "blobs":
+        return p.resolve().name
+    st = p.stat()
+    key = f"file:{p.resolve()}"
+    hit = memo_get(key)
+    if hit and hit[:2] == [st.st_size, st.st_mtime_ns]:
+        return hit[2]
+    h = hashlib.sha256()
+    with open(p, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            h.update(chunk)
+    memo_put(key, [st.st_size, st.st_mtime_ns, h.hexdigest()])
+    return h.hexdigest()
+
+
+def files_fingerprint(paths: Iterable[str | Path], root: str | Path | None = None) -> str:
+    """Stable hash over (relative name, content digest) of the given files."""
+    return digests_fingerprint({os.path.relpath(p, root) if root else Path(p).name: file_digest(p) for p in paths})
+
+
+def digests_fingerprint(digests: Dict[str, str]) -> str:
+    """Stable hash over (name, digest) pairs whose digests are already known, e.g. from hub metadata."""
+    h = hashlib.sha256()
+    for name in sorted(digests):
+        h.update(name.encode("utf-8"))
+        h.update(digests[name].encode("ascii"))
+    return h.hexdigest()
+
+
+def dir_fingerprint(path: str | Path, patterns: List[str]) -> str:
+    """Fingerprint of every file under `path` matching one of the glob patterns."""
+    root = Path(path)
+    files = {p for pat in patterns for p in root.glob(pat) if p.is_file()}
+    if not files:
+        raise FileNotFoundError(f"No files matching {patterns} under {root}")
+    return files_fingerprint(files, root=root)
+
+
+def text_fingerprint(*parts) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(repr(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
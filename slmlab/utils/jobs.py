@@ -0,0 +1,140 @@
+import os
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Make targets behind each job kind
+JOB_TARGETS = {"prep": "prep", "train": "train", "eval": "golden"}
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    use_case: str
+    cmd: List[str]
+    log_path: Path
+    status: str = QUEUED
+    returncode: Optional[int] = None
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    _proc: Optional[subprocess.Popen] = field(default=None, repr=False)
+    _cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED, CANCELLED)
+
+    def summary(self) -> dict:
+        end = self.finished or time.time()
+        return {"id": self.id, "kind": self.kind, "use_case": self.use_case, "status": self.status,
+                "returncode": self.returncode,
+                "elapsed_s": round(end - self.started, 1) if self.started else None}
+
+
+class JobManager:
+    """
+    Runs use-case commands (`make prep|train|golden`) as background
+    subprocesses, at most `max_concurrent` at a time; extra jobs wait queued.
+    Output goes straight from the child to a log file, which callers tail by
+    byte offset with `read_log`, so nothing is buffered or re-sent in memory.
+    """
+
+    def __init__(self, max_concurrent: Optional[int] = None, log_dir: str | Path = "runs/jobs"):
+        self.max_concurrent = max_concurrent or int(os.environ.get("SLMLAB_MAX_JOBS", 2))
+        self.log_dir = Path(log_dir)
+        self._slots = threading.Semaphore(self.max_concurrent)
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, use_case: str, cmd: Optional[List[str]] = None) -> Job:
+        if cmd is None:
+            if kind not in JOB_TARGETS:
+                raise ValueError(f"Unknown job kind: {kind} (expected one of {sorted(JOB_TARGETS)})")
+            cmd = ["make", JOB_TARGETS[kind], f"USE_CASE={use_case}"]
+        job_id = uuid.uuid4().hex[:8]
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        job = Job(job_id, kind, use_case, cmd, self.log_dir / f"{job_id}-{kind}-{use_case}.log")
+        job.log_path.touch()
+        with self._lock:
+            self._jobs[job_id] = job
+        threading.Thread(target=self._run, args=(job,), daemon=True, name=f"slmlab-job-{job_id}").start()
+        return job
+
+    def _run(self, job: Job):
+        with self._slots:
+            if job._cancel.is_set():
+                job.status, job.finished = CANCELLED, time.time()
+                return
+            with open(job.log_path, "ab", buffering=0) as log:
+                job._proc = subprocess.Popen(job.cmd, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                             env={**os.environ, "PYTHONUNBUFFERED": "1"},  # lines show up as printed
+                                             start_new_session=True)  # own process group, see cancel()
+                job.status, job.started = RUNNING, time.time()
+                if job._cancel.is_set():  # cancelled while starting
+                    os.killpg(job._proc.pid, signal.SIGTERM)
+                job.returncode = job._proc.wait()
+            job.finished = time.time()
+            if job._cancel.is_set():
+                job.status = CANCELLED
+            else:
+                job.status = SUCCEEDED if job.returncode == 0 else FAILED
+
+    def cancel(self, job_id: str, grace_s: float = 10.0) -> bool:
+        """Stops a queued or running job; `make` and everything it spawned get SIGTERM, then SIGKILL."""
+        job = self.get(job_id)
+        if job is None or job.done:
+            return False
+        job._cancel.set()
+        proc = job._proc
+        if proc is not None and proc.poll() is None:
+            os.killpg(proc.pid, signal.SIGTERM)
+            try:
+                proc.wait(grace_s)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+        return True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        """All jobs of this manager, newest first."""
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created, reverse=True)
+
+    def read_log(self, job_id: str, offset: int = 0, max_bytes: int = 1 << 20) -> Tuple[str, int]:
+        """
+        New log text from byte `offset`, ending at the last complete line
+        (unless the job is done), and the offset to pass next time.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return "", offset
+        with open(job.log_path, "rb") as f:
+            f.seek(offset)
+            data = f.read(max_bytes)
+        if not job.done:
+            cut = data.rfind(b"\n") + 1
+            if cut or len(data) < max_bytes:  # a line longer than max_bytes is returned in pieces
+                data = data[:cut]
+        return data.decode("utf-8", errors="replace"), offset + len(data)
+
+
+_manager: Optional[JobManager] = None
+
+
+def get_job_manager() -> JobManager:
+    global _manager
+    if _manager is None:
+        _manager = JobManager()
+    return _manager
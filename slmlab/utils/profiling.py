@@ -0,0 +1,213 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover
+    psutil = None
+
+_SAMPLE_EVERY_S = 0.05
+
+
+def _rss() -> int:
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return _max_rss()
+
+
+def _max_rss() -> int:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _cpu() -> float:
+    """CPU seconds of this process and of its finished children (e.g. Pool workers)."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class _PeakSampler(threading.Thread):
+    """Polls RSS in the background; the process-wide high-water mark can't be reset per stage."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = _rss()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(_SAMPLE_EVERY_S):
+            self.peak = max(self.peak, _rss())
+
+    def stop(self) -> int:
+        self._done.set()
+        self.join()
+        return max(self.peak, _rss())
+
+
+@dataclass
+class StageRecord:
+    name: str
+    depth: int = 0
+    start_s: float = 0.0  # offset from the start of the run
+    calls: int = 1
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    peak_rss_mb: Optional[float] = None
+    items: Optional[int] = None
+    items_per_s: Optional[float] = None
+    extra: Dict = field(default_factory=dict)
+
+
+class Stage:
+    """Handle yielded by `Profiler.stage`; set `items` (and `extra`) while the stage runs."""
+
+    def __init__(self, items: Optional[int] = None):
+        self.items = items
+        self.extra: Dict = {}
+
+
+class Profiler:
+    """
+    Records wall time, CPU time, peak RSS and items/sec per named stage.
+    Stages listed in `profile_stages` (or all, with "all") are also run under
+    cProfile; their stats are dumped next to profile.json.
+    """
+
+    def __init__(self, profile_stages: Optional[List[str]] = None):
+        self.records: List[StageRecord] = []
+        self.profile_stages = set(profile_stages or [])
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self._depth = 0
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def _profiled(self, name: str) -> bool:
+        return "all" in self.profile_stages or name in self.profile_stages
+
+    @contextmanager
+    def stage(self, name: str, items: Optional[int] = None):
+        handle = Stage(items)
+        sampler = _PeakSampler()
+        sampler.start()
+        prof = cProfile.Profile() if self._profiled(name) and sys.getprofile() is None else None
+        depth = self._depth
+        self._depth += 1
+        wall, cpu = time.perf_counter(), _cpu()
+        start = wall - self._start
+        if prof is not None:
+            prof.enable()
+        try:
+            yield handle
+        finally:
+            if prof is not None:
+                prof.disable()
+                self.profiles[name] = prof
+            wall, cpu = time.perf_counter() - wall, _cpu() - cpu
+            self._depth = depth
+            peak = sampler.stop()
+            self._record(StageRecord(
+                name=name, depth=depth, start_s=round(start, 4), wall_s=round(wall, 4), cpu_s=round(cpu, 4),
+                peak_rss_mb=round(peak / 2**20, 1), items=handle.items,
+                items_per_s=round(handle.items / wall, 2) if handle.items and wall > 0 else None,
+                extra=handle.extra,
+            ))
+            logger.info(f"stage {name}: {wall:.2f}s wall, {cpu:.2f}s cpu, peak RSS {peak / 2**20:.0f} MiB"
+                        + (f", {handle.items / wall:.1f} items/s" if handle.items and wall > 0 else ""))
+
+    def add(self, name: str, wall_s: float):
+        """Accumulates a stage timed elsewhere (e.g. from Trainer callbacks) into one record."""
+        with self._lock:
+            for r in self.records:
+                if r.name == name:
+                    r.calls += 1
+                    r.wall_s = round(r.wall_s + wall_s, 4)
+                    return
+            self.records.append(StageRecord(name=name, depth=self._depth,
+                                            start_s=round(time.perf_counter() - self._start - wall_s, 4),
+                                            wall_s=round(wall_s, 4)))
+
+    def _record(self, rec: StageRecord):
+        with self._lock:
+            self.records.append(rec)
+
+    def summary(self) -> dict:
+        return {
+            "total_wall_s": round(time.perf_counter() - self._start, 4),
+            "peak_rss_mb": round(_max_rss() / 2**20, 1),
+            "stages": [asdict(r) for r in sorted(self.records, key=lambda r: r.start_s)],
+        }
+
+    def write(self, out_dir: str | Path) -> Path:
+        """Writes profile.json (and one .prof + .txt per cProfiled stage) under `out_dir`."""
+        out = Path(out_dir)
+        out.mkdir(parents=True, exist_ok=True)
+        for name, prof in self.profiles.items():
+            safe = name.replace("/", "_")
+            prof.dump_stats(str(out / f"profile_{safe}.prof"))
+            buf = io.StringIO()
+            pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(40)
+            (out / f"profile_{safe}.txt").write_text(buf.getvalue())
+        path = out / "profile.json"
+        path.write_text(json.dumps(self.summary(), indent=2))
+        logger.info(f"stage profile saved to {path}")
+        return path
+
+
+# ---- process-wide run profiler, so library code can mark stages without plumbing ----
+
+_current: Optional[Profiler] = None
+
+
+def start_run(profile_stages: Optional[List[str]] = None) -> Profiler:
+    """
+    Starts a fresh run-level profiler. Stages to cProfile come from the
+    argument or from $SLMLAB_PROFILE (comma-separated names, or "all").
+    """
+    global _current
+    if profile_stages is None:
+        env = os.environ.get("SLMLAB_PROFILE", "")
+        profile_stages = [s.strip() for s in env.split(",") if s.strip()]
+    _current = Profiler(profile_stages)
+    return _current
+
+
+@contextmanager
+def profile_run(out_dir: str | Path, profile: Optional[str] = None):
+    """
+    Profiles a CLI run: starts a fresh profiler and writes profile.json to
+    `out_dir` when the run ends, also when it fails. `profile` lists the
+    stages to cProfile (comma-separated, or "all").
+    """
+    stages = [s.strip() for s in profile.split(",") if s.strip()] if profile else None
+    profiler = start_run(stages)
+    try:
+        yield profiler
+    finally:
+        profiler.write(out_dir)
+
+
+def get_profiler() -> Profiler:
+    global _current
+    if _current is None:
+        _current = Profiler()
+    return _current
+
+
+def stage(name: str, items: Optional[int] = None):
+    """`with stage("tokenize", items=n) as s:` on the current run profiler."""
+    return get_profiler().stage(name, items)
@@ -0,0 +1,88 @@
+import random
+
+import numpy as np
+import pytest
+
+from slmlab.prep.dedup import EMPTY, MinHasher, MinHashIndex, normalize, shingle_hashes
+
+_WORDS = ["histoire", "roman", "paris", "gallimard", "poésie", "édition", "tome", "siècle", "france", "auteur",
+          "traduction", "revue", "musique", "science", "voyage", "guerre", "enfance", "théâtre", "lettres", "art"]
+
+
+def _records(n, seed=0):
+    rng = random.Random(seed)
+    return [f"Title: {' '.join(rng.choices(_WORDS, k=8))}\nAuthor: {rng.randint(1000, 9999)}\n"
+            f"Publisher: {' '.join(rng.choices(_WORDS, k=6))}, {rng.randint(1800, 2024)}" for _ in range(n)]
+
+
+def _near(text):
+    # case, punctuation and a short suffix: still well above the threshold
+    return text.upper().replace(":", " -", 1) + " (2e éd.)"
+
+
+def test_normalize():
+    assert normalize("  Le   Roman,\tde PARIS! ") == "le roman de paris"
+
+
+def test_empty_texts_have_no_shingles():
+    assert len(shingle_hashes(" ,;! ", 5)) == 0
+    sigs = MinHasher(num_perm=16).signatures(["", "abc def", "..."])
+    assert (sigs[0] == EMPTY).all() and (sigs[2] == EMPTY).all()
+    assert not (sigs[1] == EMPTY).all()
+
+
+def test_signature_similarity_estimates_jaccard():
+    hasher = MinHasher(num_perm=256)
+    a, b = _records(2)
+    sa, sb, sa2 = hasher.signatures([a, b, _near(a)])
+    ja, jb = set(shingle_hashes(a, 5).tolist()), set(shingle_hashes(b, 5).tolist())
+    assert abs((sa == sb).mean() - len(ja & jb) / len(ja | jb)) < 0.15
+    assert (sa == sa2).mean() > 0.85
+
+
+def test_index_finds_near_duplicates(tmp_path):
+    base = _records(300)
+    dups = {len(base) + i: j for i, j in enumerate(range(0, 300, 7))}  # row -> the base row it copies
+    texts = base + [_near(base[j]) for j in dups.values()]
+    keys = [f"k{i}" for i in range(len(texts))]
+    index = MinHashIndex(tmp_path / "index")
+    reps, _ = index.add(keys, [False] * len(texts), texts=texts)
+
+    assert {i: int(reps[i]) for i in dups} == dups  # document ids are the kept rows' positions here
+    assert (reps[:len(base)] == -1).all()
+    assert index.report(len(texts))["duplicates"] == len(dups)
+
+
+def test_index_keeps_every_document_of_a_bucket(tmp_path):
+    # the same text under several keys: each later copy is a duplicate of the first
+    texts = _records(3)
+    texts = texts + texts + texts
+    reps, _ = MinHashIndex(tmp_path / "index").add([f"k{i}" for i in range(9)], [False] * 9, texts=texts)
+    assert reps.tolist() == [-1, -1, -1, 0, 1, 2, 0, 1, 2]
+
+
+def test_empty_texts_are_kept(tmp_path):
+    reps, _ = MinHashIndex(tmp_path / "index").add(["a", "b", "c"], [False] * 3, texts=["", "!!", ""])
+    assert reps.tolist() == [-1, -1, -1]
+
+
+def test_incremental_build_keeps_verdicts_and_splits(tmp_path):
+    base = _records(50)
+    index = MinHashIndex(tmp_path / "index")
+    reps, is_eval = index.add([f"k{i}" for i in range(50)], [i % 2 == 0 for i in range(50)], texts=base)
+    index.save()
+
+    index = MinHashIndex(tmp_path / "index")
+    assert index.size == 50
+    keys = ["k3", "new-dup", "new"]
+    reps2, is_eval2 = index.add(keys, [True, True, False], texts=[base[3], _near(base[4]), _records(1, seed=9)[0]])
+    assert reps2.tolist() == [-1, 4, -1]
+    assert is_eval2[0] is False  # a known row keeps its split
+
+
+def test_similar_rows_share_a_split(tmp_path):
+    index = MinHashIndex(tmp_path / "index", threshold=0.99, split_threshold=0.5)
+    a = _records(1)[0]
+    reps, is_eval = index.add(["a", "b"], [True, False], texts=[a, _near(a)])
+    assert reps.tolist() == [-1, -1]  # under the drop threshold...
+    assert is_eval == [True, True]  # ...but kept on the same side
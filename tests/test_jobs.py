@@ -0,0 +1,61 @@
+import sys
+import time
+
+import pytest
+
+from slmlab.utils.jobs import CANCELLED, SUCCEEDED, JobManager
+
+
+def _wait(predicate, timeout=10.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def _job(manager, code):
+    return manager.submit("prep", "test", cmd=[sys.executable, "-c", code])
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return JobManager(max_concurrent=2, log_dir=tmp_path)
+
+
+def test_read_log_offsets_of_a_finished_job(manager):
+    job = _job(manager, "print('one'); print('twö'); print('three', end='')")
+    _wait(lambda: job.done)
+    assert job.status == SUCCEEDED
+
+    text, offset = manager.read_log(job.id)
+    assert text == "one\ntwö\nthree"
+    assert offset == len(text.encode("utf-8")) == job.log_path.stat().st_size
+    assert manager.read_log(job.id, offset) == ("", offset)
+
+    first, offset = manager.read_log(job.id, 0, max_bytes=6)
+    rest, end = manager.read_log(job.id, offset)
+    assert (first, offset) == ("one\ntw", 6)
+    assert first + rest == text and end == len(text.encode("utf-8"))
+
+
+def test_read_log_of_a_running_job_stops_at_the_last_complete_line(manager):
+    job = _job(manager, "import sys, time\n"
+                        "print('line 1')\n"
+                        "sys.stdout.write('partial'); sys.stdout.flush()\n"
+                        "time.sleep(60)")
+    _wait(lambda: job.log_path.stat().st_size == len("line 1\npartial"))
+
+    text, offset = manager.read_log(job.id)
+    assert (text, offset) == ("line 1\n", 7)
+    assert manager.read_log(job.id, offset) == ("", offset)  # the partial line waits
+    # a line longer than max_bytes comes in pieces rather than never
+    assert manager.read_log(job.id, offset, max_bytes=4) == ("part", 11)
+
+    assert manager.cancel(job.id, grace_s=5)
+    _wait(lambda: job.done)
+    assert job.status == CANCELLED
+    assert manager.read_log(job.id, offset) == ("partial", 14)
+
+
+def test_read_log_of_an_unknown_job(manager):
+    assert manager.read_log("nope", 5) == ("", 5)
@@ -0,0 +1,20 @@
+import pytest
+
+from slmlab.serve.launcher import cpu_slices
+
+
+@pytest.mark.parametrize("n_workers, cpus, expected", [
+    (1, [0, 1, 2, 3], [[0, 1, 2, 3]]),
+    (2, [0, 1, 2, 3], [[0, 1], [2, 3]]),
+    (3, [0, 1, 2, 3, 4, 5, 6], [[0, 1], [2, 3], [4, 5]]),  # the remainder stays unused
+    (2, [7, 3, 5, 1], [[1, 3], [5, 7]]),  # sorted, contiguous slices
+    (4, [0, 1, 2, 3], [[0], [1], [2], [3]]),
+    (5, [0, 1, 2], [[0], [1], [2], [0], [1]]),  # more workers than CPUs: shared round-robin
+])
+def test_cpu_slices(n_workers, cpus, expected):
+    assert cpu_slices(n_workers, cpus) == expected
+
+
+def test_cpu_slices_default_to_usable_cpus():
+    slices = cpu_slices(1)
+    assert len(slices) == 1 and slices[0] == sorted(slices[0]) and slices[0]
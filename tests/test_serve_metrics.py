@@ -0,0 +1,78 @@
+from slmlab.serve.metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+
+def test_counter_render():
+    registry = MetricsRegistry()
+    c = registry.register(Counter("slmlab_requests_total", "Requests.", ["endpoint", "status"]))
+    c.inc(endpoint="/generate", status="ok")
+    c.inc(2, endpoint="/generate", status="ok")
+    c.inc(endpoint="/generate", status="error")
+    assert registry.render() == (
+        "# HELP slmlab_requests_total Requests.\n"
+        "# TYPE slmlab_requests_total counter\n"
+        'slmlab_requests_total{endpoint="/generate",status="error"} 1\n'
+        'slmlab_requests_total{endpoint="/generate",status="ok"} 3\n'
+    )
+
+
+def test_label_values_are_escaped():
+    c = Counter("c_total", "C.", ["model"])
+    c.inc(model='a\\b "c"\nd')
+    assert c.render()[-1] == 'c_total{model="a\\\\b \\"c\\"\\nd"} 1'
+
+
+def test_histogram_buckets_are_cumulative_and_upper_inclusive():
+    h = Histogram("lat_seconds", "Latency.", buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.observe(v)
+    assert h.render() == [
+        "# HELP lat_seconds Latency.",
+        "# TYPE lat_seconds histogram",
+        'lat_seconds_bucket{le="0.1"} 2',
+        'lat_seconds_bucket{le="1"} 3',
+        'lat_seconds_bucket{le="+Inf"} 4',
+        "lat_seconds_sum 3.65",
+        "lat_seconds_count 4",
+    ]
+
+
+def test_labelled_histogram():
+    h = Histogram("ttft_seconds", "TTFT.", ["endpoint"], buckets=(1,))
+    h.observe(2, endpoint="/b")
+    h.observe(0.5, endpoint="/a")
+    assert h.render()[2:] == [
+        'ttft_seconds_bucket{endpoint="/a",le="1"} 1',
+        'ttft_seconds_bucket{endpoint="/a",le="+Inf"} 1',
+        'ttft_seconds_sum{endpoint="/a"} 0.5',
+        'ttft_seconds_count{endpoint="/a"} 1',
+        'ttft_seconds_bucket{endpoint="/b",le="1"} 0',
+        'ttft_seconds_bucket{endpoint="/b",le="+Inf"} 1',
+        'ttft_seconds_sum{endpoint="/b"} 2',
+        'ttft_seconds_count{endpoint="/b"} 1',
+    ]
+
+
+def test_gauges():
+    g = Gauge("tokens_per_second", "Throughput.")
+    assert g.render() == ["# HELP tokens_per_second Throughput.", "# TYPE tokens_per_second gauge"]
+    g.set(12.5)
+    assert g.render()[-1] == "tokens_per_second 12.5"
+    assert Gauge("depth", "Depth.", fn=lambda: 3).render()[-1] == "depth 3"
+    assert Gauge("rss", "RSS.", fn=lambda: None).render()[2:] == []  # unknown: no sample
+    loaded = Gauge("load_seconds", "Load.", ["model"], fn=lambda: {("b",): 2.0, ("a",): 0.25})
+    assert loaded.render()[2:] == ['load_seconds{model="a"} 0.25', 'load_seconds{model="b"} 2']
+
+
+def test_const_labels_are_read_at_each_scrape():
+    worker = {}
+    registry = MetricsRegistry(const_labels=lambda: dict(worker))
+    registry.register(Counter("c_total", "C.", ["endpoint"])).inc(endpoint="/x")
+    registry.register(Histogram("h", "H.", buckets=(1,))).observe(1)
+    assert 'c_total{endpoint="/x"} 1' in registry.render().splitlines()
+
+    worker["worker"] = "2"
+    lines = registry.render().splitlines()
+    assert 'c_total{worker="2",endpoint="/x"} 1' in lines
+    assert 'h_bucket{worker="2",le="1"} 1' in lines
+    assert 'h_count{worker="2"} 1' in lines
+    assert all("worker" in line for line in lines if not line.startswith("#"))
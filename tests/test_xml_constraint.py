@@ -0,0 +1,70 @@
+import pytest
+
+from slmlab.inference.xml_constraint import XmlState
+
+
+def _accepts(text, chunks=None):
+    state = XmlState()
+    return all(state.feed(c) for c in (chunks or [text])) and state.done
+
+
+@pytest.mark.parametrize("doc", [
+    "<record/>",
+    "<record></record>",
+    '<?xml version="1.0" encoding="UTF-8"?>\n<record><leader>x</leader></record>',
+    "  \n<record>\n  <datafield tag='200' ind1=\" \"><subfield code=\"a\">Titre &amp; sous-titre</subfield></datafield>\n</record >",
+    "<record><a b='&lt;&#233;&#xE9;'/></record>",
+    "<r:ns x.y-z='1'>é 漢字 🙂</r:ns>",
+])
+def test_accepts_well_formed(doc):
+    assert _accepts(doc)
+    assert _accepts(doc, list(doc))  # one character at a time
+
+
+@pytest.mark.parametrize("doc", [
+    "text<record/>",  # text before the root
+    "<record></recrod>",  # mismatched close
+    "<record><a></record>",  # unclosed child
+    "<record a='1' a='2'/>",  # duplicate attribute
+    "<record a=1/>",  # unquoted value
+    "<record a='<'/>",
+    "<record>&nbsp;</record>",  # undefined entity
+    "<record>&#x;</record>",
+    "<record><!-- c --></record>",  # comments are refused
+    "<record/><record/>",  # a second root
+    "<record/>x",
+    "<1record/>",
+    "</record>",
+])
+def test_rejects_malformed(doc):
+    assert not _accepts(doc)
+
+
+def test_not_done_until_root_closed():
+    state = XmlState()
+    assert state.feed("<record><a/>")
+    assert not state.done
+    assert state.feed("</record>")
+    assert state.done
+
+
+def test_copy_is_independent():
+    state = XmlState()
+    state.feed("<record><a>")
+    fork = state.copy()
+    assert fork.feed("</a></record>") and fork.done
+    assert not state.feed("</record>")
+
+
+def test_feed_bytes_waits_for_split_characters():
+    data = "<r a='é'>漢🙂</r>".encode("utf-8")
+    state = XmlState()
+    assert all(state.feed_bytes(data[i:i + 1]) for i in range(len(data)))
+    assert state.done and state.pending == b""
+
+
+def test_feed_bytes_rejects_invalid_utf8_and_partial_characters_in_names():
+    assert not XmlState().feed_bytes(b"<r>\xff</r>")
+    state = XmlState()
+    assert state.feed_bytes(b"<r>")
+    assert not state.feed_bytes(b"</r\xc3")  # an incomplete character where a name goes
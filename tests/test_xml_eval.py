@@ -0,0 +1,88 @@
+from xml.etree import ElementTree as ET
+
+import pytest
+
+from slmlab.eval.xml_eval import (ReferenceSet, coverage_against_ref, extract_field_pairs, score_xml,
+                                  xml_is_well_formed)
+
+
+# The helpers score_xml replaced, as they were before the single-parse engine
+def _old_well_formed(s):
+    try:
+        ET.fromstring(s)
+        return True
+    except Exception:
+        return False
+
+
+def _old_pairs(s):
+    try:
+        root = ET.fromstring(s)
+    except Exception:
+        return []
+    return [(df.get("tag", ""), sf.get("code", "")) for df in root.findall("datafield") for sf in df.findall("subfield")]
+
+
+def _old_coverage(pred, ref):
+    ref_pairs = set(_old_pairs(ref))
+    if not ref_pairs:
+        return 0.0
+    return len(ref_pairs & set(_old_pairs(pred))) / len(ref_pairs)
+
+
+def _record(*fields):
+    body = "".join(f'<datafield tag="{tag}" ind1=" " ind2=" ">'
+                   + "".join(f'<subfield code="{c}">v&amp;{c}</subfield>' for c in codes) + "</datafield>"
+                   for tag, codes in fields)
+    return f"<record>{body}</record>"
+
+
+REF = _record(("200", "ae"), ("210", "acd"), ("700", "ab"))
+PREDS = [
+    REF,
+    _record(("200", "a"), ("210", "acd"), ("701", "ab")),
+    _record(("200", "ae"), ("200", "a"), ("215", "a")),  # repeated pair
+    '<?xml version="1.0" encoding="UTF-8"?>\n' + _record(("700", "ab")),
+    "<record><datafield tag='200'><subfield code='a'>x</subfield></record>",  # mismatched tag
+    "<record><datafield tag='200'>&nbsp;</datafield></record>",  # undefined entity
+    "some text <record/>",
+    "",
+    "<record/>",
+    "<record><controlfield tag='001'>1</controlfield></record>",
+    _record(("200", "é"), ("210", "ä")),
+]
+
+
+@pytest.mark.parametrize("doc", PREDS + [REF])
+def test_single_document_helpers_match_old(doc):
+    assert xml_is_well_formed(doc) == _old_well_formed(doc)
+    assert extract_field_pairs(doc) == _old_pairs(doc)
+    assert coverage_against_ref(doc, REF) == _old_coverage(doc, REF)
+    assert coverage_against_ref(REF, doc) == _old_coverage(REF, doc)
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_score_xml_matches_old_helpers(processes):
+    refs = [REF] * (len(PREDS) - 1) + ["<record/>"]  # the last reference has no pairs
+    scores = score_xml(PREDS, ReferenceSet(refs, processes=processes), processes=processes)
+    assert scores["xml_valid_rate"] == pytest.approx(sum(map(_old_well_formed, PREDS)) / len(PREDS))
+    assert scores["xml_coverage"] == pytest.approx(sum(_old_coverage(p, r) for p, r in zip(PREDS, refs)) / len(PREDS))
+
+
+def test_score_xml_precision_recall():
+    ref = _record(("200", "ae"), ("700", "ab"))
+    pred = _record(("200", "a"), ("700", "ab"), ("801", "a"))
+    scores = score_xml([pred], ReferenceSet([ref]))
+    # tp: 200a, 700a, 700b; fp: 801a; fn: 200e
+    assert scores["xml_precision"] == pytest.approx(3 / 4)
+    assert scores["xml_recall"] == pytest.approx(3 / 4)
+    assert scores["xml_per_tag"]["200"] == {"precision": 1.0, "recall": 0.5, "f1": pytest.approx(2 / 3), "support": 2}
+    assert scores["xml_per_tag"]["801"]["precision"] == 0.0
+    assert scores["xml_per_tag"]["801"]["support"] == 0
+
+
+def test_score_xml_empty():
+    scores = score_xml([], ReferenceSet([]))
+    assert scores["xml_valid_rate"] == 0.0
+    assert scores["xml_coverage"] == 0.0
+    assert scores["xml_per_tag"] == {}
@@ -11,6 +11,9 @@ make prep USE_CASE=$USE_CASE || true
 echo "[train] quick LoRA run…"
 python -m cli.finetune run $USE_CASE
 
+echo "[eval] golden tests on the tuned adapter…"
+python -m cli.evaluate golden $USE_CASE
+
 echo "[eval] comparing baseline vs tuned…"
 # Note: The evaluate script would also need to be adapted to be use-case aware
 # For now, this is a placeholder